@@ -1,6 +1,21 @@
+from collections import Counter
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from ...services.supabase import approve_payment as sb_approve_payment
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List
+from uuid import UUID
+from ...core.config import get_settings
+from ...services.availability import get_availability_store, payment_approved
+from ...services.payments import forget_payments, lookup_payments_by_reference
+from ...services.profiler import get_profiler
+from ...services.raffles import invalidate_raffle, invalidate_top_buyers
+from ...services.supabase import (
+    SupabaseUnavailable,
+    approve_payment as sb_approve_payment,
+    approve_payments as sb_approve_payments,
+    reject_payments as sb_reject_payments,
+)
+from ...services.verify import invalidate_payment, invalidate_payments
 
 
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -14,7 +29,137 @@ class ApprovePaymentBody(BaseModel):
 @router.post("/approve-payment")
 async def approve_payment(body: ApprovePaymentBody):
     try:
-        data = sb_approve_payment(payment_id=body.payment_id, approved_by=body.approved_by)
+        data = await sb_approve_payment(payment_id=body.payment_id, approved_by=body.approved_by)
+        invalidate_payment(body.payment_id)
+        forget_payments([body.payment_id])
+        invalidate_top_buyers()
+        await payment_approved(body.payment_id)
         return {"ok": True, "result": data}
+    except SupabaseUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+class BulkApproveBody(BaseModel):
+    payment_ids: List[UUID] = Field(min_length=1, max_length=1000)
+    approved_by: str
+
+
+class BulkRejectBody(BaseModel):
+    payment_ids: List[UUID] = Field(min_length=1, max_length=1000)
+    rejected_by: str
+
+
+def _bulk_response(rows: List[Dict[str, Any]], done: str) -> Dict[str, Any]:
+    """Invalida caches de los pagos que cambiaron y arma la respuesta por pago."""
+    changed = [r["payment_id"] for r in rows if r.get("outcome") == done]
+    invalidate_payments(changed)
+    forget_payments(changed)
+    if changed:
+        invalidate_top_buyers()
+    return {
+        "ok": True,
+        "counts": dict(Counter(r.get("outcome") for r in rows)),
+        "results": rows,
+    }
+
+
+@router.post("/approve-payments")
+async def approve_payments(body: BulkApproveBody):
+    """Aprueba varios pagos en una llamada (approve_payments). Cada pago trae su
+    ``outcome``: approved, already_approved, not_found o invalid_status."""
+    try:
+        rows = await sb_approve_payments([str(p) for p in body.payment_ids], approved_by=body.approved_by)
+    except SupabaseUnavailable:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    get_availability_store().on_sold(t for r in rows if r.get("outcome") == "approved" for t in r.get("ticket_ids") or [])
+    return _bulk_response(rows, "approved")
+
+
+@router.post("/reject-payments")
+async def reject_payments(body: BulkRejectBody):
+    """Rechaza varios pagos y libera sus tickets (reject_payments). ``outcome``:
+    rejected, already_rejected, not_found o invalid_status."""
+    try:
+        rows = await sb_reject_payments([str(p) for p in body.payment_ids], rejected_by=body.rejected_by)
+    except SupabaseUnavailable:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    get_availability_store().on_released(t for r in rows if r.get("outcome") == "rejected" for t in r.get("ticket_ids") or [])
+    return _bulk_response(rows, "rejected")
+
+
+class PaymentsByReferenceBody(BaseModel):
+    references: List[str] = Field(min_length=1, max_length=5000)
+    fresh: bool = False
+
+
+@router.post("/payments/by-reference")
+async def payments_by_reference(body: PaymentsByReferenceBody):
+    """Pagos (id, status) de muchas referencias a la vez, para conciliar con el
+    proveedor. Sale del cache de referencias salvo ``fresh``; lo que falta se
+    consulta en lotes (requiere patch_payments_reference_index.sql para no
+    recorrer payments)."""
+    try:
+        found = await lookup_payments_by_reference(body.references, fresh=body.fresh)
+    except SupabaseUnavailable:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    missing = [ref for ref in dict.fromkeys(body.references) if ref not in found]
+    return {"ok": True, "payments": found, "missing": missing}
+
+
+@router.post("/raffles/{raffle_id}/invalidate-cache")
+async def invalidate_raffle_cache(raffle_id: str):
+    """Descarta los metadatos cacheados de la rifa tras editarla (total_tickets, is_free)."""
+    invalidate_raffle(raffle_id)
+    return {"ok": True}
+
+
+class ProfilerBody(BaseModel):
+    interval_ms: float = Field(default=5.0, ge=1.0, le=1000.0)
+    duration: float = Field(default=30.0, gt=0)
+
+
+def _profiler_enabled() -> None:
+    if not get_settings().PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="profiler disabled (PROFILER_ENABLED)")
+
+
+@router.post("/profiler/start")
+async def profiler_start(body: ProfilerBody):
+    """Empieza a muestrear el event loop de este worker (ver ``pid``) por ``duration``
+    segundos. Tiene que ser ``async``: el profiler observa el hilo que lo inicia."""
+    _profiler_enabled()
+    profiler = get_profiler()
+    try:
+        profiler.start(interval=body.interval_ms / 1000.0, duration=body.duration)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"ok": True, **profiler.stats()}
+
+
+@router.post("/profiler/stop")
+async def profiler_stop():
+    _profiler_enabled()
+    profiler = get_profiler()
+    profiler.stop()
+    return {"ok": True, **profiler.stats()}
+
+
+@router.get("/profiler")
+def profiler_status():
+    _profiler_enabled()
+    return {"ok": True, **get_profiler().stats()}
+
+
+@router.get("/profiler/stacks", response_class=PlainTextResponse)
+def profiler_stacks(limit: int = 0):
+    """Pilas colapsadas (``func (archivo:línea);... muestras``) para flamegraph.pl o speedscope."""
+    _profiler_enabled()
+    return get_profiler().collapsed(limit)
@@ -0,0 +1,134 @@
+from fastapi import APIRouter, HTTPException
+import logging
+import httpx
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Tuple
+from ...services.admission import AdmissionRejected, get_admission
+from ...services.availability import get_availability_store
+from ...services.expiry import forget_released
+from ...services.rate import get_rate_cache
+from ...services.supabase import SupabaseUnavailable, get_supabase
+
+
+router = APIRouter(tags=["checkout"])
+
+logger = logging.getLogger("prizo.checkout")
+
+# Errores de checkout_for_session (patch_checkout.sql) -> status HTTP
+CHECKOUT_ERRORS = {
+    "raffle_not_found": 404,
+    "raffle_not_selling": 409,
+    "tickets_unavailable": 409,
+    "not_enough_tickets": 409,
+    "no_reserved_tickets": 409,
+    "free_raffle": 400,
+    "manual_selection_disabled": 400,
+    "below_min_purchase": 400,
+}
+
+
+class CheckoutBody(BaseModel):
+    raffle_id: str
+    session_id: str
+    # Uno de los dos; sin ninguno se pagan las reservas vigentes de la sesión
+    quantity: Optional[int] = Field(default=None, ge=1, le=1000)
+    ticket_ids: List[str] = Field(default_factory=list, max_length=1000)
+    minutes: Optional[int] = 10
+    email: str = Field(min_length=3, max_length=120)
+    phone: Optional[str] = None
+    city: Optional[str] = None
+    ci: Optional[str] = None
+    instagram: Optional[str] = None
+    method: Optional[str] = None
+    reference: Optional[str] = Field(default=None, max_length=80)
+    # La evidencia se sube antes directo a Cloudinary (/api/cloudinary/sign)
+    evidence_url: Optional[str] = None
+    # Monto acordado en el front (p. ej. con descuento por método); si falta se
+    # calcula en la base con la tasa del servidor
+    amount_ves: Optional[float] = None
+    currency: str = "VES"
+
+
+async def _server_rate() -> Tuple[Optional[float], Optional[str]]:
+    """Tasa del cache en memoria. Si todavía no hay ninguna (mirrors caídos desde el
+    arranque) el checkout no espera a los mirrors: sigue sin tasa, como el front."""
+    cache = get_rate_cache()
+    if cache.rate is None:
+        cache.trigger_refresh()
+        return None, None
+    info = await cache.get()
+    return (info["rate"], "bcv") if info else (None, None)
+
+
+def _checkout_error(e: httpx.HTTPStatusError) -> HTTPException:
+    status = e.response.status_code if e.response is not None else 500
+    message = ""
+    try:
+        message = str((e.response.json() or {}).get("message") or "")
+    except Exception:
+        pass
+    if message in CHECKOUT_ERRORS:
+        return HTTPException(status_code=CHECKOUT_ERRORS[message], detail=message)
+    detail = e.response.text if e.response is not None else str(e)
+    return HTTPException(status_code=502 if status >= 500 else status, detail=f"Supabase error {status}: {detail}")
+
+
+@router.post("/checkout")
+async def checkout(body: CheckoutBody) -> Any:
+    """Reserva y pago en una sola llamada (checkout_for_session, una transacción).
+
+    Reemplaza la cadena /reservations/* -> create_payment_for_session ->
+    /payments/set-ci: o queda el pago pendiente con sus tickets retenidos, o no queda
+    nada. Devuelve ``{ok, data: {payment_id, status, amount_ves, rate_used, tickets, ...}}``.
+    """
+    if body.quantity is not None and body.ticket_ids:
+        raise HTTPException(status_code=400, detail="use quantity or ticket_ids, not both")
+    admission = get_admission()
+    if admission is not None:
+        # Mismo ritmo por sesión que /reservations/*: un checkout también reserva
+        admission.throttle(body.session_id, "/checkout")
+    ci = body.ci.strip() if body.ci else None
+    rate, rate_source = await _server_rate()
+    payload: Dict[str, Any] = {
+        "p_raffle_id": body.raffle_id,
+        "p_session_id": body.session_id,
+        "p_quantity": body.quantity,
+        "p_ticket_ids": body.ticket_ids or None,
+        "p_minutes": body.minutes,
+        "p_email": body.email.strip(),
+        "p_phone": body.phone,
+        "p_city": body.city,
+        "p_ci": ci or None,
+        "p_instagram": body.instagram,
+        "p_method": body.method,
+        "p_reference": body.reference.strip() if body.reference else None,
+        "p_evidence_url": body.evidence_url,
+        "p_amount_ves": body.amount_ves,
+        "p_rate_used": rate,
+        "p_rate_source": rate_source,
+        "p_currency": body.currency,
+    }
+    try:
+        if admission is None:
+            data = await get_supabase().call_rpc("checkout_for_session", payload)
+        else:
+            # Reserva igual que /reservations/*: misma cola por rifa
+            async with admission.admit(body.raffle_id, body.session_id, "/checkout"):
+                data = await get_supabase().call_rpc("checkout_for_session", payload)
+    except httpx.HTTPStatusError as e:
+        raise _checkout_error(e)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Supabase request error: {str(e)}")
+    except (SupabaseUnavailable, AdmissionRejected):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    tickets = (data or {}).get("tickets") or []
+    logger.info("checkout: payment=%s raffle=%s tickets=%d", (data or {}).get("payment_id"), body.raffle_id, len(tickets))
+    # Los tickets quedan retenidos por el pago (sin vencimiento); el resto de las
+    # reservas de la sesión en la rifa se liberó
+    ids = [str(t["id"]) for t in tickets if t.get("id")]
+    forget_released(ids)
+    get_availability_store().on_reserved(tickets, body.session_id, replace_session=True)
+    return {"ok": True, "data": data}
@@ -1,7 +1,16 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
 import httpx
 from urllib.parse import urlparse
 from ...core.config import get_settings
+from ...services.admission import get_admission
+from ...services.availability import get_availability_store
+from ...services.cache import cache_stats, shared_cache_stats
+from ...services.counters import get_counters_drift_job
+from ...services.expiry import get_reservation_expiry
+from ...services.metrics import render as render_metrics
+from ...services.outbox import get_webhook_outbox
+from ...services.stream import get_stream_hub
 from ...services.supabase import get_supabase
 
 router = APIRouter()
@@ -12,14 +21,24 @@ def health():
     return {"ok": True}
 
 
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas de este proceso en formato de texto de Prometheus (latencia por ruta,
+    llamadas a Supabase, caches). Con varios workers cada uno expone las suyas.
+    ``async`` para armarlas en el event loop, que es el único que las modifica."""
+    if not get_settings().METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="metrics disabled (METRICS_ENABLED)")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @router.get("/health/db")
-def health_db():
+async def health_db():
     """Verifica conectividad con Supabase y acceso básico a la tabla raffles.
     Devuelve { ok: True, sample: {...} } o detalle del error.
     """
     try:
         sb = get_supabase()
-        sample = sb.get_many("raffles", {"limit": "1"}, select="id")
+        sample = await sb.get_many("raffles", {"limit": "1"}, select="id")
         return {"ok": True, "sample": sample}
     except httpx.HTTPStatusError as e:
         status = e.response.status_code if e.response is not None else 500
@@ -44,3 +63,57 @@ def health_env():
         host = None
     key_present = bool(getattr(s, "SUPABASE_SERVICE_KEY", None)) and len(s.SUPABASE_SERVICE_KEY) > 20
     return {"ok": True, "supabase_host": host, "service_key_present": bool(key_present)}
+
+
+@router.get("/health/supabase")
+async def health_supabase():
+    """Estado de la capa de resiliencia hacia Supabase (sin llamar a Supabase):
+    circuit breaker, presupuesto de reintentos y configuración de timeouts/hedging."""
+    return {"ok": True, **get_supabase().stats()}
+
+
+@router.get("/health/cache")
+async def health_cache():
+    """Contadores de los caches en proceso (hits, misses, cargas coalescidas, etc.) y
+    del nivel compartido entre workers, si está configurado. ``async`` como /metrics:
+    los canales del stream y los snapshots de disponibilidad cambian en el event loop."""
+    return {"ok": True, "caches": cache_stats(), "shared": shared_cache_stats(),
+            "availability": get_availability_store().stats(), "stream": get_stream_hub().stats()}
+
+
+@router.get("/health/expiry")
+async def health_expiry():
+    """Estado de la liberación de reservas vencidas (pendientes, lotes, desfase)."""
+    if not get_settings().RESERVATION_EXPIRY_ENABLED:
+        return {"ok": True, "enabled": False}
+    return {"ok": True, "enabled": True, **get_reservation_expiry().stats()}
+
+
+@router.get("/health/counters")
+async def health_counters():
+    """Corrección periódica de raffle_counters: pasadas, rifas revisadas y diferencias
+    corregidas (deberían ser 0)."""
+    if not get_settings().COUNTERS_DRIFT_ENABLED:
+        return {"ok": True, "enabled": False}
+    return {"ok": True, "enabled": True, **get_counters_drift_job().stats()}
+
+
+@router.get("/health/admission")
+async def health_admission():
+    """Admisión de reservas: llamadas en curso y cola por rifa, admitidas y rechazos
+    por motivo (queue_full, timeout, rate_limited). ``async``: recorre las colas por
+    rifa, que el event loop crea y borra con cada reserva."""
+    admission = get_admission()
+    if admission is None:
+        return {"ok": True, "enabled": False}
+    return {"ok": True, "enabled": True, **admission.stats()}
+
+
+@router.get("/health/webhooks")
+async def health_webhooks():
+    """Cola de webhooks de pago: profundidad, antigüedad del pendiente más viejo y
+    desfase entre recepción y aprobación."""
+    try:
+        return {"ok": True, **(await get_webhook_outbox().stats())}
+    except Exception as e:
+        return {"ok": False, "detail": str(e)}
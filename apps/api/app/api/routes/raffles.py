@@ -0,0 +1,130 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+import httpx
+import orjson
+from typing import Literal, Optional
+from ...core.config import get_settings
+from ...services.availability import CODES, get_availability_store
+from ...services.raffles import get_raffle_counters, get_top_buyers
+from ...services.stream import StreamLimitError, get_stream_hub
+
+
+router = APIRouter(prefix="/raffles", tags=["raffles"])
+
+
+def _supabase_error(e: httpx.HTTPError) -> HTTPException:
+    if isinstance(e, httpx.HTTPStatusError) and e.response is not None:
+        status = e.response.status_code
+        return HTTPException(status_code=502 if status >= 500 else status, detail=f"Supabase error {status}")
+    return HTTPException(status_code=502, detail=f"Supabase request error: {str(e)}")
+
+
+@router.get("/{raffle_id}/availability")
+async def raffle_availability(
+    raffle_id: str,
+    since: Optional[str] = Query(default=None, description="version de una respuesta anterior"),
+    encoding: Literal["rle", "bitmap"] = "rle",
+):
+    """Estado de todos los números de la rifa en forma compacta.
+
+    Sin ``since`` (o si la versión ya no sirve) devuelve el estado completo:
+    ``rle`` = [código, largo, ...] desde el número 1; ``bitmap`` = 2 bits por número en
+    base64. Con ``since`` devuelve solo ``changes`` = [[número, código], ...].
+    """
+    try:
+        snap = await get_availability_store().get(raffle_id)
+    except httpx.HTTPError as e:
+        raise _supabase_error(e)
+
+    out = {
+        "ok": True,
+        "raffle_id": raffle_id,
+        "version": snap.version,
+        "size": len(snap.codes),
+        "codes": CODES,
+    }
+    changes = snap.changes_since(since)
+    if changes is not None:
+        out.update({"counts": snap.counts(), "full": False, "changes": changes})
+        return out
+
+    def build() -> bytes:
+        out.update({"counts": snap.counts(), "full": True, "encoding": encoding, "data": snap.encode(encoding)})
+        return orjson.dumps(out)
+
+    # Estado completo serializado una vez por versión: lecturas repetidas no vuelven a codificar
+    return Response(snap.render(f"full:{encoding}", build), media_type="application/json")
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+@router.get("/{raffle_id}/top-buyers")
+async def raffle_top_buyers(
+    raffle_id: str,
+    limit: int = Query(default=20, ge=1, le=100),
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """Ranking de compradores de la rifa (mismas filas que top_buyers_for_raffle).
+
+    Cacheado en proceso y con ETag: si ``If-None-Match`` coincide responde 304 sin cuerpo.
+    """
+    try:
+        body, etag = await get_top_buyers(raffle_id, limit)
+    except httpx.HTTPError as e:
+        raise _supabase_error(e)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={get_settings().TOP_BUYERS_MAX_AGE}"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("/{raffle_id}/counters")
+async def raffle_counters(raffle_id: str, if_none_match: Optional[str] = Header(default=None)):
+    """Contadores de la rifa para barras de progreso (total_tickets, sold, reserved,
+    available), con las columnas de raffle_ticket_counters.
+
+    Cacheado en proceso COUNTERS_CACHE_TTL segundos y con ETag (304 si coincide).
+    """
+    try:
+        cached = await get_raffle_counters(raffle_id)
+    except httpx.HTTPError as e:
+        raise _supabase_error(e)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="raffle not found")
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={get_settings().COUNTERS_MAX_AGE}"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("/{raffle_id}/stream")
+async def raffle_stream(
+    raffle_id: str,
+    since: Optional[str] = Query(default=None, description="version ya conocida por el cliente"),
+    encoding: Literal["rle", "bitmap"] = "rle",
+    last_event_id: Optional[str] = Header(default=None),
+):
+    """Server-Sent Events con el estado de los números de la rifa.
+
+    Eventos: ``snapshot`` (estado completo, como /availability) y ``changes``
+    (``[[número, código], ...]`` agrupados cada STREAM_BATCH_INTERVAL). El ``id`` de
+    cada evento es la versión; al reconectar, EventSource envía Last-Event-ID y solo
+    se reciben los cambios pendientes.
+    """
+    try:
+        events = await get_stream_hub().subscribe(raffle_id, since or last_event_id, encoding)
+    except StreamLimitError:
+        raise HTTPException(status_code=503, detail="too many subscribers", headers={"Retry-After": "5"})
+    except httpx.HTTPError as e:
+        raise _supabase_error(e)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
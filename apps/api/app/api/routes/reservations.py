@@ -2,8 +2,12 @@ from fastapi import APIRouter, HTTPException
 import logging
 import httpx
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
-from ...services.supabase import get_supabase
+from typing import Any, Dict, List, Literal, Optional
+from ...services.admission import get_admission
+from ...services.availability import get_availability_store
+from ...services.expiry import forget_released, track_reserved
+from ...services.raffles import get_raffle_meta
+from ...services.supabase import SupabaseUnavailable, get_supabase
 
 
 router = APIRouter(prefix="/reservations", tags=["reservations"])
@@ -11,19 +15,10 @@ router = APIRouter(prefix="/reservations", tags=["reservations"])
 logger = logging.getLogger("prizo.reservations")
 
 
-class ReserveByIdsBody(BaseModel):
-    p_ticket_ids: List[str] = Field(default_factory=list)
-    p_session_id: str
-    p_minutes: Optional[int] = 10
-
-
-@router.post("/ids")
-def reserve_by_ids(body: ReserveByIdsBody) -> Any:
-    sb = get_supabase()
+async def _call_rpc(name: str, payload: Dict[str, Any]) -> Any:
+    """Invoca un RPC en el event loop (sin threadpool) y traduce errores a HTTPException."""
     try:
-        logger.info("reserve_by_ids called: raffle tickets=%d session=%s", len(body.p_ticket_ids), body.p_session_id)
-        data = sb.call_rpc("reserve_tickets", body.model_dump())
-        return {"ok": True, "data": data}
+        return await get_supabase().call_rpc(name, payload)
     except httpx.HTTPStatusError as e:
         # Propaga el estado real que devuelve Supabase y su cuerpo para facilitar el diagnóstico
         status = e.response.status_code if e.response is not None else 500
@@ -31,30 +26,62 @@ def reserve_by_ids(body: ReserveByIdsBody) -> Any:
         raise HTTPException(status_code=status, detail=f"Supabase error {status}: {detail}")
     except httpx.RequestError as e:
         raise HTTPException(status_code=502, detail=f"Supabase request error: {str(e)}")
+    except SupabaseUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _admitted_rpc(route: str, raffle_id: Optional[str], session_id: str, name: str, payload: Dict[str, Any]) -> Any:
+    """``_call_rpc`` pasando por la admisión de la rifa (ver services/admission.py):
+    ritmo de la sesión, luego turno en la cola de la rifa. Sin rifa conocida usa una
+    cola compartida. Puede lanzar ``AdmissionRejected`` (429)."""
+    admission = get_admission()
+    if admission is None:
+        return await _call_rpc(name, payload)
+    admission.throttle(session_id, route)
+    async with admission.admit(raffle_id or "", session_id, route):
+        return await _call_rpc(name, payload)
+
+
+def _reserved(rows: Any, session_id: str, minutes: Optional[int], replace_session: bool) -> None:
+    """Programa el vencimiento y actualiza el snapshot de disponibilidad."""
+    track_reserved(rows, minutes)
+    get_availability_store().on_reserved(rows, session_id, replace_session=replace_session)
+
+
+class ReserveByIdsBody(BaseModel):
+    p_ticket_ids: List[str] = Field(default_factory=list)
+    p_session_id: str
+    p_minutes: Optional[int] = 10
+
+
+@router.post("/ids")
+async def reserve_by_ids(body: ReserveByIdsBody) -> Any:
+    logger.info("reserve_by_ids called: raffle tickets=%d session=%s", len(body.p_ticket_ids), body.p_session_id)
+    raffle_id = get_availability_store().raffle_of(body.p_ticket_ids)
+    data = await _admitted_rpc("/reservations/ids", raffle_id, body.p_session_id, "reserve_tickets", body.model_dump())
+    # reserve_tickets libera las demás reservas de la sesión en esas rifas
+    _reserved(data, body.p_session_id, body.p_minutes, replace_session=True)
+    return {"ok": True, "data": data}
+
+
 class ReleaseBody(BaseModel):
     p_ticket_ids: List[str] = Field(default_factory=list)
     p_session_id: str
 
 
 @router.post("/release")
-def release_ids(body: ReleaseBody) -> Any:
-    sb = get_supabase()
-    try:
-        logger.info("release_ids called: tickets=%d session=%s", len(body.p_ticket_ids), body.p_session_id)
-        data = sb.call_rpc("release_tickets", body.model_dump())
-        return {"ok": True, "data": data}
-    except httpx.HTTPStatusError as e:
-        status = e.response.status_code if e.response is not None else 500
-        detail = e.response.text if e.response is not None else str(e)
-        raise HTTPException(status_code=status, detail=f"Supabase error {status}: {detail}")
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Supabase request error: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def release_ids(body: ReleaseBody) -> Any:
+    logger.info("release_ids called: tickets=%d session=%s", len(body.p_ticket_ids), body.p_session_id)
+    # Solo el ritmo de la sesión: una liberación no espera turno (reduce la contención)
+    admission = get_admission()
+    if admission is not None:
+        admission.throttle(body.p_session_id, "/reservations/release")
+    data = await _call_rpc("release_tickets", body.model_dump())
+    forget_released(body.p_ticket_ids)
+    get_availability_store().on_released(body.p_ticket_ids)
+    return {"ok": True, "data": data}
 
 
 class ReserveRandomBody(BaseModel):
@@ -66,41 +93,78 @@ class ReserveRandomBody(BaseModel):
 
 
 @router.post("/random")
-def reserve_random(body: ReserveRandomBody) -> Any:
-    sb = get_supabase()
+async def reserve_random(body: ReserveRandomBody) -> Any:
+    # Log the incoming body for debugging p_total / p_quantity behavior
+    payload = body.model_dump()
+    logger.info("reserve_random called: %s", payload)
+
+    # Fetch canonical raffle data and override p_total to avoid client-supplied
+    # incorrect totals that can cause ticket over-creation. Served from the
+    # in-process raffle cache, so a sale does not pay an extra round trip per request.
     try:
-        # Log the incoming body for debugging p_total / p_quantity behavior
-        original = None
-        try:
-            original = body.model_dump()
-            logger.info("reserve_random called: %s", original)
-        except Exception:
-            logger.info("reserve_random called (could not serialize body)")
-
-        # Fetch canonical raffle data and override p_total to avoid client-supplied
-        # incorrect totals that can cause ticket over-creation.
-        try:
-            raffle = sb.get_one('raffles', { 'id': f"eq.{body.p_raffle_id}" }, select='total_tickets,is_free')
-            if raffle is not None and 'total_tickets' in raffle:
-                used_total = raffle.get('total_tickets')
-                # Replace/ensure p_total in payload we send to the DB function
-                payload = body.model_dump()
-                payload['p_total'] = used_total
-                if original and original.get('p_total') is not None and original.get('p_total') != used_total:
-                    logger.warning('reserve_random: client p_total (%s) differs from raffle.total_tickets (%s) for raffle %s', original.get('p_total'), used_total, body.p_raffle_id)
-            else:
-                payload = body.model_dump()
-        except Exception as e:
-            logger.warning('reserve_random: could not fetch raffle canonical total: %s', str(e))
-            payload = body.model_dump()
-
-        data = sb.call_rpc("ensure_and_reserve_random_tickets", payload)
-        return {"ok": True, "data": data}
-    except httpx.HTTPStatusError as e:
-        status = e.response.status_code if e.response is not None else 500
-        detail = e.response.text if e.response is not None else str(e)
-        raise HTTPException(status_code=status, detail=f"Supabase error {status}: {detail}")
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Supabase request error: {str(e)}")
+        raffle = await get_raffle_meta(body.p_raffle_id)
+        if raffle is not None and 'total_tickets' in raffle:
+            used_total = raffle.get('total_tickets')
+            if body.p_total is not None and body.p_total != used_total:
+                logger.warning('reserve_random: client p_total (%s) differs from raffle.total_tickets (%s) for raffle %s', body.p_total, used_total, body.p_raffle_id)
+            # Replace/ensure p_total in payload we send to the DB function
+            payload['p_total'] = used_total
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.warning('reserve_random: could not fetch raffle canonical total: %s', str(e))
+
+    data = await _admitted_rpc("/reservations/random", body.p_raffle_id, body.p_session_id,
+                               "ensure_and_reserve_random_tickets", payload)
+    _reserved(data, body.p_session_id, body.p_minutes, replace_session=True)
+    return {"ok": True, "data": data}
+
+
+class BatchItem(BaseModel):
+    type: Literal["ids", "random"]
+    p_ticket_ids: List[str] = Field(default_factory=list)
+    p_raffle_id: Optional[str] = None
+    p_quantity: Optional[int] = None
+
+
+class ReserveBatchBody(BaseModel):
+    p_session_id: str
+    p_items: List[BatchItem] = Field(min_length=1, max_length=50)
+    p_minutes: Optional[int] = 10
+    # true: todo o nada; false: best-effort, cada ítem por separado
+    p_atomic: bool = False
+
+
+@router.post("/batch")
+async def reserve_batch(body: ReserveBatchBody) -> Any:
+    """Carrito con varias rifas / operaciones en un solo RPC (reserve_tickets_batch).
+
+    Devuelve un resultado por ítem; ``ok`` es false si algún ítem no se completó
+    (con ``p_atomic`` en ese caso no queda ninguna reserva)."""
+    items: List[Dict[str, Any]] = []
+    for i, item in enumerate(body.p_items):
+        if item.type == "ids":
+            if not item.p_ticket_ids:
+                raise HTTPException(status_code=400, detail=f"p_items[{i}]: p_ticket_ids is required")
+            items.append({"type": "ids", "ticket_ids": item.p_ticket_ids})
+        else:
+            if not item.p_raffle_id or not item.p_quantity or item.p_quantity < 1:
+                raise HTTPException(status_code=400, detail=f"p_items[{i}]: p_raffle_id and p_quantity >= 1 are required")
+            items.append({"type": "random", "raffle_id": item.p_raffle_id, "quantity": item.p_quantity})
+
+    logger.info("reserve_batch called: items=%d atomic=%s session=%s", len(items), body.p_atomic, body.p_session_id)
+    payload = {
+        "p_session_id": body.p_session_id,
+        "p_items": items,
+        "p_minutes": body.p_minutes,
+        "p_atomic": body.p_atomic,
+    }
+    # Un lote de una sola rifa usa la cola de esa rifa; uno mixto, la compartida
+    store = get_availability_store()
+    raffles = {item["raffle_id"] if item["type"] == "random" else store.raffle_of(item["ticket_ids"]) for item in items}
+    raffle_id = raffles.pop() if len(raffles) == 1 else None
+    data = await _admitted_rpc("/reservations/batch", raffle_id, body.p_session_id, "reserve_tickets_batch", payload)
+    # El lote es aditivo: no libera otras reservas de la sesión
+    _reserved(
+        [t for item in (data or {}).get("items") or [] for t in item.get("reserved") or []],
+        body.p_session_id, body.p_minutes, replace_session=False,
+    )
+    return {"ok": bool((data or {}).get("ok")), "data": data}
@@ -1,122 +1,108 @@
 from fastapi import APIRouter, HTTPException, Query
-from typing import Any, List, Dict
-from ...services.supabase import get_supabase
-import traceback
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
+import logging
+import orjson
+from ...core.config import get_settings
+from ...services.supabase import SupabaseUnavailable
+from ...services.verify import cached_lookup, cached_page, decode_cursor, encode_cursor, stream_lookup
 
 
 router = APIRouter(prefix="/verify", tags=["verify"])
 
+logger = logging.getLogger("prizo.verify")
+
 
 @router.get("")
-def verify_tickets(q: str = Query(..., min_length=2), include_pending: bool = True) -> Any:
+async def verify_tickets(
+    q: str = Query(..., min_length=2),
+    include_pending: bool = True,
+    limit: Optional[int] = Query(default=None, ge=1, description="filas por página (máximo VERIFY_PAGE_MAX)"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor de la página anterior"),
+    format: Literal["json", "ndjson"] = "json",
+) -> Any:
     """Busca tickets asociados a pagos por email o cédula (ci).
     Devuelve tickets reservados (si include_pending) y vendidos (aprobados).
+    Resultados cacheados unos segundos (VERIFY_CACHE_TTL); la ruta usada
+    (rpc/embedded/cache/coalesced) y los tiempos por etapa van en Server-Timing.
+
+    Con ``limit`` (o ``cursor``) devuelve una página y ``next_cursor``; con
+    ``format=ndjson``, todas las filas desde ``cursor`` en streaming, una por línea.
     """
-    sb = get_supabase()
-    try:
-        # 1) Primer intento: RPC (si está instalado)
+    if cursor:
         try:
-            data = sb.call_rpc(
-                "verify_tickets",
-                {"p_query": q, "p_include_pending": include_pending},
-            )
-            return {"ok": True, "data": data}
-        except Exception:
-            # continuar con fallback PostgREST sin romper la solicitud
-            pass
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+    if format == "ndjson":
+        return await _stream(q, include_pending, cursor)
+    try:
+        if limit is None and cursor is None:
+            data, trace = await cached_lookup(q, include_pending)
+            next_cursor = None
+        else:
+            page_max = get_settings().VERIFY_PAGE_MAX
+            data, next_cursor, trace = await cached_page(q, include_pending, min(limit or page_max, page_max), cursor)
+    except SupabaseUnavailable:
+        # Circuit breaker abierto: 503 con Retry-After (main.py), sin traza por solicitud
+        raise
+    except Exception:
+        # Log y respuesta 200 con data vacía para que el cliente no vea CORS espurio
+        logger.exception("verify failed: q=%r", q)
+        return {"ok": False, "data": [], "error": "internal_error"}
+    logger.info("verify q=%r rows=%d %s", q, len(data), trace.as_dict())
+    # Respuesta directa: las filas ya son JSON de PostgREST, sin pasar por jsonable_encoder
+    body: Dict[str, Any] = {"ok": True, "data": data}
+    if limit is not None or cursor is not None:
+        body["next_cursor"] = next_cursor
+    return ORJSONResponse(body, headers={"Server-Timing": trace.server_timing()})
 
-        # 2) Fallback: consulta embebida en PostgREST con service key (sin depender del RPC)
-        # Embedding: payment_tickets con joins a payments (inner) y tickets (y raffles desde tickets)
-        select = (
-            "payments!inner(id,email,ci,status,created_at),"
-            "tickets(id,ticket_number,status,raffle_id,raffles(name))"
-        )
-        # Filtro: por email o ci (ilike) y por estado approved o pending
-        term = f"*{q}*"
-        # Incluir estados en revisión/ampliados cuando include_pending=True
-        pending_set = "approved,pending,underpaid,overpaid,ref_mismatch" if include_pending else "approved"
-        params = {
-            "or": f"(payments.email.ilike.{term},payments.ci.ilike.{term})",
-            "payments.status": f"in.({pending_set})",
-        }
-        try:
-            rows: List[Dict[str, Any]] = sb.get_many("payment_tickets", params, select=select)
-        except Exception:
-            # Si falla (por ejemplo, columna ci no existe), reintentar solo con email
-            try:
-                params = {
-                    "payments.email": f"ilike.{term}",
-                    "payments.status": "in.(approved,pending,underpaid,overpaid,ref_mismatch)" if include_pending else "in.(approved)",
-                }
-                rows = sb.get_many("payment_tickets", params, select=select)
-            except Exception as e2:
-                try:
-                    print("[verify] fallback error:", str(e2))
-                    traceback.print_exc()
-                except Exception:
-                    pass
-                rows = []
 
-        # Súper fallback: si no hay resultados, buscamos primero payments y luego tickets por payment_id
-        if not rows:
-            try:
-                pending_set = "approved,pending,underpaid,overpaid,ref_mismatch" if include_pending else "approved"
-                pay_select = "id,email,ci,status,created_at"
-                pay_params = {
-                    "or": f"(email.ilike.{term},ci.ilike.{term})",
-                    "status": f"in.({pending_set})",
-                }
-                payments = sb.get_many("payments", pay_params, select=pay_select)
-                # Segundo intento: solo dígitos de la CI (cubrir "V-22321331" vs "22321331")
-                if not payments:
-                    only_digits = "".join(ch for ch in q if ch.isdigit())
-                    if len(only_digits) >= 4:
-                        dterm = f"*{only_digits}*"
-                        pay_params2 = {
-                            "ci": f"ilike.{dterm}",
-                            "status": f"in.({pending_set})",
-                        }
-                        payments = sb.get_many("payments", pay_params2, select=pay_select)
+async def _stream(q: str, include_pending: bool, cursor: Optional[str]) -> Any:
+    """NDJSON: cada página se envía apenas llega de Supabase y se suelta; en memoria
+    queda a lo sumo una página (y la siguiente en vuelo). CompressionMiddleware la
+    comprime trozo a trozo. La primera se pide antes de responder, así un error
+    temprano se informa como en el modo JSON."""
+    s = get_settings()
+    pages = stream_lookup(q, include_pending, s.VERIFY_STREAM_PAGE_SIZE, cursor, s.VERIFY_STREAM_PAGE_MAX)
+    try:
+        first: Optional[List[Dict[str, Any]]] = await pages.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except SupabaseUnavailable:
+        raise
+    except Exception:
+        logger.exception("verify stream failed: q=%r", q)
+        return {"ok": False, "data": [], "error": "internal_error"}
 
-                if payments:
-                    ids = [p.get("id") for p in payments if p.get("id")]
-                    if ids:
-                        id_list = ",".join(ids)
-                        pt_params = {"payment_id": f"in.({id_list})"}
-                        rows = sb.get_many("payment_tickets", pt_params, select=select)
-                try:
-                    print(f"[verify] q='{q}' payments_encontrados={len(payments) if 'payments' in locals() and payments else 0} tickets_encontrados={len(rows) if rows else 0}")
-                except Exception:
-                    pass
-            except Exception as e3:
+    async def body() -> AsyncIterator[bytes]:
+        rows, last, sent = first, None, 0
+        try:
+            while rows is not None:
+                yield b"".join(orjson.dumps(r) + b"\n" for r in rows)
+                last, sent = rows[-1], sent + len(rows)
                 try:
-                    print("[verify] super-fallback error:", str(e3))
-                    traceback.print_exc()
-                except Exception:
-                    pass
+                    rows = await pages.__anext__()
+                except StopAsyncIteration:
+                    rows = None
+        except Exception as e:
+            # Ya se envió el status 200: la última línea indica el error y desde dónde retomar
+            logger.exception("verify stream failed after %d rows: q=%r", sent, q)
+            error = "supabase_unavailable" if isinstance(e, SupabaseUnavailable) else "internal_error"
+            resume = encode_cursor(last) if last is not None else cursor
+            yield orjson.dumps({"ok": False, "error": error, "next_cursor": resume}) + b"\n"
+            return
+        finally:
+            await pages.aclose()
+        logger.info("verify stream q=%r rows=%d", q, sent)
 
-        # Adaptar forma de salida al contrato del RPC
-        out = []
-        for r in rows:
-            p = r.get("payments") or r.get("payment") or {}
-            t = r.get("tickets") or r.get("ticket") or {}
-            rf = (t.get("raffles") or {}).get("name") if isinstance(t.get("raffles"), dict) else None
-            out.append({
-                "raffle_id": t.get("raffle_id"),
-                "raffle_name": rf,
-                "ticket_id": t.get("id"),
-                "ticket_number": t.get("ticket_number"),
-                "ticket_status": t.get("status"),
-                "payment_id": p.get("id"),
-                "payment_status": p.get("status"),
-                "created_at": p.get("created_at"),
-            })
-        return {"ok": True, "data": out}
-    except Exception as e:
-        # Log y respuesta 200 con data vacía para que el cliente no vea CORS espurio
-        try:
-            print("[verify] error:", str(e))
-            traceback.print_exc()
-        except Exception:
-            pass
-        return {"ok": False, "data": [], "error": "internal_error"}
+    async def close() -> None:
+        await pages.aclose()
+
+    # Si el cliente se va antes de que empiece el cuerpo, body() nunca corre su finally:
+    # la tarea de fondo cierra igual las páginas (y la siguiente en vuelo); cerrar dos
+    # veces no hace nada. Va envuelto en un ``async def``: BackgroundTask manda al
+    # threadpool lo que no es una corutina, y pages.aclose es un método builtin
+    return StreamingResponse(body(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"},
+                             background=BackgroundTask(close))
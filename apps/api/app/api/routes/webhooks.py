@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-from ...services.supabase import approve_payment as sb_approve_payment, find_payment_by_reference
+from typing import Any, Dict
+from ...services.outbox import APPROVED_STATUSES, get_webhook_outbox
+from ...services.raffles import invalidate_raffle
 
 
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
@@ -14,21 +16,37 @@ class PaymentWebhook(BaseModel):
 
 @router.post("/payment")
 async def payment_webhook(payload: PaymentWebhook, request: Request):
+    """Acusa recibo en cuanto el webhook queda guardado en la cola local; la
+    aprobación la hace el worker de services/outbox.py. Reenvíos del mismo
+    (reference, status) responden ``duplicate`` sin volver a procesarse."""
     # TODO: validar firma del proveedor (según pasarela)
     if not payload.reference:
         raise HTTPException(status_code=400, detail="reference is required")
 
-    payment = find_payment_by_reference(payload.reference)
-    if not payment:
-        raise HTTPException(status_code=404, detail="payment not found")
-
-    provider_status = (payload.status or "").lower()
-    is_approved = provider_status in {"approved", "success", "paid"}
-
-    if is_approved:
-        try:
-            sb_approve_payment(payment_id=payment["id"], approved_by="webhook")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"approve failed: {e}")
-
-    return {"received": True, "processed": is_approved}
+    try:
+        inserted = await get_webhook_outbox().enqueue(
+            payload.reference, payload.status, payload.amount, payload.model_dump()
+        )
+    except Exception as e:
+        # Sin 2xx el proveedor reintenta más tarde
+        raise HTTPException(status_code=503, detail=f"webhook queue unavailable: {e}")
+
+    is_approved = (payload.status or "").strip().lower() in APPROVED_STATUSES
+    return {"received": True, "queued": inserted and is_approved, "duplicate": not inserted}
+
+
+class TableChangeWebhook(BaseModel):
+    """Payload de Database Webhooks de Supabase (INSERT/UPDATE/DELETE)."""
+    type: str | None = None
+    table: str | None = None
+    record: Dict[str, Any] | None = None
+    old_record: Dict[str, Any] | None = None
+
+
+@router.post("/raffle")
+async def raffle_changed(payload: TableChangeWebhook):
+    # Configurar en Supabase un Database Webhook sobre la tabla raffles apuntando aquí
+    row = payload.record or payload.old_record or {}
+    raffle_id = row.get("id")
+    invalidate_raffle(str(raffle_id) if raffle_id else None)
+    return {"received": True}
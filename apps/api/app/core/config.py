@@ -6,6 +6,117 @@ class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_SERVICE_KEY: str
 
+    # Pool HTTP compartido hacia Supabase (PostgREST). Un solo cliente por proceso,
+    # con keep-alive para no pagar TCP+TLS en cada RPC.
+    SUPABASE_POOL_SIZE: int = 50
+    SUPABASE_KEEPALIVE: int = 50
+    SUPABASE_KEEPALIVE_EXPIRY: float = 30.0
+    SUPABASE_HTTP2: bool = True
+    SUPABASE_TIMEOUT: float = 20.0
+
+    # Resiliencia hacia Supabase (ver SupabaseClient): timeout de lecturas, reintentos
+    # solo de lecturas dentro de un presupuesto (fracción del tráfico), circuit breaker
+    # por tasa de fallos y hedging opcional de lecturas tras el p95
+    SUPABASE_READ_TIMEOUT: float = 8.0
+    SUPABASE_READ_RETRIES: int = 2
+    SUPABASE_RETRY_BASE: float = 0.05
+    SUPABASE_RETRY_MAX: float = 1.0
+    SUPABASE_RETRY_BUDGET: float = 0.1
+    SUPABASE_BREAKER_ENABLED: bool = True
+    SUPABASE_BREAKER_THRESHOLD: float = 0.5
+    SUPABASE_BREAKER_MIN_CALLS: int = 20
+    SUPABASE_BREAKER_WINDOW: float = 10.0
+    SUPABASE_BREAKER_COOLDOWN: float = 5.0
+    SUPABASE_HEDGE: bool = False
+    SUPABASE_HEDGE_MIN_DELAY: float = 0.05
+
+    # Nivel compartido de los caches entre workers de un mismo host ("sqlite"; "none":
+    # solo en proceso) e intervalo con que cada worker aplica las invalidaciones de
+    # los demás (ver services/shared_cache.py)
+    CACHE_SHARED_BACKEND: str = "none"
+    CACHE_SHARED_PATH: str = "prizo_cache.sqlite3"
+    CACHE_INVALIDATION_POLL: float = 0.1
+
+    # Cache en proceso de metadatos de rifas (total_tickets, is_free)
+    RAFFLE_CACHE_TTL: float = 60.0
+    RAFFLE_CACHE_MAXSIZE: int = 1024
+
+    # Ranking GET /raffles/{id}/top-buyers: cache en proceso y max-age para navegadores/CDN
+    # (las revalidaciones con If-None-Match responden 304)
+    TOP_BUYERS_CACHE_TTL: float = 30.0
+    TOP_BUYERS_CACHE_MAXSIZE: int = 512
+    TOP_BUYERS_MAX_AGE: int = 10
+
+    # Contadores GET /raffles/{id}/counters (cambian con cada reserva: TTL corto) y
+    # corrección periódica de raffle_counters contra tickets en las rifas activas
+    COUNTERS_CACHE_TTL: float = 2.0
+    COUNTERS_CACHE_MAXSIZE: int = 1024
+    COUNTERS_MAX_AGE: int = 2
+    COUNTERS_DRIFT_ENABLED: bool = True
+    COUNTERS_DRIFT_INTERVAL: float = 600.0
+
+    # Admisión de las rutas que reservan (ver services/admission.py): llamadas a la vez
+    # por rifa y por proceso, cola justa entre sesiones con espera máxima (si no, 429)
+    # y ritmo por sesión (fichas por segundo, ráfaga) para reservar/liberar
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_RAFFLE_CONCURRENCY: int = 8
+    ADMISSION_QUEUE_SIZE: int = 64
+    ADMISSION_MAX_WAIT: float = 2.0
+    ADMISSION_SESSION_RATE: float = 2.0
+    ADMISSION_SESSION_BURST: float = 10.0
+    ADMISSION_MAX_SESSIONS: int = 50000
+
+    # Cache corto de resultados de /verify (consultas repetidas durante un sorteo)
+    VERIFY_CACHE_TTL: float = 10.0
+    VERIFY_CACHE_MAXSIZE: int = 2048
+    # /verify paginado (?limit=&cursor=) y en streaming (?format=ndjson)
+    VERIFY_PAGE_MAX: int = 1000
+    VERIFY_STREAM_PAGE_SIZE: int = 500
+    VERIFY_STREAM_PAGE_MAX: int = 2000
+
+    # Cache de pagos por referencia (cola de webhooks, conciliación)
+    PAYMENT_REF_CACHE_TTL: float = 300.0
+    PAYMENT_REF_CACHE_MAXSIZE: int = 10000
+
+    # Liberación de reservas vencidas desde la API (ver services/expiry.py);
+    # el job de pg_cron queda como respaldo
+    RESERVATION_EXPIRY_ENABLED: bool = True
+    RESERVATION_EXPIRY_BATCH: int = 500
+    RESERVATION_EXPIRY_GRACE: float = 1.0
+    RESERVATION_EXPIRY_RECONCILE_LIMIT: int = 10000
+
+    # Snapshot en proceso de disponibilidad por rifa (GET /raffles/{id}/availability)
+    AVAILABILITY_TTL: float = 30.0
+    AVAILABILITY_MAX_RAFFLES: int = 64
+    AVAILABILITY_MAX_CHANGES: int = 20000
+
+    # SSE /raffles/{id}/stream: ventana de agrupado de cambios, keep-alive y tope por proceso
+    STREAM_BATCH_INTERVAL: float = 0.2
+    STREAM_HEARTBEAT: float = 15.0
+    STREAM_MAX_SUBSCRIBERS: int = 5000
+
+    # Cola durable de webhooks de pago (SQLite en WAL) y su worker de aprobación
+    WEBHOOK_OUTBOX_PATH: str = "webhook_outbox.sqlite3"
+    WEBHOOK_BATCH: int = 50
+    WEBHOOK_CONCURRENCY: int = 8
+    WEBHOOK_MAX_ATTEMPTS: int = 10
+    WEBHOOK_RETRY_BASE: float = 2.0
+    WEBHOOK_RETRY_MAX: float = 300.0
+    WEBHOOK_RETENTION_DAYS: float = 7.0
+
+    # Compresión br/gzip de respuestas grandes (br requiere el paquete brotli). Calidad
+    # baja de brotli: para respuestas dinámicas rinde más que la máxima
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+
+    # Métricas de Prometheus en /metrics y profiler por muestreo (/admin/profiler),
+    # apagado salvo que se habilite
+    METRICS_ENABLED: bool = True
+    PROFILER_ENABLED: bool = False
+    PROFILER_MAX_SECONDS: float = 120.0
+
     # Pydantic v2: permitir variables extra en el entorno (p. ej., CLOUDINARY_*),
     # sin exigirlas ni fallar. Mantiene lectura desde .env.
     model_config = SettingsConfigDict(
@@ -1,5 +1,10 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
+import logging
+import math
 import os
 from .api.routes.health import router as health_router
 from .api.routes.admin import router as admin_router
@@ -9,10 +14,96 @@ from .api.routes.verify import router as verify_router
 from .api.routes.rate import router as rate_router
 from .api.routes.cloudinary import router as cloudinary_router
 from .api.routes.payments import router as payments_router
+from .api.routes.raffles import router as raffles_router
+from .api.routes.checkout import router as checkout_router
+from .core.config import get_settings
+from .services.admission import AdmissionRejected
+from .services.cache import attach_shared_tier
+from .services.compression import CompressionMiddleware
+from .services.counters import get_counters_drift_job
+from .services.expiry import get_reservation_expiry
+from .services.metrics import MetricsMiddleware
+from .services.outbox import get_webhook_outbox
+from .services.rate import get_rate_cache
+from .services.shared_cache import InvalidationListener, new_origin, open_tier
+from .services.supabase import SupabaseUnavailable, close_supabase, init_supabase
+from .services.verify import get_verify_engine
+
+
+logger = logging.getLogger("prizo.main")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un único cliente Supabase (pool HTTP compartido) para toda la vida del proceso.
+    # Si faltan variables de entorno no bloqueamos el arranque: /health sigue respondiendo
+    # y el error aparece al usar Supabase, como antes.
+    try:
+        init_supabase()
+    except Exception as e:
+        logger.warning("Supabase client not initialized at startup: %s", e)
+    # Caches compartidos entre workers e invalidaciones entre ellos (ver services/shared_cache.py)
+    tier = listener = None
+    try:
+        s = get_settings()
+        tier = open_tier(s.CACHE_SHARED_BACKEND, s.CACHE_SHARED_PATH)
+        if tier is not None:
+            origin = new_origin()
+            listener = InvalidationListener(tier, origin, interval=s.CACHE_INVALIDATION_POLL)
+            attach_shared_tier(tier, origin, listener)
+            listener.start()
+    except Exception as e:
+        logger.warning("Shared cache tier not started: %s", e)
+    # Tasa USD->VES: refresco periódico en segundo plano (ver services/rate.py)
+    rate_cache = get_rate_cache()
+    rate_cache.start()
+    # /verify: detectar una vez si existen el RPC y la columna ci (sin bloquear el arranque)
+    verify_probe = asyncio.ensure_future(get_verify_engine().warm())
+    # Vencimiento de reservas: carga las vigentes y las libera al vencer (ver services/expiry.py)
+    expiry = None
+    try:
+        if get_settings().RESERVATION_EXPIRY_ENABLED:
+            expiry = get_reservation_expiry()
+            expiry.start()
+    except Exception as e:
+        logger.warning("Reservation expiry not started: %s", e)
+    # Contadores por rifa: corrección periódica de raffle_counters (ver services/counters.py)
+    counters_job = None
+    try:
+        if get_settings().COUNTERS_DRIFT_ENABLED:
+            counters_job = get_counters_drift_job()
+            counters_job.start()
+    except Exception as e:
+        logger.warning("Counters drift job not started: %s", e)
+    # Webhooks de pago: cola local y worker que aprueba en lotes (ver services/outbox.py)
+    outbox = None
+    try:
+        outbox = get_webhook_outbox()
+        outbox.start()
+    except Exception as e:
+        logger.warning("Webhook outbox not started: %s", e)
+    try:
+        yield
+    finally:
+        verify_probe.cancel()
+        if outbox is not None:
+            await outbox.stop()
+        if counters_job is not None:
+            await counters_job.stop()
+        if expiry is not None:
+            await expiry.stop()
+        await rate_cache.stop()
+        if listener is not None:
+            await listener.stop()
+        if tier is not None:
+            attach_shared_tier(None)
+            tier.close()
+        await close_supabase()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Prizo API", version="0.2.0")
+    # orjson para serializar respuestas: bastante menos CPU que json en listas grandes
+    app = FastAPI(title="Prizo API", version="0.2.0", lifespan=lifespan, default_response_class=ORJSONResponse)
     # CORS: cuando allow_credentials=True no se puede usar "*".
     # Permitimos orígenes locales por defecto y soportamos FRONTEND_ORIGINS (separado por comas).
     raw_origins = os.getenv("FRONTEND_ORIGINS")
@@ -45,6 +136,42 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
         expose_headers=["*"],
     )
+    # br/gzip para respuestas grandes (/verify, /availability completo); los streams pasan tal cual
+    try:
+        s = get_settings()
+        compression = {
+            "min_size": s.COMPRESSION_MIN_SIZE,
+            "gzip_level": s.COMPRESSION_GZIP_LEVEL,
+            "brotli_quality": s.COMPRESSION_BROTLI_QUALITY,
+        } if s.COMPRESSION_ENABLED else None
+    except Exception:
+        compression = {}
+    if compression is not None:
+        app.add_middleware(CompressionMiddleware, **compression)
+    # Latencia, estado y solicitudes en curso por ruta (/metrics). Va por fuera de CORS
+    # para medir también los preflight
+    try:
+        metrics_enabled = get_settings().METRICS_ENABLED
+    except Exception:
+        metrics_enabled = True
+    if metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
+
+    # Circuit breaker abierto: 503 inmediato para que el cliente reintente más tarde
+    @app.exception_handler(SupabaseUnavailable)
+    async def supabase_unavailable(request: Request, exc: SupabaseUnavailable):
+        return JSONResponse(
+            status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+        )
+
+    # Admisión de reservas: cola de la rifa llena, espera agotada o sesión muy rápida
+    @app.exception_handler(AdmissionRejected)
+    async def admission_rejected(request: Request, exc: AdmissionRejected):
+        return JSONResponse(
+            status_code=429, content={"detail": str(exc), "reason": exc.reason},
+            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+        )
+
     app.include_router(health_router)
     app.include_router(admin_router)
     app.include_router(webhooks_router)
@@ -53,6 +180,8 @@ def create_app() -> FastAPI:
     app.include_router(rate_router)
     app.include_router(cloudinary_router)
     app.include_router(payments_router)
+    app.include_router(raffles_router)
+    app.include_router(checkout_router)
     return app
 
 
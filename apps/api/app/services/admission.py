@@ -0,0 +1,252 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from ..core.config import get_settings
+from .metrics import admission_rejections, admission_wait, register_collector
+
+
+class AdmissionRejected(Exception):
+    """La solicitud no entra: cola de la rifa llena, espera agotada o la sesión
+    superó su ritmo. main.py lo traduce a 429 con ``Retry-After``."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Too many requests ({reason}), retry in {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``rate`` fichas por segundo hasta ``burst``; cada operación gasta una."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """0 si hay ficha (y la gasta); si no, segundos hasta la próxima."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class _Lane:
+    """Estado de una rifa: llamadas en curso y quién espera, por sesión."""
+
+    __slots__ = ("active", "queued", "waiting")
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.queued = 0
+        # session_id -> futures en orden de llegada; el orden del dict es el turno
+        self.waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+
+class AdmissionController:
+    """Control de admisión de las rutas que reservan, por rifa y por sesión.
+
+    - Cada rifa deja pasar hasta ``concurrency`` llamadas a Supabase a la vez; con
+      más, la base solo agrega espera por locks sobre las mismas filas de tickets y
+      todos se vuelven lentos. El resto espera en una cola acotada (``queue_size``
+      por rifa) como máximo ``max_wait`` segundos; con la cola llena o la espera
+      agotada se responde 429 de inmediato, así la latencia de lo admitido no crece
+      con la sobrecarga.
+    - La cola es justa entre sesiones: los turnos se reparten en ronda entre las
+      sesiones que esperan (FIFO dentro de cada una), así un cliente que dispara
+      muchas solicitudes no desplaza a los demás.
+    - Cada sesión tiene un token bucket (``session_rate`` por segundo, ráfaga de
+      ``session_burst``) que frena los ciclos rápidos de reservar/liberar.
+
+    Es por proceso: con varios workers el límite efectivo por rifa es
+    ``concurrency`` x workers. Solo desde el event loop, sin locks.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 8,
+        queue_size: int = 64,
+        max_wait: float = 2.0,
+        session_rate: float = 2.0,
+        session_burst: float = 10.0,
+        max_sessions: int = 50000,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.max_sessions = max_sessions
+        self._lanes: Dict[str, _Lane] = {}
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Duración promedio (EWMA) de una llamada admitida, para estimar Retry-After
+        self._service_time = 0.05
+        self._stats = {"admitted": 0, "queued": 0, "queue_full": 0, "timeout": 0, "rate_limited": 0}
+
+    # --- ritmo por sesión ---
+
+    def throttle(self, session_id: str, route: str = "") -> None:
+        """Gasta una ficha de la sesión o lanza ``AdmissionRejected``."""
+        if self.session_rate <= 0 or not session_id:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(session_id)
+        if bucket is None:
+            bucket = self._buckets[session_id] = TokenBucket(self.session_rate, self.session_burst, now)
+            while len(self._buckets) > self.max_sessions:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(session_id)
+        wait = bucket.take(now)
+        if wait > 0:
+            self._reject("rate_limited", route, wait)
+
+    # --- concurrencia por rifa ---
+
+    @asynccontextmanager
+    async def admit(self, raffle_id: str, session_id: str, route: str = "") -> AsyncIterator[None]:
+        """Ocupa un lugar de la rifa mientras dura el bloque (espera su turno si hace falta)."""
+        lane = self._lanes.get(raffle_id)
+        if lane is None:
+            lane = self._lanes[raffle_id] = _Lane()
+        started = time.monotonic()
+        if lane.active < self.concurrency and not lane.queued:
+            lane.active += 1
+        else:
+            await self._wait(raffle_id, lane, session_id, route)
+        self._stats["admitted"] += 1
+        admission_wait.observe((route,), time.monotonic() - started)
+        began = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_time += 0.1 * (time.monotonic() - began - self._service_time)
+            self._release(raffle_id, lane)
+
+    async def _wait(self, raffle_id: str, lane: _Lane, session_id: str, route: str) -> None:
+        if lane.queued >= self.queue_size:
+            self._drop_if_idle(raffle_id, lane)
+            self._reject("queue_full", route, self._retry_after(lane))
+        fut = asyncio.get_running_loop().create_future()
+        waiters = lane.waiting.get(session_id)
+        if waiters is None:
+            waiters = lane.waiting[session_id] = deque()
+        waiters.append(fut)
+        lane.queued += 1
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(fut, self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # Se le pasó el turno justo al cortar: lo devuelve al siguiente
+                self._release(raffle_id, lane)
+            else:
+                self._forget(lane, session_id, fut)
+                self._drop_if_idle(raffle_id, lane)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("timeout", route, self._retry_after(lane))
+            raise
+
+    def _forget(self, lane: _Lane, session_id: str, fut: asyncio.Future) -> None:
+        waiters = lane.waiting.get(session_id)
+        if waiters is not None and fut in waiters:
+            waiters.remove(fut)
+            lane.queued -= 1
+            if not waiters:
+                del lane.waiting[session_id]
+
+    def _release(self, raffle_id: str, lane: _Lane) -> None:
+        """Libera un lugar y se lo pasa a la siguiente sesión en la ronda."""
+        lane.active -= 1
+        while lane.active < self.concurrency and lane.waiting:
+            session_id, waiters = lane.waiting.popitem(last=False)
+            fut = waiters.popleft()
+            lane.queued -= 1
+            if waiters:
+                # Al final de la ronda con lo que le queda
+                lane.waiting[session_id] = waiters
+            if not fut.done():
+                lane.active += 1
+                fut.set_result(None)
+        self._drop_if_idle(raffle_id, lane)
+
+    def _drop_if_idle(self, raffle_id: str, lane: _Lane) -> None:
+        if lane.active <= 0 and not lane.queued and self._lanes.get(raffle_id) is lane:
+            del self._lanes[raffle_id]
+
+    def _retry_after(self, lane: _Lane) -> float:
+        """Cuánto tardaría en vaciarse la cola actual de la rifa."""
+        return (lane.queued + 1) * self._service_time / self.concurrency
+
+    def _reject(self, reason: str, route: str, retry_after: float) -> None:
+        self._stats[reason] += 1
+        admission_rejections.inc((route, reason))
+        raise AdmissionRejected(reason, retry_after)
+
+    def totals(self) -> Tuple[int, int]:
+        """(llamadas en curso, solicitudes esperando) sumando todas las rifas."""
+        lanes = self._lanes.values()
+        return sum(lane.active for lane in lanes), sum(lane.queued for lane in lanes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "max_wait_seconds": self.max_wait,
+            "session_rate": self.session_rate,
+            "session_burst": self.session_burst,
+            "service_time_ms": round(self._service_time * 1000, 2),
+            "sessions_tracked": len(self._buckets),
+            "raffles": {
+                rid: {"active": lane.active, "queued": lane.queued, "sessions_waiting": len(lane.waiting)}
+                for rid, lane in self._lanes.items()
+            },
+            **self._stats,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission() -> Optional[AdmissionController]:
+    """None con ADMISSION_ENABLED=false: las rutas llaman directo, como antes."""
+    global _controller
+    if _controller is None:
+        s = get_settings()
+        if not s.ADMISSION_ENABLED:
+            return None
+        _controller = AdmissionController(
+            concurrency=s.ADMISSION_RAFFLE_CONCURRENCY,
+            queue_size=s.ADMISSION_QUEUE_SIZE,
+            max_wait=s.ADMISSION_MAX_WAIT,
+            session_rate=s.ADMISSION_SESSION_RATE,
+            session_burst=s.ADMISSION_SESSION_BURST,
+            max_sessions=s.ADMISSION_MAX_SESSIONS,
+        )
+    return _controller
+
+
+def _admission_metrics() -> List[str]:
+    if _controller is None:
+        return []
+    active, queued = _controller.totals()
+    return [
+        "# HELP prizo_admission_active Llamadas admitidas en curso (todas las rifas)",
+        "# TYPE prizo_admission_active gauge",
+        f"prizo_admission_active {active}",
+        "# HELP prizo_admission_queued Solicitudes esperando turno (todas las rifas)",
+        "# TYPE prizo_admission_queued gauge",
+        f"prizo_admission_queued {queued}",
+    ]
+
+
+register_collector(_admission_metrics)
@@ -0,0 +1,372 @@
+import asyncio
+import base64
+import logging
+import re
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from ..core.config import get_settings
+from .raffles import get_raffle_meta
+from .supabase import get_supabase, parse_timestamp
+
+
+logger = logging.getLogger("prizo.availability")
+
+# Un código por número de ticket (posición n-1). "unavailable" agrupa void/refunded.
+CODES = {"available": 0, "reserved": 1, "sold": 2, "unavailable": 3}
+AVAILABLE, RESERVED, SOLD, UNAVAILABLE = 0, 1, 2, 3
+
+SNAPSHOT_SELECT = "id,ticket_number,status,reserved_until,reserved_by"
+PAGE_SIZE = 1000
+PAGE_CONCURRENCY = 8
+
+_RUN = re.compile(rb"(.)\1*", re.S)
+
+
+def _code(row: Dict[str, Any], now: float) -> int:
+    status = row.get("status")
+    if status == "available":
+        return AVAILABLE
+    if status == "reserved":
+        # Igual que raffle_ticket_counters: una reserva vencida cuenta como disponible
+        until = row.get("reserved_until")
+        if until:
+            deadline = parse_timestamp(until)
+            if deadline is not None and deadline <= now:
+                return AVAILABLE
+        return RESERVED
+    if status == "sold":
+        return SOLD
+    return UNAVAILABLE
+
+
+def _number(row: Dict[str, Any]) -> Optional[int]:
+    try:
+        n = int(row.get("ticket_number"))
+    except (TypeError, ValueError):
+        return None
+    return n if n >= 1 else None
+
+
+class AvailabilitySnapshot:
+    """Estado de los números de una rifa en memoria, con versión y registro de cambios.
+
+    La versión es ``"<epoch>-<seq>"``: el epoch cambia con cada snapshot nuevo
+    (reinicio, otro worker, expulsión del cache), así un ``since`` ajeno devuelve
+    el estado completo en lugar de deltas incorrectos.
+    """
+
+    def __init__(self, raffle_id: str, max_changes: int = 20000):
+        self.raffle_id = raffle_id
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.codes = bytearray()
+        self.holders: Dict[int, str] = {}
+        self.ids: Dict[str, int] = {}
+        self.loaded_at = 0.0
+        self._changes: Deque[Tuple[int, int, int]] = deque(maxlen=max_changes)
+        # Mayor seq con algún cambio descartado del registro (total o parcialmente): un
+        # cliente anterior a ella necesita el estado completo
+        self._evicted_seq = 0
+        self._encoded: Dict[str, Tuple[int, Any]] = {}
+
+    @property
+    def version(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+    def apply(self, updates: Iterable[Tuple[int, int, Optional[str]]]) -> int:
+        """Aplica (número, código, sesión) y sube la versión una vez si algo cambió."""
+        changed: List[Tuple[int, int]] = []
+        for number, code, holder in updates:
+            if number > len(self.codes):
+                self.codes.extend(b"\x00" * (number - len(self.codes)))
+            if code == RESERVED and holder:
+                self.holders[number] = holder
+            else:
+                self.holders.pop(number, None)
+            if self.codes[number - 1] != code:
+                self.codes[number - 1] = code
+                changed.append((number, code))
+        if changed:
+            self.seq += 1
+            changes = self._changes
+            for number, code in changed:
+                if len(changes) == changes.maxlen:
+                    self._evicted_seq = changes[0][0]
+                changes.append((self.seq, number, code))
+        return len(changed)
+
+    def changed_numbers(self, since_seq: int) -> set:
+        return {number for s, number, _ in self._changes if s > since_seq}
+
+    def replace(self, codes: bytearray, holders: Dict[int, str], ids: Dict[str, int], keep: Optional[set] = None) -> int:
+        """Reemplaza el estado por uno recargado de la base registrando la diferencia
+        como cambios. ``keep``: números modificados por eventos durante la recarga, que
+        son más recientes que lo leído y se conservan."""
+        keep = keep or set()
+        for number in keep:
+            if number <= len(self.codes):
+                if number > len(codes):
+                    codes.extend(b"\x00" * (number - len(codes)))
+                codes[number - 1] = self.codes[number - 1]
+                if number in self.holders:
+                    holders[number] = self.holders[number]
+                else:
+                    holders.pop(number, None)
+        self.ids.update(ids)
+        size = max(len(codes), len(self.codes))
+        codes.extend(b"\x00" * (size - len(codes)))
+        updates = [(i + 1, codes[i], holders.get(i + 1)) for i in range(size)
+                   if i >= len(self.codes) or self.codes[i] != codes[i]]
+        n = self.apply(updates)
+        self.holders = dict(holders)
+        self.loaded_at = time.monotonic()
+        return n
+
+    def changes_since(self, since: Optional[str]) -> Optional[List[List[int]]]:
+        """Cambios [número, código] posteriores a ``since`` (el último por número), o
+        None si hay que enviar el estado completo (otro epoch o registro insuficiente)."""
+        if not since:
+            return None
+        epoch, _, raw_seq = since.partition("-")
+        if epoch != self.epoch or not raw_seq.isdigit():
+            return None
+        seq = int(raw_seq)
+        if seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        # Un apply más grande que el registro (p. ej. replace tras una recarga) pierde
+        # sus primeros cambios: el delta sería parcial aunque la seq siga en el registro
+        if not self._changes or seq < self._evicted_seq:
+            return None
+        latest: Dict[int, int] = {}
+        for s, number, code in reversed(self._changes):
+            if s <= seq:
+                break
+            latest.setdefault(number, code)
+        return [[n, c] for n, c in sorted(latest.items())]
+
+    def counts(self) -> Dict[str, int]:
+        return {name: self.codes.count(code) for name, code in CODES.items()}
+
+    def render(self, key: str, build: Callable[[], bytes]) -> bytes:
+        """Respuesta ya serializada para la versión actual (se reconstruye al cambiar)."""
+        cached = self._encoded.get(key)
+        if cached is None or cached[0] != self.seq:
+            cached = (self.seq, build())
+            self._encoded[key] = cached
+        return cached[1]
+
+    def encode(self, encoding: str) -> Any:
+        """``rle``: [código, largo, código, largo, ...]; ``bitmap``: 2 bits por número
+        (4 por byte, el número 1 en los bits bajos del primer byte), en base64."""
+        cached = self._encoded.get(encoding)
+        if cached is not None and cached[0] == self.seq:
+            return cached[1]
+        data = bytes(self.codes)
+        if encoding == "bitmap":
+            padded = data + b"\x00" * (-len(data) % 4)
+            packed = bytes(
+                a | (b << 2) | (c << 4) | (d << 6)
+                for a, b, c, d in zip(padded[0::4], padded[1::4], padded[2::4], padded[3::4])
+            )
+            value: Any = base64.b64encode(packed).decode("ascii")
+        else:
+            value = []
+            for m in _RUN.finditer(data):
+                value.append(m.group()[0])
+                value.append(m.end() - m.start())
+        self._encoded[encoding] = (self.seq, value)
+        return value
+
+
+class AvailabilityStore:
+    """Snapshots por rifa: carga única (single-flight) desde PostgREST, refresco en
+    segundo plano al superar ``ttl`` y actualización inmediata con los eventos de
+    la API (reservas, liberaciones, vencimientos, pagos aprobados)."""
+
+    def __init__(self, ttl: float = 30.0, max_raffles: int = 64, max_changes: int = 20000):
+        self.ttl = ttl
+        self.max_raffles = max_raffles
+        self.max_changes = max_changes
+        self._snapshots: "OrderedDict[str, AvailabilitySnapshot]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        # ticket_id -> (raffle_id, número), para eventos que solo traen ids
+        self._index: Dict[str, Tuple[str, int]] = {}
+
+    async def _fetch(self, raffle_id: str) -> Tuple[bytearray, Dict[int, str], Dict[str, int]]:
+        sb = get_supabase()
+        meta = await get_raffle_meta(raffle_id)
+        total = int((meta or {}).get("total_tickets") or 0)
+        codes = bytearray(total)
+        holders: Dict[int, str] = {}
+        ids: Dict[str, int] = {}
+        now = time.time()
+
+        async def page(i: int) -> List[Dict[str, Any]]:
+            params = {"raffle_id": f"eq.{raffle_id}", "order": "id.asc",
+                      "limit": str(PAGE_SIZE), "offset": str(i * PAGE_SIZE)}
+            return await sb.get_many("tickets", params, select=SNAPSHOT_SELECT)
+
+        first = 0
+        while True:
+            pages = await asyncio.gather(*(page(i) for i in range(first, first + PAGE_CONCURRENCY)))
+            for rows in pages:
+                for row in rows:
+                    number = _number(row)
+                    if number is None:
+                        continue
+                    if number > len(codes):
+                        codes.extend(b"\x00" * (number - len(codes)))
+                    code = _code(row, now)
+                    codes[number - 1] = code
+                    ids[str(row["id"])] = number
+                    if code == RESERVED and row.get("reserved_by"):
+                        holders[number] = str(row["reserved_by"])
+            if any(len(rows) < PAGE_SIZE for rows in pages):
+                break
+            first += PAGE_CONCURRENCY
+        return codes, holders, ids
+
+    async def _load(self, raffle_id: str) -> AvailabilitySnapshot:
+        try:
+            current = self._snapshots.get(raffle_id)
+            started_seq = current.seq if current is not None else 0
+            codes, holders, ids = await self._fetch(raffle_id)
+            snap = self._snapshots.get(raffle_id)
+            keep = snap.changed_numbers(started_seq) if snap is not None and snap is current else set()
+            if snap is None:
+                snap = AvailabilitySnapshot(raffle_id, self.max_changes)
+                self._snapshots[raffle_id] = snap
+                while len(self._snapshots) > self.max_raffles:
+                    _, evicted = self._snapshots.popitem(last=False)
+                    for tid in evicted.ids:
+                        self._index.pop(tid, None)
+            changed = snap.replace(codes, holders, ids, keep)
+            for tid, number in ids.items():
+                self._index[tid] = (raffle_id, number)
+            if changed:
+                logger.info("availability %s reloaded: %d changes -> %s", raffle_id, changed, snap.version)
+            return snap
+        finally:
+            self._loading.pop(raffle_id, None)
+
+    def refresh(self, raffle_id: str) -> asyncio.Task:
+        """Recarga el snapshot desde la base (single-flight)."""
+        task = self._loading.get(raffle_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(raffle_id))
+            self._loading[raffle_id] = task
+        return task
+
+    def peek(self, raffle_id: str) -> Optional[AvailabilitySnapshot]:
+        """Snapshot actual sin cargarlo ni recargarlo."""
+        snap = self._snapshots.get(raffle_id)
+        if snap is not None:
+            self._snapshots.move_to_end(raffle_id)
+        return snap
+
+    async def get(self, raffle_id: str) -> AvailabilitySnapshot:
+        snap = self._snapshots.get(raffle_id)
+        if snap is None:
+            return await asyncio.shield(self.refresh(raffle_id))
+        self._snapshots.move_to_end(raffle_id)
+        if time.monotonic() - snap.loaded_at > self.ttl:
+            # stale-while-revalidate: se sirve el snapshot y se recarga detrás
+            self.refresh(raffle_id)
+        return snap
+
+    # --- eventos ---
+
+    def on_reserved(self, rows: Iterable[Dict[str, Any]], session_id: Optional[str] = None, replace_session: bool = False) -> None:
+        """Tickets reservados por una sesión. Con ``replace_session`` se emula que el
+        RPC liberó las demás reservas de la sesión en esas rifas (reserve_tickets,
+        ensure_and_reserve_random_tickets)."""
+        by_raffle: Dict[str, List[Tuple[int, int, Optional[str]]]] = {}
+        for row in rows or []:
+            if not isinstance(row, dict):
+                continue
+            raffle_id, number = str(row.get("raffle_id") or ""), _number(row)
+            if not raffle_id or number is None:
+                continue
+            holder = str(row.get("reserved_by") or session_id or "") or None
+            by_raffle.setdefault(raffle_id, []).append((number, RESERVED, holder))
+            snap = self._snapshots.get(raffle_id)
+            if row.get("id") and snap is not None:
+                # Tickets nuevos (rifas gratis) también entran al índice
+                snap.ids[str(row["id"])] = number
+                self._index[str(row["id"])] = (raffle_id, number)
+        for raffle_id, updates in by_raffle.items():
+            snap = self._snapshots.get(raffle_id)
+            if snap is None:
+                continue
+            if replace_session and session_id:
+                keep = {n for n, _, _ in updates}
+                updates = [(n, AVAILABLE, None) for n, h in snap.holders.items() if h == session_id and n not in keep] + updates
+            snap.apply(updates)
+
+    def raffle_of(self, ticket_ids: Iterable[str]) -> Optional[str]:
+        """Rifa de los tickets según el índice (la del primero conocido), o None."""
+        for tid in ticket_ids:
+            ref = self._index.get(str(tid))
+            if ref is not None:
+                return ref[0]
+        return None
+
+    def on_released(self, ticket_ids: Iterable[str]) -> None:
+        self._set_by_ids(ticket_ids, AVAILABLE)
+
+    def on_sold(self, ticket_ids: Iterable[str]) -> None:
+        self._set_by_ids(ticket_ids, SOLD)
+
+    def _set_by_ids(self, ticket_ids: Iterable[str], code: int) -> None:
+        by_raffle: Dict[str, List[Tuple[int, int, Optional[str]]]] = {}
+        for tid in ticket_ids:
+            ref = self._index.get(str(tid))
+            if ref is not None:
+                by_raffle.setdefault(ref[0], []).append((ref[1], code, None))
+        for raffle_id, updates in by_raffle.items():
+            snap = self._snapshots.get(raffle_id)
+            if snap is not None:
+                snap.apply(updates)
+
+    async def on_payment_approved(self, payment_id: str) -> None:
+        """Marca como vendidos los tickets del pago (una consulta a payment_tickets)."""
+        if not self._snapshots:
+            return
+        rows = await get_supabase().get_many("payment_tickets", {"payment_id": f"eq.{payment_id}"}, select="ticket_id")
+        self.on_sold([r.get("ticket_id") for r in rows or [] if r.get("ticket_id")])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "raffles": len(self._snapshots),
+            "indexed_tickets": len(self._index),
+            "snapshots": {
+                rid: {"version": s.version, "size": len(s.codes), "age_seconds": round(time.monotonic() - s.loaded_at, 3)}
+                for rid, s in self._snapshots.items()
+            },
+        }
+
+
+_store: Optional[AvailabilityStore] = None
+
+
+def get_availability_store() -> AvailabilityStore:
+    global _store
+    if _store is None:
+        s = get_settings()
+        _store = AvailabilityStore(ttl=s.AVAILABILITY_TTL, max_raffles=s.AVAILABILITY_MAX_RAFFLES,
+                                   max_changes=s.AVAILABILITY_MAX_CHANGES)
+    return _store
+
+
+async def payment_approved(payment_id: str) -> None:
+    """Hook tras aprobar un pago; un fallo aquí no afecta la aprobación (el snapshot
+    se corrige en la siguiente recarga)."""
+    try:
+        await get_availability_store().on_payment_approved(payment_id)
+    except Exception as e:
+        logger.warning("availability update after approving %s failed: %s", payment_id, e)
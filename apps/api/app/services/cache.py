@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import orjson
+
+from .shared_cache import InvalidationListener, SharedTier, decode_key, encode_key
+
+
+logger = logging.getLogger("prizo.cache")
+
+_MISSING = object()
+
+# Registro de caches por nombre para exponer contadores (/health/cache)
+_registry: Dict[str, "TTLCache"] = {}
+
+# Nivel compartido entre workers (ver shared_cache.py); None: solo en proceso
+_shared: Optional[SharedTier] = None
+_origin = ""
+_listener: Optional[InvalidationListener] = None
+
+Predicate = Callable[[Hashable, Any], bool]
+# (clave, valor) -> etiquetas de la entrada para una regla (ver add_rule)
+Tagger = Callable[[Hashable, Any], Iterable[str]]
+
+
+def attach_shared_tier(tier: Optional[SharedTier], origin: str = "", listener: Optional[InvalidationListener] = None) -> None:
+    global _shared, _origin, _listener
+    _shared, _origin, _listener = tier, origin, listener
+
+
+def shared_tier() -> Optional[SharedTier]:
+    return _shared
+
+
+def shared_cache_stats() -> Dict[str, Any]:
+    if _shared is None:
+        return {"backend": "none"}
+    try:
+        stats = _shared.stats()
+    except Exception as e:
+        stats = {"backend": _shared.name, "error": str(e)}
+    return {**stats, "origin": _origin, "listener": _listener.stats() if _listener is not None else None}
+
+
+class TTLCache:
+    """Cache en memoria del proceso con TTL, límite LRU y carga single-flight.
+
+    Pensado para el event loop de la app: no es thread-safe. Los valores ``None``
+    no se guardan (p. ej. fila inexistente) para no fijar ausencias.
+
+    Con ``shared`` y un nivel compartido configurado (CACHE_SHARED_BACKEND) es un
+    cache de dos niveles: un fallo en proceso consulta el nivel compartido antes de
+    cargar, lo cargado se escribe en ambos y las invalidaciones se publican para los
+    demás workers. Los valores tienen que ser JSON (orjson); las invalidaciones por
+    contenido van con reglas con nombre (``add_rule``/``invalidate_rule``), porque un
+    predicado no se puede enviar a otro proceso. Con ``broadcast`` solo se publican
+    las invalidaciones y cada worker carga lo suyo.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0, shared: bool = False, broadcast: bool = False):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        # Solo invalidaciones entre workers (valores que no son JSON, TTL corto)
+        self.broadcast = broadcast or shared
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._rules: Dict[str, Callable[[Any], Predicate]] = {}
+        self._taggers: Dict[str, Tagger] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+        _registry[name] = self
+
+    def _tier(self) -> Optional[SharedTier]:
+        return _shared if self.shared else None
+
+    def _tier_call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Llamada al nivel compartido; un error cuenta y se sigue sin él."""
+        try:
+            return fn(*args)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.debug("shared cache %s: %s", self.name, e)
+            return None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        tier = self._tier()
+        if tier is not None:
+            row = self._tier_call(tier.get, self.name, encode_key(key))
+            # Un valor que no decodifica cuenta como error del nivel y como fallo
+            value = self._tier_call(orjson.loads, row[0]) if row is not None else None
+            if value is not None:
+                self.shared_hits += 1
+                self._store(key, value, min(self.ttl, row[1] - time.time()))
+                return value
+        self.misses += 1
+        return default
+
+    def _store(self, key: Hashable, value: Any, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key: Hashable, value: Any, after_event: Optional[int] = None) -> None:
+        self._store(key, value, self.ttl)
+        tier = self._tier()
+        if tier is not None:
+            tags = {rule: [str(t) for t in tagger(key, value)] for rule, tagger in self._taggers.items()}
+            self._tier_call(tier.set, self.name, encode_key(key), orjson.dumps(value), self.ttl, after_event, tags)
+
+    def _drop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        # Una carga en curso para esta clave ya no debe guardar su resultado
+        self._inflight.pop(key, None)
+        self.invalidations += 1
+
+    def _drop_where(self, predicate: Predicate) -> int:
+        keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+        for k in keys:
+            del self._data[k]
+        self._inflight.clear()
+        self.invalidations += 1
+        return len(keys)
+
+    def _drop_all(self) -> None:
+        self._data.clear()
+        self._inflight.clear()
+        self.invalidations += 1
+
+    def _publish(self, op: str, arg: Any) -> None:
+        tier = _shared if self.broadcast else None
+        if tier is not None:
+            self._tier_call(tier.publish, self.name, op, arg, _origin)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._drop(key)
+        tier = self._tier()
+        if tier is not None:
+            self._tier_call(tier.delete, self.name, [encode_key(key)])
+        self._publish("key", encode_key(key))
+
+    def invalidate_where(self, predicate: Predicate) -> int:
+        """Descarta las entradas cuyo (clave, valor) cumple ``predicate``. Las cargas en
+        curso tampoco se guardarán, porque podrían traer datos previos al cambio.
+        Solo en este proceso: en caches compartidos usar ``invalidate_rule``."""
+        return self._drop_where(predicate)
+
+    def add_rule(self, name: str, factory: Callable[[Any], Predicate], tags: Optional[Tagger] = None) -> None:
+        """Registra una invalidación por contenido: ``factory(arg)`` arma el predicado
+        (``arg`` tiene que ser JSON para poder publicarlo).
+
+        En caches ``shared`` conviene dar ``tags``: las etiquetas de cada entrada se
+        guardan al escribirla en el nivel compartido y ``invalidate_rule`` borra ahí
+        por etiqueta (``arg`` es entonces la lista de etiquetas a invalidar) en lugar
+        de leer y decodificar todo el namespace."""
+        self._rules[name] = factory
+        if tags is not None:
+            self._taggers[name] = tags
+
+    def invalidate_rule(self, name: str, arg: Any) -> int:
+        """Como ``invalidate_where`` con la regla ``name``, también en el nivel
+        compartido y en los demás workers."""
+        predicate = self._rules[name](arg)
+        n = self._drop_where(predicate)
+        tier = self._tier()
+        if tier is not None:
+            if name in self._taggers:
+                tags = arg if isinstance(arg, (list, tuple, set)) else [arg]
+                self._tier_call(tier.delete_tagged, self.name, name, [str(t) for t in tags])
+            else:
+                self._tier_call(self._delete_matching, tier, predicate)
+        self._publish("rule", {"rule": name, "arg": arg})
+        return n
+
+    def _delete_matching(self, tier: SharedTier, predicate: Predicate) -> None:
+        """Regla sin etiquetas: recorre el namespace compartido (lento con valores grandes)."""
+        keys: List[str] = []
+        for raw_key, raw in tier.scan(self.name):
+            try:
+                value = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                # Entrada corrupta o marca de claim(): se borra igual
+                keys.append(raw_key)
+                continue
+            if predicate(decode_key(raw_key), value):
+                keys.append(raw_key)
+        if keys:
+            tier.delete(self.name, keys)
+
+    def apply_remote(self, op: str, arg: Any) -> None:
+        """Invalidación publicada por otro worker (el nivel compartido ya está al día)."""
+        self.remote_invalidations += 1
+        if op == "key":
+            self._drop(decode_key(arg))
+        elif op == "clear":
+            self._drop_all()
+        elif op == "rule" and arg.get("rule") in self._rules:
+            self._drop_where(self._rules[arg["rule"]](arg.get("arg")))
+
+    def loading(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def clear(self) -> None:
+        self._drop_all()
+        tier = self._tier()
+        if tier is not None:
+            self._tier_call(tier.clear, self.name)
+        self._publish("clear", None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Devuelve el valor cacheado o lo carga una sola vez aunque haya
+        varias solicitudes concurrentes para la misma clave."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            self.loads += 1
+            tier = self._tier()
+            # Invalidaciones publicadas hasta aquí: si llega otra durante la carga, el
+            # resultado no se escribe en el nivel compartido
+            after_event = self._tier_call(tier.last_event) if tier is not None else None
+            # La carga corre en su propia tarea: si se cancela la solicitud que la
+            # inició, las demás que esperan la misma clave no se ven afectadas.
+            task = asyncio.ensure_future(self._load(key, loader, after_event))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], after_event: Optional[int] = None) -> Any:
+        me = asyncio.current_task()
+        try:
+            value = await loader()
+        except BaseException:
+            if self._inflight.get(key) is me:
+                del self._inflight[key]
+            raise
+        if self._inflight.get(key) is me:
+            del self._inflight[key]
+            if value is not None:
+                self.set(key, value, after_event)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            **({"shared": self.shared and _shared is not None, "shared_errors": self.shared_errors,
+                "remote_invalidations": self.remote_invalidations} if self.broadcast else {}),
+        }
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def get_cache(name: str) -> Optional[TTLCache]:
+    return _registry.get(name)
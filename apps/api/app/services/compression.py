@@ -0,0 +1,195 @@
+import asyncio
+import gzip
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:  # brotli es opcional: sin el paquete se ofrece solo gzip
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Cuerpos más grandes se comprimen en un hilo (zlib/brotli sueltan el GIL) para no
+# frenar el event loop
+THREAD_MIN_SIZE = 256 * 1024
+
+# Ya comprimidos o que no se pueden retener (SSE se envía evento a evento)
+SKIP_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/gzip")
+
+# Streams que sí se comprimen, trozo a trozo y con flush en cada uno (/verify?format=ndjson)
+STREAM_TYPES = ("application/x-ndjson",)
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    """``Accept-Encoding`` -> {codificación: q}."""
+    out: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        out[name] = q
+    return out
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    """br si el cliente lo acepta y está instalado, si no gzip; None sin compresión."""
+    accepted = _accepted(header)
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class StreamCompressor:
+    """Compresión incremental: cada ``process`` devuelve lo comprimido hasta ahí
+    (flush), así el cliente puede descomprimir cada trozo apenas llega."""
+
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 4):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._gz = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.flush()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._br.finish()
+        return self._gz.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """Comprime con br/gzip las respuestas de un solo cuerpo desde ``min_size`` bytes.
+
+    ASGI puro como MetricsMiddleware: las respuestas en streaming (SSE, más de un
+    ``http.response.body``) pasan sin tocar, igual que las que ya traen
+    Content-Encoding o cuyo tipo no gana nada; salvo los tipos de STREAM_TYPES, que
+    se comprimen trozo a trozo con StreamCompressor. Al comprimir, el ETag pasa a débil
+    (el cuerpo ya no es el mismo byte a byte) y se agrega ``Vary: Accept-Encoding``.
+    """
+
+    def __init__(self, app: Any, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = None
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                encoding = choose_encoding(value.decode("latin-1"))
+                break
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Dict[str, Any]] = None
+        passthrough = False
+        stream: Optional[StreamCompressor] = None
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal start, passthrough, stream
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message
+                if not self._compressible(message):
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if stream is None and more and self._streamable(start):
+                stream = StreamCompressor(encoding, self.gzip_level, self.brotli_quality)
+                await send({**start, "headers": self._headers(start["headers"], encoding, None)})
+            if stream is not None:
+                if len(body) >= THREAD_MIN_SIZE:
+                    data = await asyncio.to_thread(stream.process, body)
+                else:
+                    data = stream.process(body)
+                if not more:
+                    data += stream.finish()
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+                return
+            if more or len(body) < self.min_size:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            if len(body) >= THREAD_MIN_SIZE:
+                data = await asyncio.to_thread(compress, body, encoding, self.gzip_level, self.brotli_quality)
+            else:
+                data = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            await send({**start, "headers": self._headers(start["headers"], encoding, len(data))})
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressible(start: Dict[str, Any]) -> bool:
+        if start["status"] < 200 or start["status"] in (204, 304):
+            return False
+        for key, value in start["headers"]:
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type" and value.decode("latin-1").startswith(SKIP_TYPES):
+                return False
+        return True
+
+    @staticmethod
+    def _streamable(start: Dict[str, Any]) -> bool:
+        for key, value in start["headers"]:
+            if key == b"content-type":
+                return value.decode("latin-1").startswith(STREAM_TYPES)
+        return False
+
+    @staticmethod
+    def _headers(raw: List[Tuple[bytes, bytes]], encoding: str, length: Optional[int]) -> List[Tuple[bytes, bytes]]:
+        headers: List[Tuple[bytes, bytes]] = []
+        vary = None
+        for key, value in raw:
+            if key == b"content-length":
+                continue
+            if key == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            if key == b"vary":
+                vary = value
+                continue
+            headers.append((key, value))
+        if vary is None:
+            vary = b"Accept-Encoding"
+        elif b"accept-encoding" not in vary.lower():
+            vary = vary + b", Accept-Encoding"
+        headers.append((b"vary", vary))
+        headers.append((b"content-encoding", encoding.encode("ascii")))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode("ascii")))
+        return headers
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from ..core.config import get_settings
+from .cache import shared_tier
+from .raffles import invalidate_counters
+from .supabase import get_supabase
+
+
+logger = logging.getLogger("prizo.counters")
+
+# Solo estas rifas cambian tickets; las cerradas quedan como las dejó la última pasada
+ACTIVE_STATUSES = ("published", "selling")
+
+
+class CountersDriftJob:
+    """Corrección periódica de raffle_counters (patch_raffle_counters_table.sql).
+
+    Los triggers mantienen los contadores exactos; una diferencia solo aparece si se
+    tocaron tickets con el trigger deshabilitado o por un error. Cada ``interval``
+    segundos recalcula las rifas activas, una por vez y cada una en su propia
+    transacción (``refresh_raffle_counters`` bloquea brevemente las reservas de esa
+    rifa mientras cuenta), registra lo corregido y descarta su entrada del cache.
+
+    Con varios workers la pasada la hace uno solo por intervalo: el que toma la clave
+    ``counters/drift`` del nivel compartido de los caches (sin nivel compartido, cada
+    worker hace la suya). La primera espera un tiempo al azar dentro del intervalo, así
+    un deploy no dispara todos los recálculos juntos al arrancar.
+    """
+
+    def __init__(self, interval: float = 600.0, retry_delay: float = 60.0):
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"runs": 0, "skipped": 0, "raffles": 0, "corrected": 0, "errors": 0}
+        self._last_run: Optional[float] = None
+        self._last_drift: List[Dict[str, Any]] = []
+
+    async def run_once(self) -> int:
+        """Recalcula las rifas activas; devuelve cuántas tenían diferencias."""
+        sb = get_supabase()
+        raffles = await sb.get_many("raffles", {"status": f"in.({','.join(ACTIVE_STATUSES)})"}, select="id")
+        drift: List[Dict[str, Any]] = []
+        for raffle in raffles or []:
+            # Una fila rara no corta la pasada: cuenta como error de esa rifa
+            try:
+                raffle_id = str(raffle["id"])
+                rows = await sb.call_rpc("refresh_raffle_counters", {"p_raffle_id": raffle_id})
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning("refresh_raffle_counters failed for %s: %s", raffle.get("id"), e)
+                continue
+            self._stats["raffles"] += 1
+            for row in rows or []:
+                if row.get("sold_drift") or row.get("reserved_drift"):
+                    drift.append(row)
+                    invalidate_counters(raffle_id)
+                    logger.warning(
+                        "raffle_counters drift corrected for %s: sold %+d, reserved %+d",
+                        raffle_id, row.get("sold_drift") or 0, row.get("reserved_drift") or 0,
+                    )
+        self._stats["runs"] += 1
+        self._stats["corrected"] += len(drift)
+        self._last_run = time.time()
+        self._last_drift = drift
+        return len(drift)
+
+    def _claim(self) -> bool:
+        """True si esta pasada le toca a este worker (otro no la hizo en el intervalo)."""
+        tier = shared_tier()
+        if tier is None:
+            return True
+        try:
+            return tier.claim("counters", "drift", self.interval)
+        except Exception as e:
+            logger.debug("counters drift claim failed: %s", e)
+            return True
+
+    async def _run(self) -> None:
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                if self._claim():
+                    await self.run_once()
+                else:
+                    self._stats["skipped"] += 1
+                await asyncio.sleep(self.interval * random.uniform(0.9, 1.1))
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning("counters drift job error: %s", e)
+                await asyncio.sleep(self.retry_delay)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "last_run_ago_seconds": round(time.time() - self._last_run, 1) if self._last_run is not None else None,
+            "last_drift": self._last_drift,
+            **self._stats,
+        }
+
+
+_job: Optional[CountersDriftJob] = None
+
+
+def get_counters_drift_job() -> CountersDriftJob:
+    global _job
+    if _job is None:
+        _job = CountersDriftJob(interval=get_settings().COUNTERS_DRIFT_INTERVAL)
+    return _job
@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..core.config import get_settings
+from .availability import get_availability_store
+from .supabase import get_supabase, parse_timestamp
+
+
+logger = logging.getLogger("prizo.expiry")
+
+
+class ReservationExpiry:
+    """Vencimientos de reservas en memoria (cola de prioridad por deadline).
+
+    Las rutas de /reservations registran cada ticket reservado con su
+    ``reserved_until``; al vencer, los tickets se liberan en lote con el RPC
+    ``release_expired_tickets``, que solo libera los que siguen reservados y
+    vencidos (una reserva renovada se vuelve a programar). Al arrancar se cargan
+    las reservas vigentes desde la base. El job de pg_cron queda como respaldo.
+    """
+
+    def __init__(self, batch_size: int = 500, grace: float = 1.0, reconcile_limit: int = 10000, retry_delay: float = 5.0):
+        self.batch_size = batch_size
+        # Margen tras el deadline para tolerar desfase de reloj con la base
+        self.grace = grace
+        self.reconcile_limit = reconcile_limit
+        self.retry_delay = retry_delay
+        self._deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"released": 0, "renewed": 0, "dropped": 0, "batches": 0, "errors": 0, "reconciled": 0}
+        self._last_lag: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def track(self, ticket_id: str, deadline: float) -> None:
+        tid = str(ticket_id)
+        self._deadlines[tid] = deadline
+        heapq.heappush(self._heap, (deadline, tid))
+        # Entradas obsoletas (renovaciones / forget) se descartan al salir; compactar si abundan
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._heap = [(d, t) for t, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        if self._wakeup is not None and self._heap[0] == (deadline, tid):
+            self._wakeup.set()
+
+    def track_rows(self, rows: Iterable[Dict[str, Any]], minutes: Optional[int] = None) -> int:
+        """Registra filas de tickets devueltas por los RPCs de reserva. Sin
+        ``reserved_until`` se usa ahora + ``minutes``."""
+        fallback = time.time() + 60.0 * (minutes or 10)
+        n = 0
+        for row in rows or []:
+            if not isinstance(row, dict) or not row.get("id"):
+                continue
+            if row.get("status") not in (None, "reserved"):
+                continue
+            self.track(row["id"], parse_timestamp(row.get("reserved_until")) or fallback)
+            n += 1
+        return n
+
+    def forget(self, ticket_ids: Iterable[str]) -> None:
+        for tid in ticket_ids:
+            self._deadlines.pop(str(tid), None)
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap:
+            deadline, tid = self._heap[0]
+            if self._deadlines.get(tid) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: float) -> List[Tuple[str, float]]:
+        """Saca hasta ``batch_size`` tickets vencidos (deadline + grace <= now)."""
+        due: List[Tuple[str, float]] = []
+        while self._heap and len(due) < self.batch_size:
+            deadline, tid = self._heap[0]
+            if self._deadlines.get(tid) != deadline:
+                heapq.heappop(self._heap)
+                continue
+            if deadline + self.grace > now:
+                break
+            heapq.heappop(self._heap)
+            del self._deadlines[tid]
+            due.append((tid, deadline))
+        return due
+
+    async def release_due(self) -> int:
+        now = time.time()
+        due = self.pop_due(now)
+        if not due:
+            return 0
+        ids = [tid for tid, _ in due]
+        try:
+            rows = await get_supabase().call_rpc("release_expired_tickets", {"p_ticket_ids": ids})
+        except Exception as e:
+            # Reintentar más tarde; si la API cae, el barrido de pg_cron los libera igual
+            self._stats["errors"] += 1
+            logger.warning("release_expired_tickets failed for %d tickets: %s", len(ids), e)
+            for tid in ids:
+                self.track(tid, now + self.retry_delay)
+            return 0
+
+        self._stats["batches"] += 1
+        released = 0
+        seen = set()
+        for row in rows or []:
+            tid = str(row.get("ticket_id"))
+            seen.add(tid)
+            if row.get("released"):
+                released += 1
+            else:
+                # Renovada en otra reserva / worker: se reprograma con su nuevo vencimiento
+                deadline = parse_timestamp(row.get("reserved_until"))
+                if deadline is not None:
+                    self.track(tid, deadline)
+                    self._stats["renewed"] += 1
+        # Vendidos, liberados por la sesión o adjuntos a un pago: nada que hacer
+        self._stats["dropped"] += len(ids) - len(seen)
+        get_availability_store().on_released([str(r.get("ticket_id")) for r in rows or [] if r.get("released")])
+        self._stats["released"] += released
+        self._last_lag = now - min(d for _, d in due)
+        if released:
+            logger.info("released %d expired tickets (batch=%d)", released, len(ids))
+        return released
+
+    async def reconcile(self) -> int:
+        """Carga las reservas vigentes de la base (arranque / tras reinicio)."""
+        sb = get_supabase()
+        page = 1000
+        loaded = 0
+        while loaded < self.reconcile_limit:
+            rows = await sb.get_many(
+                "tickets",
+                {
+                    "status": "eq.reserved",
+                    "reserved_until": "not.is.null",
+                    "order": "reserved_until.asc,id.asc",
+                    "limit": str(min(page, self.reconcile_limit - loaded)),
+                    "offset": str(loaded),
+                },
+                select="id,reserved_until",
+            )
+            self.track_rows(rows)
+            loaded += len(rows)
+            if len(rows) < page:
+                break
+        self._stats["reconciled"] += loaded
+        logger.info("expiry reconcile: %d reserved tickets loaded", loaded)
+        return loaded
+
+    async def _run(self) -> None:
+        try:
+            await self.reconcile()
+        except Exception as e:
+            logger.warning("expiry reconcile failed (pg_cron sweep still applies): %s", e)
+        while True:
+            deadline = self.next_deadline()
+            delay = None if deadline is None else deadline + self.grace - time.time()
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.release_due()
+            except Exception as e:
+                logger.warning("expiry loop error: %s", e)
+                await asyncio.sleep(self.retry_delay)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        deadline = self.next_deadline()
+        return {
+            "tracked": len(self._deadlines),
+            "next_in_seconds": round(deadline - time.time(), 3) if deadline is not None else None,
+            "last_lag_seconds": round(self._last_lag, 3) if self._last_lag is not None else None,
+            **self._stats,
+        }
+
+
+_expiry: Optional[ReservationExpiry] = None
+
+
+def get_reservation_expiry() -> ReservationExpiry:
+    global _expiry
+    if _expiry is None:
+        s = get_settings()
+        _expiry = ReservationExpiry(
+            batch_size=s.RESERVATION_EXPIRY_BATCH,
+            grace=s.RESERVATION_EXPIRY_GRACE,
+            reconcile_limit=s.RESERVATION_EXPIRY_RECONCILE_LIMIT,
+        )
+    return _expiry
+
+
+def track_reserved(rows: Iterable[Dict[str, Any]], minutes: Optional[int] = None) -> None:
+    """Programa el vencimiento de tickets recién reservados (no-op si está deshabilitado)."""
+    if get_settings().RESERVATION_EXPIRY_ENABLED:
+        get_reservation_expiry().track_rows(rows, minutes)
+
+
+def forget_released(ticket_ids: Iterable[str]) -> None:
+    if _expiry is not None:
+        _expiry.forget(ticket_ids)
@@ -0,0 +1,225 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .cache import cache_stats
+
+
+# Buckets de latencia en segundos (de 1 ms a 10 s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Registro de métricas del proceso, en orden de exposición
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        _registry.append(self)
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        ...
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    """Contador por combinación de etiquetas (tupla de valores, en el orden de ``labels``).
+
+    Sin locks: se actualiza solo desde el event loop.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, labels: Tuple[str, ...], value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram(_Metric):
+    """Histograma con buckets fijos: ``observe`` es un bisect y dos sumas.
+
+    Guarda los conteos por bucket sin acumular; se acumulan al exponer.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [conteo por bucket..., +Inf, suma]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 2)
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for labels, row in self.values.items():
+            acc = 0
+            for bound, count in zip(self.buckets + (math.inf,), row):
+                acc += count
+                le = 'le="' + _num(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(row[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {acc}"
+
+
+# --- Métricas de la API ---
+
+http_requests = Counter("prizo_http_requests_total", "Solicitudes HTTP atendidas", ("method", "route", "status"))
+http_latency = Histogram(
+    "prizo_http_request_duration_seconds",
+    "Tiempo hasta el inicio de la respuesta (en streams, hasta el primer byte)", ("method", "route"),
+)
+http_inflight = Gauge("prizo_http_requests_in_flight", "Solicitudes en curso (incluye streams abiertos)")
+
+supabase_latency = Histogram(
+    "prizo_supabase_request_duration_seconds", "Duración de las llamadas a PostgREST", ("kind", "name"),
+)
+supabase_requests = Counter("prizo_supabase_requests_total", "Llamadas a PostgREST por código HTTP", ("kind", "name", "status"))
+supabase_errors = Counter(
+    "prizo_supabase_errors_total", "Llamadas a PostgREST fallidas (código >= 400 o error de red)", ("kind", "name", "reason"),
+)
+supabase_retries = Counter("prizo_supabase_retries_total", "Reintentos de llamadas a PostgREST", ("kind", "name"))
+supabase_hedges = Counter("prizo_supabase_hedges_total", "Lecturas duplicadas por hedging", ("kind", "name"))
+
+admission_wait = Histogram(
+    "prizo_admission_wait_seconds", "Espera en la cola de admisión antes de llamar a Supabase", ("route",),
+)
+admission_rejections = Counter(
+    "prizo_admission_rejections_total", "Solicitudes rechazadas con 429 por la admisión", ("route", "reason"),
+)
+
+
+def observe_supabase(kind: str, name: str, started: float, status: Optional[int], error: Optional[str] = None) -> None:
+    """Registra una llamada a PostgREST: ``status`` None si falló antes de la respuesta;
+    ``error`` (código o clase de la excepción) si cuenta como fallida."""
+    labels = (kind, name)
+    supabase_latency.observe(labels, time.perf_counter() - started)
+    supabase_requests.inc((kind, name, str(status) if status is not None else "error"))
+    if error is not None:
+        supabase_errors.inc((kind, name, error))
+
+
+def _cache_lines() -> List[str]:
+    stats = cache_stats()
+    lines: List[str] = []
+    for field, kind, help in (
+        ("hits", "counter", "Aciertos de los caches en proceso"),
+        ("misses", "counter", "Fallos de los caches en proceso"),
+        ("evictions", "counter", "Entradas desalojadas por el límite LRU"),
+        ("size", "gauge", "Entradas en cada cache"),
+    ):
+        name = f"prizo_cache_{field}" + ("_total" if kind == "counter" else "")
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{cache="{_escape(cache)}"}} {s[field]}' for cache, s in stats.items()]
+    return lines
+
+
+# Colectores que se evalúan al exponer (estado que ya se lleva en otro lado)
+_collectors: List[Callable[[], List[str]]] = [_cache_lines]
+
+
+def register_collector(collect: Callable[[], List[str]]) -> None:
+    _collectors.append(collect)
+
+
+def render() -> str:
+    """Todas las métricas del proceso en formato de texto de Prometheus (0.0.4)."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines += metric.render()
+    for collect in _collectors:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI (sin BaseHTTPMiddleware, para no envolver el body ni romper
+    los streams) que mide cada solicitud por plantilla de ruta.
+
+    La ruta se toma de ``scope["route"]`` (FastAPI la deja al resolver), así que
+    ``/raffles/{raffle_id}/availability`` es una sola serie; lo que no resuelve a
+    una ruta cuenta como ``<unmatched>``.
+    """
+
+    def __init__(self, app: Any, exclude: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.exclude = exclude
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        timed = False
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status, timed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                http_latency.observe((scope["method"], _route(scope)), time.perf_counter() - started)
+                timed = True
+            await send(message)
+
+        http_inflight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_inflight.dec()
+            route = _route(scope)
+            if not timed:
+                http_latency.observe((scope["method"], route), time.perf_counter() - started)
+            http_requests.inc((scope["method"], route, str(status)))
+
+
+def _route(scope: Dict[str, Any]) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
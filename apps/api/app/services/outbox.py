@@ -0,0 +1,435 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from ..core.config import get_settings
+from .availability import get_availability_store, payment_approved
+from .payments import lookup_payments_by_reference, remember_payments
+from .raffles import invalidate_top_buyers
+from .supabase import approve_payment, approve_payments
+from .verify import invalidate_payment, invalidate_payments
+
+
+logger = logging.getLogger("prizo.outbox")
+
+# Estados del proveedor que aprueban el pago (el resto se registra y se ignora)
+APPROVED_STATUSES = {"approved", "success", "paid"}
+
+_SCHEMA = """
+create table if not exists payment_webhooks (
+  id integer primary key autoincrement,
+  reference text not null,
+  status text not null,
+  amount real,
+  payload text,
+  received_at real not null,
+  state text not null default 'pending',   -- pending | done | ignored | dead
+  attempts integer not null default 0,
+  next_attempt_at real not null,
+  processed_at real,
+  payment_id text,
+  last_error text,
+  unique (reference, status)
+);
+create index if not exists payment_webhooks_due on payment_webhooks (next_attempt_at) where state = 'pending';
+create index if not exists payment_webhooks_processed on payment_webhooks (processed_at) where state <> 'pending';
+"""
+
+
+class WebhookOutbox:
+    """Cola durable de webhooks de pago en SQLite (WAL).
+
+    El endpoint solo inserta el webhook y responde: la inserción es idempotente
+    por (reference, status), así que los reintentos del proveedor no duplican
+    aprobaciones. Las inserciones concurrentes se confirman juntas en una sola
+    transacción (group commit) en un hilo dedicado, sin bloquear el event loop.
+
+    Un worker toma los pendientes vencidos por lotes (con lease, por si varios
+    procesos comparten el archivo), resuelve todas las referencias del lote en
+    una consulta, aprueba con concurrencia acotada y reprograma los fallos con
+    backoff exponencial hasta ``max_attempts``.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 50,
+        concurrency: int = 8,
+        max_attempts: int = 10,
+        retry_base: float = 2.0,
+        retry_max: float = 300.0,
+        retention: float = 7 * 86400.0,
+        lease: float = 60.0,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retention = retention
+        self.lease = lease
+        # SQLite solo desde este hilo: una conexión, escrituras serializadas
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prizo-outbox")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: List[Tuple[Tuple[Any, ...], asyncio.Future]] = []
+        self._flushing = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: List[int] = []
+        # None: todavía no se sabe si approve_payments está instalada
+        self._bulk: Optional[bool] = None
+        self._lags: Deque[float] = deque(maxlen=1000)
+        self._stats = {
+            "received": 0, "duplicates": 0, "ignored": 0, "commits": 0, "batches": 0,
+            "approved": 0, "already_approved": 0, "retries": 0, "dead": 0, "errors": 0,
+        }
+
+    # --- SQLite (hilo del executor) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            # FULL: el webhook está en disco antes de responder 200 al proveedor
+            conn.execute("pragma synchronous=full")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _db(self, fn, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _insert_many(self, rows: List[Tuple[Any, ...]]) -> List[bool]:
+        conn = self._connect()
+        out: List[bool] = []
+        conn.execute("begin immediate")
+        try:
+            for row in rows:
+                cur = conn.execute(
+                    "insert or ignore into payment_webhooks"
+                    " (reference, status, amount, payload, received_at, state, next_attempt_at, processed_at)"
+                    " values (?, ?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                out.append(cur.rowcount == 1)
+            conn.execute("commit")
+        except BaseException:
+            conn.execute("rollback")
+            raise
+        return out
+
+    def _claim(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        rows = conn.execute(
+            "update payment_webhooks set attempts = attempts + 1, next_attempt_at = ?"
+            " where id in (select id from payment_webhooks where state = 'pending' and next_attempt_at <= ?"
+            " order by next_attempt_at, id limit ?)"
+            " returning id, reference, status, attempts, received_at",
+            (now + self.lease, now, limit),
+        ).fetchall()
+        return [dict(zip(("id", "reference", "status", "attempts", "received_at"), r)) for r in rows]
+
+    def _finish(self, now: float, done: List[Tuple[int, str]], retry: List[Tuple[int, float, str]],
+                dead: List[Tuple[int, str]]) -> None:
+        conn = self._connect()
+        conn.execute("begin immediate")
+        try:
+            conn.executemany(
+                "update payment_webhooks set state = 'done', processed_at = ?, payment_id = ?, last_error = null where id = ?",
+                [(now, pid, i) for i, pid in done],
+            )
+            conn.executemany(
+                "update payment_webhooks set next_attempt_at = ?, last_error = ? where id = ?",
+                [(at, err, i) for i, at, err in retry],
+            )
+            conn.executemany(
+                "update payment_webhooks set state = 'dead', processed_at = ?, last_error = ? where id = ?",
+                [(now, err, i) for i, err in dead],
+            )
+            conn.execute("commit")
+        except BaseException:
+            conn.execute("rollback")
+            raise
+
+    def _unclaim(self, ids: List[int], now: float) -> None:
+        self._connect().executemany(
+            "update payment_webhooks set attempts = max(0, attempts - 1), next_attempt_at = ?"
+            " where id = ? and state = 'pending'",
+            [(now, i) for i in ids],
+        )
+
+    def _next_due(self) -> Optional[float]:
+        row = self._connect().execute(
+            "select min(next_attempt_at) from payment_webhooks where state = 'pending'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def _purge(self, before: float) -> int:
+        cur = self._connect().execute(
+            "delete from payment_webhooks where state <> 'pending' and processed_at < ?", (before,)
+        )
+        return cur.rowcount
+
+    def _depth(self) -> Dict[str, Any]:
+        conn = self._connect()
+        counts = dict(conn.execute("select state, count(*) from payment_webhooks group by state").fetchall())
+        oldest = conn.execute(
+            "select min(received_at) from payment_webhooks where state = 'pending'"
+        ).fetchone()[0]
+        return {"states": counts, "oldest_pending": oldest}
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Ingesta ---
+
+    async def enqueue(self, reference: str, status: Optional[str], amount: Optional[float] = None,
+                      payload: Optional[Dict[str, Any]] = None) -> bool:
+        """Guarda el webhook de forma durable. Devuelve False si ya se había recibido."""
+        status = (status or "").strip().lower()
+        now = time.time()
+        actionable = status in APPROVED_STATUSES
+        row = (
+            reference, status, amount, json.dumps(payload) if payload is not None else None, now,
+            "pending" if actionable else "ignored", now, None if actionable else now,
+        )
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((row, fut))
+        if not self._flushing:
+            self._flushing = True
+            asyncio.ensure_future(self._flush())
+        inserted = await fut
+        self._stats["received"] += 1
+        if not inserted:
+            self._stats["duplicates"] += 1
+        elif not actionable:
+            self._stats["ignored"] += 1
+        elif self._wakeup is not None:
+            self._wakeup.set()
+        return inserted
+
+    async def _flush(self) -> None:
+        # Lo que llega mientras se confirma un lote va en el siguiente commit
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    results = await self._db(self._insert_many, [row for row, _ in batch])
+                except Exception as e:
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                self._stats["commits"] += 1
+                for (_, fut), inserted in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(inserted)
+        finally:
+            self._flushing = False
+
+    # --- Worker ---
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max, self.retry_base * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _approve(self, payment_ids: List[str]) -> Tuple[Dict[str, Optional[str]], Set[str]]:
+        """Aprueba los pagos y devuelve el error de cada uno (None = aprobado) y los
+        que no tiene sentido reintentar.
+
+        Con ``approve_payments`` (patch_approve_payments_bulk.sql) es una sola llamada
+        por lote; si la función no está instalada se aprueba de a uno con concurrencia
+        acotada, como antes.
+        """
+        outcome: Dict[str, Optional[str]] = {}
+        permanent: Set[str] = set()
+        if not payment_ids:
+            return outcome, permanent
+        if self._bulk is not False:
+            try:
+                rows = await approve_payments(payment_ids, approved_by="webhook")
+            except httpx.HTTPStatusError as e:
+                if self._bulk is not None or e.response.status_code != 404:
+                    return {pid: f"approve failed: {e}" for pid in payment_ids}, permanent
+                # 404 (PGRST202): la función no está instalada
+                logger.info("approve_payments not installed; approving webhooks one by one")
+                self._bulk = False
+            except Exception as e:
+                return {pid: f"approve failed: {e}" for pid in payment_ids}, permanent
+            else:
+                self._bulk = True
+                outcome = {pid: "approve_payments: no result" for pid in payment_ids}
+                sold: List[str] = []
+                for row in rows:
+                    pid = str(row.get("payment_id"))
+                    result = row.get("outcome")
+                    if result in ("approved", "already_approved"):
+                        outcome[pid] = None
+                        sold.extend(row.get("ticket_ids") or [])
+                        self._stats["approved" if result == "approved" else "already_approved"] += 1
+                        continue
+                    outcome[pid] = f"approve_payments: {result} ({row.get('previous_status')})"
+                    # Rechazado/cancelado mientras tanto: lo resuelve un admin, no un reintento
+                    if result == "invalid_status":
+                        permanent.add(pid)
+                approved = [pid for pid, error in outcome.items() if error is None]
+                invalidate_payments(approved)
+                if approved:
+                    invalidate_top_buyers()
+                get_availability_store().on_sold(sold)
+                return outcome, permanent
+
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def approve(payment_id: str) -> None:
+            async with sem:
+                try:
+                    await approve_payment(payment_id=payment_id, approved_by="webhook")
+                except Exception as e:
+                    outcome[payment_id] = f"approve failed: {e}"
+                    return
+            outcome[payment_id] = None
+            self._stats["approved"] += 1
+            invalidate_payment(payment_id)
+            invalidate_top_buyers()
+            await payment_approved(payment_id)
+
+        await asyncio.gather(*(approve(pid) for pid in payment_ids))
+        return outcome, permanent
+
+    async def process_due(self) -> int:
+        """Procesa un lote de webhooks vencidos; devuelve cuántos se tomaron."""
+        now = time.time()
+        rows = await self._db(self._claim, now, self.batch_size)
+        if not rows:
+            return 0
+        self._inflight = [r["id"] for r in rows]
+        self._stats["batches"] += 1
+        errors: Dict[int, str] = {}
+        by_ref: Dict[str, Dict[str, Any]] = {}
+        refs = sorted({r["reference"] for r in rows})
+        try:
+            # Desde el cache de referencias; las que falten, en una consulta por lote
+            by_ref = await lookup_payments_by_reference(refs)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("webhook batch lookup failed (%d references): %s", len(refs), e)
+            errors = {r["id"]: f"lookup failed: {e}" for r in rows}
+
+        # Un mismo pago puede llegar con varios estados (paid + approved): se aprueba una vez
+        to_approve = sorted({p["id"] for p in by_ref.values() if p.get("status") != "approved"})
+        self._stats["already_approved"] += len({p["id"] for p in by_ref.values()}) - len(to_approve)
+        outcome, permanent = await self._approve(to_approve)
+        remember_payments(
+            {**p, "status": "approved"} for p in by_ref.values() if p["id"] in outcome and outcome[p["id"]] is None
+        )
+
+        done: List[Tuple[int, str]] = []
+        retry: List[Tuple[int, float, str]] = []
+        dead: List[Tuple[int, str]] = []
+        finished = time.time()
+        for r in rows:
+            payment = by_ref.get(r["reference"])
+            error = errors.get(r["id"])
+            if error is None:
+                # Sin pago puede ser que el webhook llegó antes que el registro: se reintenta
+                error = "payment not found" if payment is None else outcome.get(payment["id"])
+            if error is None:
+                done.append((r["id"], payment["id"]))
+                self._lags.append(finished - r["received_at"])
+            elif r["attempts"] >= self.max_attempts or (payment is not None and payment["id"] in permanent):
+                dead.append((r["id"], error))
+                logger.error("webhook %s/%s dropped after %d attempts: %s", r["reference"], r["status"], r["attempts"], error)
+            else:
+                retry.append((r["id"], finished + self._backoff(r["attempts"]), error))
+        self._stats["retries"] += len(retry)
+        self._stats["dead"] += len(dead)
+        await self._db(self._finish, finished, done, retry, dead)
+        self._inflight = []
+        return len(rows)
+
+    async def _run(self) -> None:
+        last_purge = 0.0
+        while True:
+            try:
+                if time.time() - last_purge > 3600:
+                    last_purge = time.time()
+                    purged = await self._db(self._purge, last_purge - self.retention)
+                    if purged:
+                        logger.info("webhook outbox: purged %d processed rows", purged)
+                self._wakeup.clear()
+                if await self.process_due() >= self.batch_size:
+                    continue
+                due = await self._db(self._next_due)
+                timeout = None if due is None else max(0.0, due - time.time())
+                if timeout == 0.0:
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning("webhook outbox loop error: %s", e)
+                await asyncio.sleep(self.retry_base)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._inflight:
+            # Lote cortado por el apagado: vuelve a estar disponible ya, sin esperar el lease
+            await self._db(self._unclaim, self._inflight, time.time())
+            self._inflight = []
+        await self._db(self._close)
+
+    async def stats(self) -> Dict[str, Any]:
+        depth = await self._db(self._depth)
+        oldest = depth["oldest_pending"]
+        lags = sorted(self._lags)
+        return {
+            "pending": depth["states"].get("pending", 0),
+            "states": depth["states"],
+            "oldest_pending_seconds": round(time.time() - oldest, 3) if oldest is not None else None,
+            "lag_p50_seconds": round(lags[len(lags) // 2], 3) if lags else None,
+            "lag_p99_seconds": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))], 3) if lags else None,
+            **self._stats,
+        }
+
+
+_outbox: Optional[WebhookOutbox] = None
+
+
+def get_webhook_outbox() -> WebhookOutbox:
+    global _outbox
+    if _outbox is None:
+        s = get_settings()
+        _outbox = WebhookOutbox(
+            path=s.WEBHOOK_OUTBOX_PATH,
+            batch_size=s.WEBHOOK_BATCH,
+            concurrency=s.WEBHOOK_CONCURRENCY,
+            max_attempts=s.WEBHOOK_MAX_ATTEMPTS,
+            retry_base=s.WEBHOOK_RETRY_BASE,
+            retry_max=s.WEBHOOK_RETRY_MAX,
+            retention=s.WEBHOOK_RETENTION_DAYS * 86400.0,
+        )
+    return _outbox
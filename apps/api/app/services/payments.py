@@ -0,0 +1,93 @@
+import asyncio
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from ..core.config import get_settings
+from .cache import TTLCache
+from .supabase import get_supabase
+
+
+PAYMENT_REF_SELECT = "id,reference,status"
+
+# Referencias por consulta ``reference=in.(...)``: acota el largo de la URL
+LOOKUP_CHUNK = 200
+
+_ref_cache: Optional[TTLCache] = None
+
+
+def _rows_for_payments(payment_ids: List[str]) -> Callable[[Any, Any], bool]:
+    """Regla de invalidación: referencias de alguno de los pagos."""
+    ids = set(payment_ids)
+    return lambda _ref, row: str(row.get("id")) in ids
+
+
+def payment_ref_cache() -> TTLCache:
+    """reference -> {id, reference, status}. Lo llenan las búsquedas por referencia y
+    las aprobaciones de la cola de webhooks; aprobaciones/rechazos del admin lo
+    invalidan. El TTL acota cambios hechos fuera de la API."""
+    global _ref_cache
+    if _ref_cache is None:
+        s = get_settings()
+        _ref_cache = TTLCache("payment_refs", maxsize=s.PAYMENT_REF_CACHE_MAXSIZE, ttl=s.PAYMENT_REF_CACHE_TTL, shared=True)
+        _ref_cache.add_rule("payments", _rows_for_payments, tags=lambda _ref, row: [str(row.get("id"))])
+    return _ref_cache
+
+
+def _in_filter(values: List[str]) -> str:
+    """Filtro ``in.(...)`` de PostgREST con cada valor entre comillas."""
+    quoted = ['"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values]
+    return f"in.({','.join(quoted)})"
+
+
+async def lookup_payments_by_reference(references: Iterable[str], fresh: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Pagos por referencia, desde el cache y con una consulta por cada
+    ``LOOKUP_CHUNK`` referencias que falten (usa idx_payments_reference).
+
+    Las referencias sin pago no se cachean (el webhook puede llegar antes que el
+    pago). Si hay varios pagos con la misma referencia se toma el primero que
+    devuelve PostgREST, como hasta ahora. ``fresh`` ignora el cache (conciliación)
+    pero lo actualiza con lo leído.
+    """
+    cache = payment_ref_cache()
+    found: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for ref in dict.fromkeys(references):
+        hit = None if fresh else cache.get(ref)
+        if hit is not None:
+            found[ref] = hit
+        else:
+            missing.append(ref)
+    if not missing:
+        return found
+
+    sb = get_supabase()
+    chunks = [missing[i:i + LOOKUP_CHUNK] for i in range(0, len(missing), LOOKUP_CHUNK)]
+    results = await asyncio.gather(*(
+        sb.get_many("payments", {"reference": _in_filter(chunk)}, select=PAYMENT_REF_SELECT) for chunk in chunks
+    ))
+    for rows in results:
+        for row in rows or []:
+            ref = row.get("reference")
+            if ref is not None and ref not in found:
+                found[ref] = row
+                cache.set(ref, row)
+    return found
+
+
+async def find_payment_by_reference(reference: str) -> Optional[Dict[str, Any]]:
+    return (await lookup_payments_by_reference([reference])).get(reference)
+
+
+def remember_payments(rows: Iterable[Dict[str, Any]]) -> None:
+    """Guarda/actualiza pagos conocidos (p. ej. tras aprobarlos desde la cola)."""
+    cache = payment_ref_cache()
+    for row in rows:
+        if row.get("reference"):
+            cache.set(row["reference"], {k: row.get(k) for k in ("id", "reference", "status")})
+
+
+def forget_payments(payment_ids: Iterable[str]) -> int:
+    """Descarta las referencias de estos pagos (cambiaron de estado por otra vía)."""
+    ids = {str(p) for p in payment_ids}
+    if not ids:
+        return 0
+    return payment_ref_cache().invalidate_rule("payments", sorted(ids))
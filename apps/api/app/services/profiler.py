@@ -0,0 +1,106 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from ..core.config import get_settings
+
+
+logger = logging.getLogger("prizo.profiler")
+
+
+class SamplingProfiler:
+    """Profiler por muestreo del hilo del event loop, activable en caliente.
+
+    Un hilo aparte toma la pila del hilo observado cada ``interval`` segundos
+    (``sys._current_frames``) y cuenta pilas colapsadas (``a;b;c N``, el formato
+    de flamegraph.pl / speedscope). No instrumenta llamadas: con el profiler
+    apagado no cuesta nada y encendido el costo es proporcional al muestreo.
+
+    Es por proceso: con varios workers de uvicorn se perfila el worker que
+    atendió ``/admin/profiler/start`` (su ``pid`` va en la respuesta).
+    """
+
+    def __init__(self, max_duration: float = 60.0, max_depth: int = 64):
+        self.max_duration = max_duration
+        self.max_depth = max_depth
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+        self.interval = 0.0
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.005, duration: float = 30.0) -> None:
+        """Empieza a muestrear el hilo que llama (el del event loop); se detiene
+        solo tras ``duration`` segundos (acotado por ``max_duration``)."""
+        if self.running:
+            raise RuntimeError("profiler already running")
+        self.interval = max(0.001, interval)
+        duration = min(max(0.1, duration), self.max_duration)
+        self._target = threading.get_ident()
+        self._stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, args=(duration,), name="prizo-profiler", daemon=True)
+        self._thread.start()
+        logger.info("profiler started (interval %.1f ms, %.0f s)", self.interval * 1000, duration)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self, duration: float) -> None:
+        end = time.monotonic() + duration
+        while not self._stop.wait(self.interval) and time.monotonic() < end:
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            names: List[str] = []
+            while frame is not None and len(names) < self.max_depth:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+        self.stopped_at = time.time()
+
+    def collapsed(self, limit: int = 0) -> str:
+        """Pilas colapsadas de la última corrida, de más a menos frecuente (se puede
+        pedir con el profiler corriendo: se copia el dict de una vez)."""
+        rows = Counter(dict.copy(self._stacks)).most_common(limit or None)
+        return "".join(f"{stack} {count}\n" for stack, count in rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+        }
+
+
+_profiler: Optional[SamplingProfiler] = None
+
+
+def get_profiler() -> SamplingProfiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(max_duration=get_settings().PROFILER_MAX_SECONDS)
+    return _profiler
@@ -0,0 +1,118 @@
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+
+from ..core.config import get_settings
+from .cache import TTLCache
+from .supabase import get_supabase
+
+
+RAFFLE_META_SELECT = "total_tickets,is_free"
+
+_raffle_cache: Optional[TTLCache] = None
+
+
+def raffle_cache() -> TTLCache:
+    global _raffle_cache
+    if _raffle_cache is None:
+        s = get_settings()
+        _raffle_cache = TTLCache("raffle_meta", maxsize=s.RAFFLE_CACHE_MAXSIZE, ttl=s.RAFFLE_CACHE_TTL, shared=True)
+    return _raffle_cache
+
+
+async def get_raffle_meta(raffle_id: str) -> Optional[Dict[str, Any]]:
+    """Metadatos canónicos de la rifa (total_tickets, is_free) desde el cache en proceso.
+    Una ráfaga de solicitudes para la misma rifa dispara una sola consulta a Supabase.
+    """
+
+    async def load() -> Optional[Dict[str, Any]]:
+        return await get_supabase().get_one("raffles", {"id": f"eq.{raffle_id}"}, select=RAFFLE_META_SELECT)
+
+    return await raffle_cache().get_or_load(raffle_id, load)
+
+
+def invalidate_raffle(raffle_id: Optional[str] = None) -> None:
+    """Descarta los metadatos cacheados de una rifa (o de todas si no se indica id).
+    Llamar cuando admin/webhooks modifiquen la rifa.
+    """
+    if raffle_id is None:
+        raffle_cache().clear()
+    else:
+        raffle_cache().invalidate(raffle_id)
+
+
+_top_buyers_cache: Optional[TTLCache] = None
+
+
+def top_buyers_cache() -> TTLCache:
+    """(raffle_id, limit) -> (cuerpo JSON serializado, ETag)."""
+    global _top_buyers_cache
+    if _top_buyers_cache is None:
+        s = get_settings()
+        _top_buyers_cache = TTLCache("top_buyers", maxsize=s.TOP_BUYERS_CACHE_MAXSIZE, ttl=s.TOP_BUYERS_CACHE_TTL,
+                                     broadcast=True)
+        _top_buyers_cache.add_rule("raffle", lambda raffle_id: lambda key, _value: key[0] == raffle_id)
+    return _top_buyers_cache
+
+
+async def get_top_buyers(raffle_id: str, limit: int) -> Tuple[bytes, str]:
+    """Ranking de compradores de la rifa (top_buyers_for_raffle) ya serializado, con
+    su ETag (hash del contenido). Con patch_top_buyers_leaderboard.sql el RPC lee la
+    tabla materializada; el cache evita el round trip en ráfagas de visitas.
+    """
+
+    async def load() -> Tuple[bytes, str]:
+        rows = await get_supabase().call_rpc(
+            "top_buyers_for_raffle", {"p_raffle_id": raffle_id, "p_limit": limit}, read=True
+        )
+        body = orjson.dumps({"ok": True, "raffle_id": raffle_id, "buyers": rows or []})
+        return body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+    return await top_buyers_cache().get_or_load((raffle_id, limit), load)
+
+
+def invalidate_top_buyers(raffle_id: Optional[str] = None) -> None:
+    """Descarta rankings cacheados. Las aprobaciones/rechazos se conocen por id de
+    pago, no por rifa: sin ``raffle_id`` se descartan todos (son pocas entradas)."""
+    if raffle_id is None:
+        top_buyers_cache().clear()
+    else:
+        top_buyers_cache().invalidate_rule("raffle", raffle_id)
+
+
+_counters_cache: Optional[TTLCache] = None
+
+
+def counters_cache() -> TTLCache:
+    """raffle_id -> (cuerpo JSON serializado, ETag)."""
+    global _counters_cache
+    if _counters_cache is None:
+        s = get_settings()
+        _counters_cache = TTLCache("raffle_counters", maxsize=s.COUNTERS_CACHE_MAXSIZE, ttl=s.COUNTERS_CACHE_TTL,
+                                   broadcast=True)
+    return _counters_cache
+
+
+async def get_raffle_counters(raffle_id: str) -> Optional[Tuple[bytes, str]]:
+    """Contadores de la rifa (ticket_counters_for_raffle: total_tickets, sold,
+    reserved, available) ya serializados, con su ETag. None si la rifa no existe o no
+    es pública. Con patch_raffle_counters_table.sql el RPC suma unas pocas filas; el
+    cache (TTL corto: cambian con cada reserva) absorbe las barras de progreso.
+    """
+
+    async def load() -> Optional[Tuple[bytes, str]]:
+        rows = await get_supabase().call_rpc("ticket_counters_for_raffle", {"p_raffle_id": raffle_id}, read=True)
+        if not rows:
+            return None
+        body = orjson.dumps({"ok": True, **rows[0]})
+        return body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+    return await counters_cache().get_or_load(raffle_id, load)
+
+
+def invalidate_counters(raffle_id: Optional[str] = None) -> None:
+    if raffle_id is None:
+        counters_cache().clear()
+    else:
+        counters_cache().invalidate(raffle_id)
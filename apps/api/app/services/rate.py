@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import orjson
+
+from .cache import shared_tier
+
+
+logger = logging.getLogger("prizo.rate")
+
+DEFAULT_MIRRORS = [
+    "https://pydolarvenezuela.github.io/api/v1/dollar",
+    "https://pydolarvenezuela-api.vercel.app/api/v1/dollar",
+    "https://pydolarvenezuela.vercel.app/api/v1/dollar",
+    "https://pydolarvenezuela.obh.software/api/v1/dollar",
+    "https://dolartoday-api.vercel.app/api/pydolar",
+    "https://venezuela-exchange.vercel.app/api",
+]
+
+
+def to_number(val: Any) -> Optional[float]:
+    if isinstance(val, (int, float)) and float(val) > 0:
+        return float(val)
+    if isinstance(val, str):
+        s = val.strip().replace(".", "").replace(",", ".")
+        try:
+            n = float(s)
+            if n > 0:
+                return n
+        except Exception:
+            return None
+    return None
+
+
+def scan(obj: Any) -> Optional[float]:
+    """Busca la tasa BCV/oficial en la respuesta JSON de un mirror."""
+    if not isinstance(obj, dict):
+        return None
+    for k, v in obj.items():
+        key = str(k).lower()
+        if any(x in key for x in ("bcv", "official", "oficial")):
+            n = to_number(v)
+            if n:
+                return n
+        if key == "bcv" and isinstance(v, dict):
+            cand = v.get("price") or v.get("promedio") or v.get("value") or v.get("venta") or v.get("sell")
+            n = to_number(cand)
+            if n:
+                return n
+        if isinstance(v, dict):
+            nested = scan(v)
+            if nested:
+                return nested
+    return None
+
+
+async def _fetch_one(client: httpx.AsyncClient, url: str) -> Optional[float]:
+    r = await client.get(url)
+    if r.status_code >= 400:
+        return None
+    return scan(r.json())
+
+
+async def race_mirrors(mirrors: List[str], timeout: float = 8.0) -> Tuple[float, str]:
+    """Consulta todos los mirrors en paralelo y devuelve (tasa, mirror) del primero
+    que responde con un valor válido; cancela el resto."""
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        tasks = {asyncio.ensure_future(_fetch_one(client, url)): url for url in mirrors}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is not None:
+                        logger.debug("rate mirror %s failed: %s", tasks[t], t.exception())
+                        continue
+                    n = t.result()
+                    if n:
+                        return n, tasks[t]
+        finally:
+            for t in pending:
+                t.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    raise RuntimeError("No rate source available")
+
+
+class RateCache:
+    """Tasa USD->VES en memoria, refrescada en segundo plano.
+
+    Las lecturas siempre salen de memoria (stale-while-revalidate): si el valor
+    supera ``max_age`` se sirve igual y se dispara un refresco en segundo plano.
+    Solo el primer acceso sin valor espera a los mirrors.
+    """
+
+    def __init__(self, mirrors: List[str], refresh_interval: float = 300.0, max_age: float = 600.0, timeout: float = 8.0):
+        self.mirrors = mirrors
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.timeout = timeout
+        self.rate: Optional[float] = None
+        self.mirror: Optional[str] = None
+        self.date: Optional[str] = None
+        self.fetched_at = 0.0
+        self.last_error: Optional[str] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def age(self) -> Optional[float]:
+        return time.monotonic() - self.fetched_at if self.rate is not None else None
+
+    def _from_shared(self) -> bool:
+        """Toma la tasa que otro worker consultó hace poco (nivel compartido de los
+        caches), en lugar de ir a los mirrors."""
+        tier = shared_tier()
+        if tier is None:
+            return False
+        try:
+            row = tier.get("rate", "usd_ves")
+        except Exception:
+            return False
+        if row is None:
+            return False
+        data = orjson.loads(row[0])
+        age = max(0.0, time.time() - data["fetched_at"])
+        if age > (self.refresh_interval or self.max_age) / 2:
+            return False
+        self.rate, self.mirror, self.date = data["rate"], data["mirror"], data["date"]
+        self.fetched_at = time.monotonic() - age
+        self.last_error = None
+        return True
+
+    def _to_shared(self) -> None:
+        tier = shared_tier()
+        if tier is None:
+            return
+        data = {"rate": self.rate, "mirror": self.mirror, "date": self.date, "fetched_at": time.time()}
+        try:
+            tier.set("rate", "usd_ves", orjson.dumps(data), self.max_age)
+        except Exception as e:
+            logger.debug("rate not shared: %s", e)
+
+    def _release_shared(self) -> None:
+        tier = shared_tier()
+        if tier is not None:
+            try:
+                tier.delete("rate", ["refreshing"])
+            except Exception:
+                pass
+
+    async def _wait_shared(self) -> bool:
+        """Si otro worker ya está consultando los mirrors, espera su resultado (hasta
+        ``timeout``) en vez de consultarlos también. False: consultar desde aquí."""
+        tier = shared_tier()
+        if tier is None:
+            return False
+        try:
+            if tier.claim("rate", "refreshing", self.timeout):
+                return False
+        except Exception:
+            return False
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            if self._from_shared():
+                return True
+        return False
+
+    async def _refresh(self) -> None:
+        if self._from_shared() or await self._wait_shared():
+            return
+        try:
+            rate, mirror = await race_mirrors(self.mirrors, self.timeout)
+        except Exception as e:
+            # Se conserva el último valor conocido (stale-if-error)
+            self.last_error = str(e)
+            logger.warning("rate refresh failed: %s", e)
+            self._release_shared()
+            return
+        self.rate, self.mirror = rate, mirror
+        self.date = datetime.utcnow().strftime("%Y%m%d")
+        self.fetched_at = time.monotonic()
+        self.last_error = None
+        self._to_shared()
+        self._release_shared()
+
+    def trigger_refresh(self) -> asyncio.Task:
+        """Inicia un refresco si no hay otro en curso (single-flight)."""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return self._refreshing
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        if self.rate is None:
+            await asyncio.shield(self.trigger_refresh())
+        elif (self.age() or 0.0) > self.max_age:
+            self.trigger_refresh()
+        if self.rate is None:
+            return None
+        age = self.age() or 0.0
+        return {
+            "rate": float(self.rate),
+            "source": "BCV",
+            "date": self.date,
+            "mirror": self.mirror,
+            "age_seconds": round(age, 3),
+            "stale": age > self.max_age,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await self.trigger_refresh()
+            # Con varios workers compartiendo la tasa, el jitter evita que todos vayan a
+            # los mirrors a la vez (el primero la comparte con los demás)
+            jitter = random.uniform(0.9, 1.1) if shared_tier() is not None else 1.0
+            await asyncio.sleep(self.refresh_interval * jitter)
+
+    def start(self) -> None:
+        if self.refresh_interval > 0 and self._loop_task is None:
+            self._loop_task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        for t in (self._loop_task, self._refreshing):
+            if t is not None and not t.done():
+                t.cancel()
+                await asyncio.gather(t, return_exceptions=True)
+        self._loop_task = None
+        self._refreshing = None
+
+
+_rate_cache: Optional[RateCache] = None
+
+
+def get_rate_cache() -> RateCache:
+    # Configuración por entorno (como cloudinary): la tasa no depende de Supabase
+    global _rate_cache
+    if _rate_cache is None:
+        raw = os.getenv("RATE_MIRRORS")
+        mirrors = [m.strip() for m in raw.split(",") if m.strip()] if raw else list(DEFAULT_MIRRORS)
+        interval = float(os.getenv("RATE_REFRESH_INTERVAL", "300"))
+        _rate_cache = RateCache(
+            mirrors,
+            refresh_interval=interval,
+            max_age=float(os.getenv("RATE_MAX_AGE", str(max(interval, 60.0) * 2))),
+            timeout=float(os.getenv("RATE_MIRROR_TIMEOUT", "8")),
+        )
+    return _rate_cache
@@ -0,0 +1,166 @@
+import math
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+
+class SupabaseUnavailable(Exception):
+    """El circuit breaker está abierto: se falla de inmediato sin llamar a Supabase.
+
+    main.py lo traduce a 503 con ``Retry-After``.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Supabase unavailable (circuit open, retry in {retry_after:.1f}s)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker por tasa de fallos en una ventana deslizante.
+
+    closed: deja pasar todo y cuenta llamadas/fallos en baldes de un segundo.
+    Si en los últimos ``window`` segundos hay al menos ``min_calls`` y la tasa
+    de fallos llega a ``threshold``, pasa a open: cada llamada lanza
+    ``SupabaseUnavailable`` sin tocar la red. Tras ``cooldown`` segundos deja
+    pasar una sola llamada de prueba (half-open): si sale bien se cierra, si
+    falla vuelve a abrirse.
+
+    Fallo es lo que indica que Supabase no está sano (error de red, timeout,
+    5xx); un 4xx es una respuesta válida. Solo desde el event loop, sin locks.
+    """
+
+    def __init__(self, threshold: float = 0.5, min_calls: int = 20, window: float = 10.0, cooldown: float = 5.0):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.window = max(1, int(window))
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probing = False
+        # [segundo, llamadas, fallos]
+        self._buckets: Deque[List[int]] = deque()
+        self.opens = 0
+        self.rejected = 0
+
+    def _bucket(self, now: float) -> List[int]:
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        while self._buckets[0][0] <= second - self.window:
+            self._buckets.popleft()
+        return self._buckets[-1]
+
+    def allow(self) -> bool:
+        """Lanza ``SupabaseUnavailable`` si hay que fallar rápido. Devuelve True si
+        la llamada es la prueba de half-open (hay que informar su resultado)."""
+        if self.state == "closed":
+            return False
+        wait = self.opened_at + self.cooldown - time.monotonic()
+        if wait > 0 or self._probing:
+            self.rejected += 1
+            raise SupabaseUnavailable(max(wait, 0.0) or self.cooldown)
+        self.state = "half_open"
+        self._probing = True
+        return True
+
+    def release_probe(self) -> None:
+        """La llamada de prueba se canceló sin resultado: la siguiente hace de prueba."""
+        self._probing = False
+
+    def record(self, failed: bool, probe: bool = False) -> None:
+        now = time.monotonic()
+        if probe:
+            self._probing = False
+            if failed:
+                self._open(now)
+            else:
+                self.state = "closed"
+                self._buckets.clear()
+            return
+        if self.state != "closed":
+            return
+        bucket = self._bucket(now)
+        bucket[1] += 1
+        if failed:
+            bucket[2] += 1
+            calls = sum(b[1] for b in self._buckets)
+            if calls >= self.min_calls and sum(b[2] for b in self._buckets) >= self.threshold * calls:
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self.opened_at = now
+        self.opens += 1
+        self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        calls = sum(b[1] for b in self._buckets)
+        failures = sum(b[2] for b in self._buckets)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "window_failures": failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+
+class RetryBudget:
+    """Presupuesto de reintentos: cada solicitud original deposita ``ratio`` fichas
+    y cada reintento (o request de cobertura) gasta una. Así los reintentos nunca
+    pasan de ~``ratio`` del tráfico y no multiplican la carga cuando Supabase ya
+    está saturado. ``reserve`` permite algunos reintentos con poco tráfico."""
+
+    def __init__(self, ratio: float = 0.1, reserve: float = 10.0):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+        self.spent = 0
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.tokens + self.ratio, self.reserve + 100 * self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.spent += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tokens": round(self.tokens, 2), "spent": self.spent, "exhausted": self.exhausted}
+
+
+class LatencyTracker:
+    """Últimas ``size`` latencias por operación y su p95, recalculado cada
+    ``every`` observaciones para no ordenar en cada llamada."""
+
+    def __init__(self, size: int = 200, every: int = 20):
+        self.size = size
+        self.every = every
+        self._samples: Dict[str, Deque[float]] = {}
+        self._p95: Dict[str, float] = {}
+        self._pending: Dict[str, int] = {}
+
+    def observe(self, op: str, seconds: float) -> None:
+        samples = self._samples.get(op)
+        if samples is None:
+            samples = self._samples[op] = deque(maxlen=self.size)
+        samples.append(seconds)
+        n = self._pending.get(op, 0) + 1
+        if n >= self.every:
+            ordered = sorted(samples)
+            self._p95[op] = ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+            n = 0
+        self._pending[op] = n
+
+    def p95(self, op: str) -> Optional[float]:
+        return self._p95.get(op)
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Backoff exponencial con jitter completo (attempt empieza en 1)."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
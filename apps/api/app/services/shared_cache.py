@@ -0,0 +1,350 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+
+
+logger = logging.getLogger("prizo.cache")
+
+_SCHEMA = """
+create table if not exists cache_entries (
+  ns text not null,
+  key text not null,
+  value blob not null,
+  expires_at real not null,
+  primary key (ns, key)
+) without rowid;
+create index if not exists cache_entries_expiry on cache_entries (expires_at);
+create table if not exists cache_invalidations (
+  id integer primary key autoincrement,
+  ns text not null,
+  op text not null,          -- key | clear | rule
+  arg blob,
+  origin text not null,
+  at real not null
+);
+create index if not exists cache_invalidations_ns on cache_invalidations (ns, id);
+-- Etiquetas de cada entrada por regla (p. ej. los pagos que contiene un resultado de
+-- /verify): invalidate_rule borra por etiqueta sin leer ni decodificar los valores
+create table if not exists cache_tags (
+  ns text not null,
+  rule text not null,
+  tag text not null,
+  key text not null,
+  primary key (ns, rule, tag, key)
+) without rowid;
+create index if not exists cache_tags_key on cache_tags (ns, key);
+"""
+
+# Etiquetas de una entrada: regla -> valores
+Tags = Dict[str, Iterable[str]]
+
+
+def encode_key(key: Any) -> str:
+    """Clave del cache en proceso -> texto estable (las tuplas quedan como listas JSON)."""
+    if isinstance(key, str) and not key.startswith(("[", '"')):
+        return key
+    return orjson.dumps(key).decode()
+
+
+def decode_key(raw: str) -> Any:
+    if not raw.startswith(("[", '"')):
+        return raw
+    key = orjson.loads(raw)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class SharedTier(ABC):
+    """Segundo nivel de los caches, compartido por los workers de un mismo despliegue,
+    y canal de invalidaciones entre ellos. Los valores viajan como JSON (orjson).
+
+    Las llamadas son síncronas y cortas (se hacen desde el event loop); un error
+    cuenta como fallo del nivel y la app sigue con su cache en proceso.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def get(self, ns: str, key: str) -> Optional[Tuple[bytes, float]]:
+        """(valor, vencimiento en epoch) o None."""
+        ...
+
+    @abstractmethod
+    def set(self, ns: str, key: str, value: bytes, ttl: float, unless_after: Optional[int] = None,
+            tags: Optional[Tags] = None) -> bool:
+        """Guarda la entrada (con sus ``tags``, ver ``delete_tagged``) salvo que ``ns``
+        haya tenido una invalidación posterior a ``unless_after`` (la carga empezó
+        antes del cambio y traería datos viejos)."""
+        ...
+
+    @abstractmethod
+    def claim(self, ns: str, key: str, ttl: float) -> bool:
+        """Toma la clave por ``ttl`` segundos si nadie la tiene (single-flight entre
+        workers: solo uno hace la carga y los demás leen su resultado)."""
+        ...
+
+    @abstractmethod
+    def scan(self, ns: str) -> List[Tuple[str, bytes]]:
+        ...
+
+    @abstractmethod
+    def delete(self, ns: str, keys: Iterable[str]) -> None:
+        ...
+
+    @abstractmethod
+    def delete_tagged(self, ns: str, rule: str, tags: Iterable[str]) -> int:
+        """Borra las entradas con alguna de ``tags`` para ``rule``; devuelve cuántas."""
+        ...
+
+    @abstractmethod
+    def clear(self, ns: str) -> None:
+        ...
+
+    @abstractmethod
+    def publish(self, ns: str, op: str, arg: Any, origin: str) -> None:
+        ...
+
+    @abstractmethod
+    def events(self, after: int, limit: int = 1000) -> List[Tuple[int, str, str, Any, str]]:
+        """Invalidaciones con id > ``after``: (id, ns, op, arg, origin)."""
+        ...
+
+    @abstractmethod
+    def last_event(self) -> int:
+        ...
+
+    @abstractmethod
+    def purge(self, keep_events: float) -> int:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class SQLiteTier(SharedTier):
+    """Nivel compartido en un archivo SQLite (WAL) en el mismo host: cada worker abre
+    su conexión y las lecturas no esperan a las escrituras. ``synchronous=normal``:
+    es un cache, perder lo último escrito ante un corte de luz no importa."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 0.05):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        try:
+            self._conn.executescript(_SCHEMA)
+        except sqlite3.OperationalError:
+            # Otro worker creando el esquema al mismo tiempo
+            time.sleep(busy_timeout)
+            self._conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        self._conn.execute("begin")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("rollback")
+            raise
+        self._conn.execute("commit")
+
+    def get(self, ns: str, key: str) -> Optional[Tuple[bytes, float]]:
+        return self._conn.execute(
+            "select value, expires_at from cache_entries where ns = ? and key = ? and expires_at > ?",
+            (ns, key, time.time()),
+        ).fetchone()
+
+    def set(self, ns: str, key: str, value: bytes, ttl: float, unless_after: Optional[int] = None,
+            tags: Optional[Tags] = None) -> bool:
+        with self._tx() as conn:
+            if unless_after is None:
+                conn.execute(
+                    "insert or replace into cache_entries (ns, key, value, expires_at) values (?, ?, ?, ?)",
+                    (ns, key, value, time.time() + ttl),
+                )
+            else:
+                cur = conn.execute(
+                    "insert or replace into cache_entries (ns, key, value, expires_at)"
+                    " select ?, ?, ?, ? where not exists (select 1 from cache_invalidations where ns = ? and id > ?)",
+                    (ns, key, value, time.time() + ttl, ns, unless_after),
+                )
+                if cur.rowcount <= 0:
+                    return False
+            conn.execute("delete from cache_tags where ns = ? and key = ?", (ns, key))
+            if tags:
+                conn.executemany(
+                    "insert or ignore into cache_tags (ns, rule, tag, key) values (?, ?, ?, ?)",
+                    [(ns, rule, tag, key) for rule, values in tags.items() for tag in values],
+                )
+        return True
+
+    def claim(self, ns: str, key: str, ttl: float) -> bool:
+        now = time.time()
+        self._conn.execute("delete from cache_entries where ns = ? and key = ? and expires_at <= ?", (ns, key, now))
+        cur = self._conn.execute(
+            "insert or ignore into cache_entries (ns, key, value, expires_at) values (?, ?, x'', ?)",
+            (ns, key, now + ttl),
+        )
+        return cur.rowcount > 0
+
+    def scan(self, ns: str) -> List[Tuple[str, bytes]]:
+        return self._conn.execute(
+            "select key, value from cache_entries where ns = ? and expires_at > ?", (ns, time.time())
+        ).fetchall()
+
+    def delete(self, ns: str, keys: Iterable[str]) -> None:
+        pairs = [(ns, k) for k in keys]
+        with self._tx() as conn:
+            conn.executemany("delete from cache_entries where ns = ? and key = ?", pairs)
+            conn.executemany("delete from cache_tags where ns = ? and key = ?", pairs)
+
+    def delete_tagged(self, ns: str, rule: str, tags: Iterable[str]) -> int:
+        tags = list(tags)
+        if not tags:
+            return 0
+        with self._tx() as conn:
+            keys: set = set()
+            # De a 500 para no pasar el límite de parámetros de SQLite
+            for i in range(0, len(tags), 500):
+                chunk = tags[i:i + 500]
+                keys.update(k for (k,) in conn.execute(
+                    f"select key from cache_tags where ns = ? and rule = ? and tag in ({','.join('?' * len(chunk))})",
+                    (ns, rule, *chunk),
+                ))
+            pairs = [(ns, k) for k in keys]
+            conn.executemany("delete from cache_entries where ns = ? and key = ?", pairs)
+            conn.executemany("delete from cache_tags where ns = ? and key = ?", pairs)
+        return len(keys)
+
+    def clear(self, ns: str) -> None:
+        with self._tx() as conn:
+            conn.execute("delete from cache_entries where ns = ?", (ns,))
+            conn.execute("delete from cache_tags where ns = ?", (ns,))
+
+    def publish(self, ns: str, op: str, arg: Any, origin: str) -> None:
+        self._conn.execute(
+            "insert into cache_invalidations (ns, op, arg, origin, at) values (?, ?, ?, ?, ?)",
+            (ns, op, orjson.dumps(arg), origin, time.time()),
+        )
+
+    def events(self, after: int, limit: int = 1000) -> List[Tuple[int, str, str, Any, str]]:
+        rows = self._conn.execute(
+            "select id, ns, op, arg, origin from cache_invalidations where id > ? order by id limit ?", (after, limit)
+        ).fetchall()
+        return [(i, ns, op, orjson.loads(arg) if arg is not None else None, origin) for i, ns, op, arg, origin in rows]
+
+    def last_event(self) -> int:
+        return self._conn.execute("select coalesce(max(id), 0) from cache_invalidations").fetchone()[0]
+
+    def purge(self, keep_events: float) -> int:
+        now = time.time()
+        n = self._conn.execute("delete from cache_entries where expires_at <= ?", (now,)).rowcount
+        self._conn.execute(
+            "delete from cache_tags where not exists"
+            " (select 1 from cache_entries e where e.ns = cache_tags.ns and e.key = cache_tags.key)"
+        )
+        # Siempre queda la última, para que el id no vuelva a empezar
+        self._conn.execute(
+            "delete from cache_invalidations where at < ? and id < (select max(id) from cache_invalidations)",
+            (now - keep_events,),
+        )
+        return n
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._conn.execute("select count(*) from cache_entries").fetchone()[0]
+        return {"backend": self.name, "path": self.path, "entries": entries, "last_event": self.last_event()}
+
+
+class InvalidationListener:
+    """Aplica en este worker las invalidaciones publicadas por los demás: cada
+    ``interval`` segundos lee las nuevas y las pasa a los caches en proceso por
+    nombre. También purga periódicamente entradas vencidas e invalidaciones viejas.
+
+    Una invalidación tarda a lo sumo ``interval`` en llegar a los otros workers
+    (el worker que la origina la aplica al instante).
+    """
+
+    def __init__(self, tier: SharedTier, origin: str, interval: float = 0.1,
+                 purge_interval: float = 60.0, keep_events: float = 600.0):
+        self.tier = tier
+        self.origin = origin
+        self.interval = interval
+        self.purge_interval = purge_interval
+        self.keep_events = keep_events
+        # Solo lo posterior al arranque: el cache en proceso empieza vacío
+        self.last_id = tier.last_event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = time.monotonic()
+        self._stats = {"polls": 0, "applied": 0, "purged": 0, "errors": 0}
+
+    def poll(self) -> int:
+        from .cache import get_cache
+
+        applied = 0
+        while True:
+            events = self.tier.events(self.last_id)
+            for event_id, ns, op, arg, origin in events:
+                self.last_id = event_id
+                cache = get_cache(ns)
+                if origin == self.origin or cache is None:
+                    continue
+                cache.apply_remote(op, arg)
+                applied += 1
+            if len(events) < 1000:
+                break
+        self._stats["polls"] += 1
+        self._stats["applied"] += applied
+        if time.monotonic() - self._last_purge > self.purge_interval:
+            self._last_purge = time.monotonic()
+            self._stats["purged"] += self.tier.purge(self.keep_events)
+        return applied
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning("cache invalidation poll failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"interval_seconds": self.interval, "last_event": self.last_id, **self._stats}
+
+
+def new_origin() -> str:
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def open_tier(backend: str, path: str) -> Optional[SharedTier]:
+    """Nivel compartido según CACHE_SHARED_BACKEND; None con "none" o desconocido."""
+    if backend == "sqlite":
+        return SQLiteTier(path)
+    if backend not in ("", "none"):
+        logger.warning("unknown CACHE_SHARED_BACKEND %r, using in-process caches only", backend)
+    return None
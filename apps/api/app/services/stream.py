@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+import weakref
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import orjson
+
+from ..core.config import get_settings
+from .availability import AvailabilitySnapshot, get_availability_store
+
+
+logger = logging.getLogger("prizo.stream")
+
+
+class StreamLimitError(Exception):
+    """Se alcanzó el máximo de suscriptores SSE del proceso."""
+
+
+def _frame(event: str, version: str, payload: Dict) -> bytes:
+    head = f"id: {version}\nevent: {event}\ndata: ".encode("utf-8")
+    return head + orjson.dumps(payload) + b"\n\n"
+
+
+class RaffleChannel:
+    """Difusión de cambios de una rifa a sus suscriptores.
+
+    Un solo task por rifa revisa la versión del snapshot cada ``batch_interval``
+    y, si cambió, despierta a todos los suscriptores con un único future
+    compartido. Cada suscriptor envía los cambios desde la última versión que
+    entregó: un cliente lento no acumula cola, al ponerse al día recibe un solo
+    delta coalescido (o el estado completo si quedó fuera del registro). Los
+    frames se serializan una vez por (versión origen, encoding) y se comparten.
+    """
+
+    def __init__(self, raffle_id: str, batch_interval: float, reconcile_interval: float):
+        self.raffle_id = raffle_id
+        self.batch_interval = batch_interval
+        self.reconcile_interval = reconcile_interval
+        self.subscribers = 0
+        self.broadcasts = 0
+        self.tick: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._frames: Dict[Tuple[str, str, str], bytes] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def frame(self, snap: AvailabilitySnapshot, since: Optional[str], encoding: str) -> bytes:
+        key = (snap.version, since or "", encoding)
+        cached = self._frames.get(key)
+        if cached is not None:
+            return cached
+        changes = snap.changes_since(since)
+        if changes is None:
+            out = snap.render(f"sse:{encoding}", lambda: _frame("snapshot", snap.version, {
+                "version": snap.version, "size": len(snap.codes), "counts": snap.counts(),
+                "encoding": encoding, "data": snap.encode(encoding),
+            }))
+        else:
+            out = _frame("changes", snap.version, {"version": snap.version, "counts": snap.counts(), "changes": changes})
+        if len(self._frames) > 256:
+            self._frames.clear()
+        self._frames[key] = out
+        return out
+
+    def _broadcast(self) -> None:
+        self.broadcasts += 1
+        self._frames.clear()
+        tick, self.tick = self.tick, asyncio.get_running_loop().create_future()
+        tick.set_result(None)
+
+    async def _run(self) -> None:
+        store = get_availability_store()
+        last_version: Optional[str] = None
+        last_reconcile = time.monotonic()
+        while self.subscribers > 0:
+            await asyncio.sleep(self.batch_interval)
+            try:
+                if time.monotonic() - last_reconcile >= self.reconcile_interval:
+                    # Reconciliación periódica: recoge cambios hechos fuera de esta API
+                    last_reconcile = time.monotonic()
+                    store.refresh(self.raffle_id)
+                snap = store.peek(self.raffle_id)
+                if snap is None:
+                    snap = await store.get(self.raffle_id)
+            except Exception as e:
+                logger.warning("stream %s: snapshot unavailable: %s", self.raffle_id, e)
+                continue
+            if snap.version != last_version:
+                last_version = snap.version
+                self._broadcast()
+        self._task = None
+
+    def join(self) -> None:
+        self.subscribers += 1
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def leave(self) -> None:
+        self.subscribers -= 1
+
+
+class StreamHub:
+    def __init__(self, batch_interval: float = 0.2, reconcile_interval: float = 30.0,
+                 heartbeat: float = 15.0, max_subscribers: int = 5000):
+        self.batch_interval = batch_interval
+        self.reconcile_interval = reconcile_interval
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self.channels: Dict[str, RaffleChannel] = {}
+        self.subscribers = 0
+
+    def _channel(self, raffle_id: str) -> RaffleChannel:
+        channel = self.channels.get(raffle_id)
+        if channel is None:
+            channel = RaffleChannel(raffle_id, self.batch_interval, self.reconcile_interval)
+            self.channels[raffle_id] = channel
+        return channel
+
+    async def subscribe(self, raffle_id: str, since: Optional[str] = None, encoding: str = "rle") -> AsyncIterator[bytes]:
+        """Generador SSE: primero el estado (o el delta desde ``since``), luego los cambios."""
+        if self.subscribers >= self.max_subscribers:
+            raise StreamLimitError()
+        # El cupo se toma antes del primer await: en una ráfaga de conexiones (snapshot
+        # en frío) todas pasarían el control antes de que alguna se sume
+        self.subscribers += 1
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.subscribers -= 1
+
+        store = get_availability_store()
+        try:
+            snap = await store.get(raffle_id)
+        except BaseException:
+            release()
+            raise
+
+        async def events() -> AsyncIterator[bytes]:
+            nonlocal snap
+            version = since
+            # El alta en el canal va dentro del generador: si nunca se itera (cliente
+            # desconectado antes de empezar la respuesta) no queda nada que dar de baja
+            channel = self._channel(raffle_id)
+            channel.join()
+            try:
+                yield b"retry: 3000\n\n"
+                while True:
+                    # El tick se toma antes de mirar la versión para no perder un aviso
+                    tick = channel.tick
+                    snap = store.peek(raffle_id) or snap
+                    if snap.version != version:
+                        # El snapshot se modifica en el lugar: la versión enviada se toma
+                        # antes del yield. Si el envío se bloqueó (cliente lento), la
+                        # próxima vuelta manda de una vez todo lo acumulado desde ahí
+                        sent = snap.version
+                        yield channel.frame(snap, version, encoding)
+                        version = sent
+                        continue
+                    try:
+                        await asyncio.wait_for(asyncio.shield(tick), timeout=self.heartbeat)
+                    except asyncio.TimeoutError:
+                        yield b": ping\n\n"
+            finally:
+                release()
+                channel.leave()
+                if channel.subscribers <= 0 and self.channels.get(raffle_id) is channel:
+                    del self.channels[raffle_id]
+
+        gen = events()
+        # Un generador que nunca arrancó no corre su finally: el cupo se suelta al recolectarlo
+        weakref.finalize(gen, release)
+        return gen
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": self.subscribers,
+            "channels": {rid: {"subscribers": c.subscribers, "broadcasts": c.broadcasts} for rid, c in self.channels.items()},
+        }
+
+
+_hub: Optional[StreamHub] = None
+
+
+def get_stream_hub() -> StreamHub:
+    global _hub
+    if _hub is None:
+        s = get_settings()
+        _hub = StreamHub(
+            batch_interval=s.STREAM_BATCH_INTERVAL,
+            reconcile_interval=s.AVAILABILITY_TTL,
+            heartbeat=s.STREAM_HEARTBEAT,
+            max_subscribers=s.STREAM_MAX_SUBSCRIBERS,
+        )
+    return _hub
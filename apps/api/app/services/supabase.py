@@ -1,12 +1,86 @@
+import asyncio
 import httpx
-from typing import Any, Dict, Optional
-from ..core.config import get_settings
+import orjson
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from ..core.config import Settings, get_settings
+from .metrics import observe_supabase, register_collector, supabase_hedges, supabase_retries
+from .resilience import CircuitBreaker, LatencyTracker, RetryBudget, SupabaseUnavailable, backoff
+
+
+# Respuestas de lectura que vale la pena reintentar (gateway/instancia caída o saturada)
+RETRY_STATUSES = (502, 503, 504)
+
+
+def _decode(res: httpx.Response) -> Any:
+    """Cuerpo JSON con orjson (más rápido que ``res.json()`` en listas grandes). Un
+    cuerpo vacío (RPC que devuelve void) es None."""
+    return orjson.loads(res.content) if res.content else None
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Timestamp de PostgREST (ISO 8601, p. ej. ``reserved_until``) -> epoch en segundos."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def build_http_client(s: Settings) -> httpx.AsyncClient:
+    """Crea el cliente HTTP asíncrono compartido (pool con keep-alive y HTTP/2)."""
+    limits = httpx.Limits(
+        max_connections=s.SUPABASE_POOL_SIZE,
+        max_keepalive_connections=s.SUPABASE_KEEPALIVE,
+        keepalive_expiry=s.SUPABASE_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(http2=s.SUPABASE_HTTP2, limits=limits, timeout=s.SUPABASE_TIMEOUT)
 
 
 class SupabaseClient:
-    def __init__(self, url: str, service_key: str):
+    """Cliente PostgREST con la capa de resiliencia del proceso.
+
+    - Timeouts por operación: las lecturas usan ``read_timeout``; los RPC y
+      updates, el timeout del pool (no son idempotentes y pueden tardar más).
+    - Reintentos con backoff y jitter solo en lecturas (``get_one``/``get_many`` y
+      RPC marcados ``read=True``), ante errores de red o 502/503/504, dentro de
+      un presupuesto global de reintentos.
+    - Circuit breaker: con la tasa de fallos alta, todas las llamadas fallan en
+      el acto con ``SupabaseUnavailable`` (503) en lugar de esperar el timeout.
+    - Hedging opcional de lecturas: si la primera no respondió en el p95
+      reciente de esa operación, se lanza una segunda y gana la primera.
+
+    Sin breaker/budget (el default) se comporta como un cliente sin reintentos.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        service_key: str,
+        http: httpx.AsyncClient,
+        read_timeout: Optional[float] = None,
+        read_retries: int = 0,
+        retry_base: float = 0.05,
+        retry_max: float = 1.0,
+        budget: Optional[RetryBudget] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: bool = False,
+        hedge_min_delay: float = 0.05,
+    ):
         self.base_url = url.rstrip("/")
         self.service_key = service_key
+        self.http = http
+        self.read_timeout = read_timeout
+        self.read_retries = read_retries if budget is not None else 0
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.budget = budget
+        self.breaker = breaker
+        self.hedge = hedge and budget is not None
+        self.hedge_min_delay = hedge_min_delay
+        self.latency = LatencyTracker()
 
     def _headers(self) -> Dict[str, str]:
         return {
@@ -16,30 +90,116 @@ class SupabaseClient:
             "Accept": "application/json",
         }
 
-    def call_rpc(self, name: str, payload: Dict[str, Any]) -> Any:
+    async def _send(self, kind: str, name: str, method: str, url: str, not_found_ok: bool = False, **kwargs: Any) -> httpx.Response:
+        """Hace la solicitud y registra duración y resultado por RPC/tabla (/metrics).
+        Con ``not_found_ok`` un 404/406 (sin filas) no cuenta como error."""
+        probe = self.breaker.allow() if self.breaker is not None else False
+        started = time.perf_counter()
+        try:
+            res = await self.http.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            observe_supabase(kind, name, started, None, type(e).__name__)
+            if self.breaker is not None:
+                self.breaker.record(True, probe)
+            raise
+        except BaseException:
+            # Cancelada (p. ej. la request perdedora de un hedge): no dice nada de Supabase
+            if probe:
+                self.breaker.release_probe()
+            raise
+        failed = res.status_code >= 400 and not (not_found_ok and res.status_code in (404, 406))
+        observe_supabase(kind, name, started, res.status_code, str(res.status_code) if failed else None)
+        if self.breaker is not None:
+            self.breaker.record(res.status_code >= 500, probe)
+        if res.status_code < 500:
+            self.latency.observe(f"{kind}:{name}", time.perf_counter() - started)
+        return res
+
+    async def _read(self, kind: str, name: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Lectura idempotente: timeout de lectura, reintentos y hedging."""
+        if self.read_timeout is not None:
+            kwargs.setdefault("timeout", self.read_timeout)
+        if self.budget is not None:
+            self.budget.deposit()
+        attempt = 0
+        while True:
+            error: Optional[httpx.TransportError] = None
+            try:
+                if self.hedge:
+                    res = await self._hedged(kind, name, method, url, **kwargs)
+                else:
+                    res = await self._send(kind, name, method, url, **kwargs)
+                if res.status_code not in RETRY_STATUSES:
+                    return res
+            except httpx.TransportError as e:
+                error = e
+            if attempt >= self.read_retries or not self.budget.withdraw():
+                if error is not None:
+                    raise error
+                return res
+            attempt += 1
+            supabase_retries.inc((kind, name))
+            await asyncio.sleep(backoff(attempt, self.retry_base, self.retry_max))
+
+    async def _hedged(self, kind: str, name: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        delay = self.latency.p95(f"{kind}:{name}")
+        if delay is None:
+            return await self._send(kind, name, method, url, **kwargs)
+        first = asyncio.ensure_future(self._send(kind, name, method, url, **kwargs))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(delay, self.hedge_min_delay))
+            if done or not self.budget.withdraw():
+                return await first
+            supabase_hedges.inc((kind, name))
+            tasks.add(asyncio.ensure_future(self._send(kind, name, method, url, **kwargs)))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        return task.result()
+                if not pending:
+                    # Las dos fallaron: se propaga el resultado de la última
+                    return task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "read_timeout": self.read_timeout,
+            "read_retries": self.read_retries,
+            "hedge": self.hedge,
+            "breaker": self.breaker.stats() if self.breaker is not None else None,
+            "retry_budget": self.budget.stats() if self.budget is not None else None,
+        }
+
+    async def call_rpc(self, name: str, payload: Dict[str, Any], read: bool = False) -> Any:
+        """``read=True`` solo para funciones sin efectos (se pueden reintentar)."""
         url = f"{self.base_url}/rest/v1/rpc/{name}"
-        with httpx.Client(timeout=20.0) as client:
-            res = client.post(url, json=payload, headers=self._headers())
-            res.raise_for_status()
-            return res.json()
+        send = self._read if read else self._send
+        res = await send("rpc", name, "POST", url, content=orjson.dumps(payload), headers=self._headers())
+        res.raise_for_status()
+        return _decode(res)
 
-    def get_one(self, table: str, params: Dict[str, str], select: str = "*") -> Optional[Dict[str, Any]]:
+    async def get_one(self, table: str, params: Dict[str, str], select: str = "*") -> Optional[Dict[str, Any]]:
         url = f"{self.base_url}/rest/v1/{table}"
         headers = self._headers()
         headers.update({"Prefer": "return=representation,single-object"})
         query = {"select": select}
         query.update(params)
-        with httpx.Client(timeout=20.0) as client:
-            res = client.get(url, headers=headers, params=query)
-            if res.status_code in (404, 406):
-                return None
-            res.raise_for_status()
-            data = res.json()
-            if isinstance(data, list):
-                return data[0] if data else None
-            return data
-
-    def get_many(self, table: str, params: Dict[str, str], select: str = "*") -> Any:
+        res = await self._read("select", table, "GET", url, not_found_ok=True, headers=headers, params=query)
+        if res.status_code in (404, 406):
+            return None
+        res.raise_for_status()
+        data = _decode(res)
+        if isinstance(data, list):
+            return data[0] if data else None
+        return data
+
+    async def get_many(self, table: str, params: Dict[str, str], select: str = "*") -> Any:
         """Consulta PostgREST con soporte de embeds (select con relaciones) y filtros.
         Devuelve lista JSON tal cual.
         """
@@ -47,36 +207,94 @@ class SupabaseClient:
         headers = self._headers()
         query = {"select": select}
         query.update(params)
-        with httpx.Client(timeout=25.0) as client:
-            res = client.get(url, headers=headers, params=query)
-            if res.status_code in (404, 406):
-                return []
-            res.raise_for_status()
-            return res.json()
-
-    def update_one(self, table: str, where: Dict[str, str], data: Dict[str, Any]) -> Any:
+        res = await self._read("select", table, "GET", url, not_found_ok=True, headers=headers, params=query)
+        if res.status_code in (404, 406):
+            return []
+        res.raise_for_status()
+        return _decode(res)
+
+    async def update_one(self, table: str, where: Dict[str, str], data: Dict[str, Any]) -> Any:
         """Actualiza una fila usando PostgREST con service key y devuelve la representación.
         Ejemplo de 'where': {"id": "eq.<uuid>"}
         """
         url = f"{self.base_url}/rest/v1/{table}"
         headers = self._headers()
         headers.update({"Prefer": "return=representation"})
-        with httpx.Client(timeout=20.0) as client:
-            res = client.patch(url, headers=headers, params=where, json=data)
-            res.raise_for_status()
-            return res.json()
+        res = await self._send("update", table, "PATCH", url, headers=headers, params=where, content=orjson.dumps(data))
+        res.raise_for_status()
+        return _decode(res)
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+
+# Cliente único por proceso: se crea en el lifespan de la app (ver main.py) y se
+# reutiliza en todas las solicitudes para aprovechar el pool de conexiones.
+_client: Optional[SupabaseClient] = None
+
+
+def init_supabase() -> SupabaseClient:
+    global _client
+    if _client is None:
+        s = get_settings()
+        breaker = None
+        if s.SUPABASE_BREAKER_ENABLED:
+            breaker = CircuitBreaker(
+                threshold=s.SUPABASE_BREAKER_THRESHOLD, min_calls=s.SUPABASE_BREAKER_MIN_CALLS,
+                window=s.SUPABASE_BREAKER_WINDOW, cooldown=s.SUPABASE_BREAKER_COOLDOWN,
+            )
+        _client = SupabaseClient(
+            url=s.SUPABASE_URL,
+            service_key=s.SUPABASE_SERVICE_KEY,
+            http=build_http_client(s),
+            read_timeout=s.SUPABASE_READ_TIMEOUT,
+            read_retries=s.SUPABASE_READ_RETRIES,
+            retry_base=s.SUPABASE_RETRY_BASE,
+            retry_max=s.SUPABASE_RETRY_MAX,
+            budget=RetryBudget(ratio=s.SUPABASE_RETRY_BUDGET),
+            breaker=breaker,
+            hedge=s.SUPABASE_HEDGE,
+            hedge_min_delay=s.SUPABASE_HEDGE_MIN_DELAY,
+        )
+    return _client
+
+
+async def close_supabase() -> None:
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
 
 
 def get_supabase() -> SupabaseClient:
-    s = get_settings()
-    return SupabaseClient(url=s.SUPABASE_URL, service_key=s.SUPABASE_SERVICE_KEY)
+    # Creación perezosa por si se usa fuera del lifespan (scripts, consola)
+    return _client if _client is not None else init_supabase()
+
+
+def _breaker_metrics() -> List[str]:
+    breaker = _client.breaker if _client is not None else None
+    if breaker is None:
+        return []
+    name = "prizo_supabase_circuit_open"
+    return [f"# HELP {name} 1 si el circuit breaker hacia Supabase está abierto (falla rápido)",
+            f"# TYPE {name} gauge", f"{name} {0 if breaker.state == 'closed' else 1}"]
+
+
+register_collector(_breaker_metrics)
+
+
+async def approve_payment(payment_id: str, approved_by: str) -> Any:
+    sb = get_supabase()
+    return await sb.call_rpc("approve_payment", {"p_payment_id": payment_id, "p_approved_by": approved_by})
 
 
-def approve_payment(payment_id: str, approved_by: str) -> Any:
+async def approve_payments(payment_ids: List[str], approved_by: str) -> List[Dict[str, Any]]:
+    """Aprobación en lote (patch_approve_payments_bulk.sql): una fila por pago con
+    ``outcome`` y los ``ticket_ids`` que pasaron a vendidos."""
     sb = get_supabase()
-    return sb.call_rpc("approve_payment", {"p_payment_id": payment_id, "p_approved_by": approved_by})
+    return await sb.call_rpc("approve_payments", {"p_payment_ids": payment_ids, "p_approved_by": approved_by}) or []
 
 
-def find_payment_by_reference(reference: str) -> Optional[Dict[str, Any]]:
+async def reject_payments(payment_ids: List[str], rejected_by: str) -> List[Dict[str, Any]]:
     sb = get_supabase()
-    return sb.get_one("payments", {"reference": f"eq.{reference}"}, select="id, reference, status")
+    return await sb.call_rpc("reject_payments", {"p_payment_ids": payment_ids, "p_rejected_by": rejected_by}) or []
@@ -0,0 +1,426 @@
+import asyncio
+import base64
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+import orjson
+
+from ..core.config import get_settings
+from .cache import TTLCache
+from .supabase import get_supabase
+
+
+logger = logging.getLogger("prizo.verify")
+
+PENDING_STATUSES = ("pending", "underpaid", "overpaid", "ref_mismatch")
+
+# Embedding: payment_tickets con joins a payments (inner) y tickets (y raffles desde tickets)
+EMBED_SELECT = (
+    "payments!inner(id,email,ci,status,created_at),"
+    "tickets(id,ticket_number,status,raffle_id,raffles(name))"
+)
+
+PROBE_QUERY = "__prizo_probe__"
+
+# Errores de PostgREST que indican que el esquema cambió desde el sondeo: función
+# inexistente o con otra firma (PGRST202, 42883) y columna inexistente (42703)
+SCHEMA_ERROR_CODES = ("PGRST202", "42883", "42703")
+
+# Posición en el orden de verify_tickets: (created_at, raffle_name, ticket_number, ticket_id)
+Cursor = Tuple[str, str, str, str]
+
+
+def row_cursor(row: Dict[str, Any]) -> Cursor:
+    return (
+        str(row.get("created_at") or ""),
+        str(row.get("raffle_name") or ""),
+        str(row.get("ticket_number") or ""),
+        str(row.get("ticket_id") or ""),
+    )
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Cursor opaco (base64url de JSON) que apunta justo después de ``row``."""
+    return base64.urlsafe_b64encode(orjson.dumps(row_cursor(row))).rstrip(b"=").decode()
+
+
+def decode_cursor(value: str) -> Cursor:
+    """Inverso de encode_cursor; ``ValueError`` si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        parts = orjson.loads(raw)
+    except (ValueError, orjson.JSONDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    # created_at vacío: fila de un pago sin fecha (payments.created_at admite null)
+    if not isinstance(parts, list) or len(parts) != 4 or not all(isinstance(x, str) for x in parts):
+        raise ValueError("invalid cursor")
+    return tuple(parts)  # type: ignore[return-value]
+
+
+def page_rows(rows: List[Dict[str, Any]], after: Optional[Cursor], limit: Optional[int]) -> List[Dict[str, Any]]:
+    """Paginación en proceso para las rutas sin keyset en la base (fallback embebido o
+    RPC sin patch_verify_tickets_paged.sql): mismo orden y mismo cursor que el RPC."""
+    ordered = sorted(rows, key=lambda r: row_cursor(r)[1:])
+    # created_at desc con los vacíos (null) primero, como nulls first en el RPC
+    ordered.sort(key=lambda r: (not row_cursor(r)[0], row_cursor(r)[0]), reverse=True)
+    if after is not None:
+        ordered = [r for r in ordered if _is_after(row_cursor(r), after)]
+    return ordered if limit is None else ordered[:limit]
+
+
+def _is_after(pos: Cursor, after: Cursor) -> bool:
+    # created_at desc con los vacíos primero; el resto asc
+    if pos[0] == after[0]:
+        return pos[1:] > after[1:]
+    if not after[0]:
+        return True
+    return bool(pos[0]) and pos[0] < after[0]
+
+
+def _schema_changed(e: httpx.HTTPStatusError) -> bool:
+    """True si el error es de esquema (re-planificar); no si la consulta era mala."""
+    if e.response is None:
+        return False
+    if e.response.status_code == 404:
+        return True
+    try:
+        code = e.response.json().get("code")
+    except Exception:
+        return False
+    return code in SCHEMA_ERROR_CODES
+
+
+class VerifyTrace:
+    """Ruta usada y tiempos por etapa (ms) de una búsqueda, para logs y Server-Timing."""
+
+    def __init__(self) -> None:
+        self.path: Optional[str] = None
+        self.stages: List[Tuple[str, float]] = []
+
+    def add(self, stage: str, started: float) -> None:
+        self.stages.append((stage, (time.perf_counter() - started) * 1000.0))
+
+    def server_timing(self) -> str:
+        parts = []
+        for stage, ms in self.stages:
+            desc = f';desc="{self.path}"' if stage == "query" and self.path else ""
+            parts.append(f"{stage}{desc};dur={ms:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"path": self.path, "stages_ms": {stage: round(ms, 2) for stage, ms in self.stages}}
+
+
+class VerifyEngine:
+    """Busca tickets por email o cédula con una sola consulta planificada.
+
+    Al arrancar se detecta una vez si existe el RPC ``verify_tickets`` y la
+    columna ``payments.ci``; cada búsqueda ejecuta solo la ruta elegida en
+    lugar de encadenar intentos.
+    """
+
+    def __init__(self) -> None:
+        self.has_rpc: Optional[bool] = None
+        self.has_ci: Optional[bool] = None
+        # verify_tickets acepta p_limit / p_after_* (patch_verify_tickets_paged.sql)
+        self.has_paging = False
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @property
+    def probed(self) -> bool:
+        return self.has_rpc is not None and self.has_ci is not None
+
+    async def _probe(self) -> None:
+        sb = get_supabase()
+        has_rpc = has_paging = False
+        for payload in ({"p_limit": 1}, {}):
+            try:
+                await sb.call_rpc("verify_tickets", {"p_query": PROBE_QUERY, "p_include_pending": False, **payload})
+                has_rpc, has_paging = True, bool(payload)
+                break
+            except httpx.HTTPStatusError as e:
+                # 404 (PGRST202): la función no está instalada o no tiene esa firma
+                # (sin p_limit: falta el patch de paginación); se prueba la firma original
+                logger.warning("verify probe: rpc%s unavailable (%s)", " paging" if payload else "", e.response.status_code)
+        try:
+            await sb.get_many("payments", {"limit": "0"}, select="ci")
+            has_ci = True
+        except httpx.HTTPStatusError as e:
+            # 400 (42703): la columna ci no existe
+            logger.warning("verify probe: payments.ci unavailable (%s)", e.response.status_code)
+            has_ci = False
+        self.has_rpc, self.has_ci, self.has_paging = has_rpc, has_ci, has_paging
+        logger.info("verify probe: rpc=%s paging=%s ci=%s -> path=%s", has_rpc, has_paging, has_ci, self.plan())
+
+    def probe(self) -> asyncio.Task:
+        """Detecta capacidades una sola vez (single-flight). Errores de red no se
+        memorizan: el siguiente uso vuelve a intentarlo."""
+        if self._probe_task is None or (self._probe_task.done() and not self.probed):
+            self._probe_task = asyncio.ensure_future(self._probe())
+        return self._probe_task
+
+    async def warm(self) -> None:
+        """Sondeo en segundo plano al arrancar; los errores solo se registran."""
+        try:
+            await self.probe()
+        except Exception as e:
+            logger.warning("verify probe failed at startup: %s", e)
+
+    def reset(self) -> None:
+        self.has_rpc = None
+        self.has_ci = None
+        self.has_paging = False
+        self._probe_task = None
+
+    def plan(self) -> str:
+        if self.has_rpc:
+            return "rpc"
+        return "embedded" if self.has_ci else "embedded_email"
+
+    async def lookup(
+        self, q: str, include_pending: bool = True, limit: Optional[int] = None, after: Optional[Cursor] = None
+    ) -> Tuple[List[Dict[str, Any]], VerifyTrace]:
+        """Filas de la búsqueda en el orden de verify_tickets. Con ``limit``/``after``
+        devuelve solo esa página: en la base si el RPC pagina, si no en proceso."""
+        trace = VerifyTrace()
+        if not self.probed:
+            started = time.perf_counter()
+            await asyncio.shield(self.probe())
+            trace.add("probe", started)
+
+        trace.path = self.plan()
+        started = time.perf_counter()
+        try:
+            rows = await self._run(trace.path, q, include_pending, limit, after)
+        except httpx.HTTPStatusError as e:
+            # El esquema cambió desde el sondeo (RPC o columna eliminados): re-planificar una
+            # vez. Otro 400 es de la consulta misma y no toca el plan del proceso
+            if not _schema_changed(e):
+                raise
+            logger.warning("verify: path %s failed with %s, re-probing", trace.path, e.response.status_code)
+            failed = trace.path
+            self.reset()
+            await asyncio.shield(self.probe())
+            trace.path = self.plan()
+            if trace.path == failed:
+                raise
+            rows = await self._run(trace.path, q, include_pending, limit, after)
+        trace.add("query", started)
+
+        paged_in_db = trace.path == "rpc" and self.has_paging
+        if trace.path == "rpc" and (paged_in_db or (limit is None and after is None)):
+            return rows, trace
+        started = time.perf_counter()
+        out = rows if trace.path == "rpc" else shape_rows(rows)
+        if limit is not None or after is not None:
+            out = page_rows(out, after, limit)
+        trace.add("shape", started)
+        return out, trace
+
+    async def pages(
+        self,
+        q: str,
+        include_pending: bool = True,
+        page_size: int = 500,
+        after: Optional[Cursor] = None,
+        max_page_size: Optional[int] = None,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Recorre la búsqueda completa por páginas sin tenerla entera en memoria: con
+        el RPC paginado, una llamada por página con el cursor de la anterior (la
+        siguiente se pide mientras se entrega la actual); en las otras rutas la base
+        devuelve todo junto y solo se entrega por partes.
+
+        La primera página es de ``page_size`` filas (llega rápido) y cada una duplica
+        la anterior hasta ``max_page_size``, así un comprador con miles de tickets no
+        paga una llamada a Supabase cada ``page_size`` filas."""
+        max_page_size = max(page_size, max_page_size or page_size)
+        if not self.probed:
+            await asyncio.shield(self.probe())
+        if not (self.plan() == "rpc" and self.has_paging):
+            rows, _ = await self.lookup(q, include_pending, after=after)
+            for i in range(0, len(rows), page_size):
+                yield rows[i:i + page_size]
+            return
+        size = page_size
+        pending = asyncio.ensure_future(self.lookup(q, include_pending, size, after))
+        try:
+            while pending is not None:
+                rows, _ = await pending
+                pending = None
+                if len(rows) >= size:
+                    size = min(size * 2, max_page_size)
+                    pending = asyncio.ensure_future(self.lookup(q, include_pending, size, row_cursor(rows[-1])))
+                if rows:
+                    yield rows
+        finally:
+            # Cliente desconectado a mitad del stream: no dejar la página siguiente en vuelo
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    async def _run(
+        self, path: str, q: str, include_pending: bool, limit: Optional[int] = None, after: Optional[Cursor] = None
+    ) -> List[Dict[str, Any]]:
+        sb = get_supabase()
+        if path == "rpc":
+            payload: Dict[str, Any] = {"p_query": q, "p_include_pending": include_pending}
+            if self.has_paging and limit is not None:
+                payload["p_limit"] = limit
+            if self.has_paging and after is not None:
+                payload.update(p_after_created_at=after[0] or None, p_after_raffle_name=after[1],
+                               p_after_ticket_number=after[2], p_after_ticket_id=after[3] or None)
+            return await sb.call_rpc("verify_tickets", payload, read=True)
+
+        statuses = ("approved",) + (PENDING_STATUSES if include_pending else ())
+        term = _quote(f"*{q}*")
+        conditions = [f"email.ilike.{term}"]
+        if path == "embedded":
+            # "V-22321331" vs "22321331" lo resuelve el RPC con ci_digits
+            # (patch_verify_tickets_normalized_search.sql); aquí solo coincidencia literal.
+            conditions.append(f"ci.ilike.{term}")
+        params = {
+            "payments.or": f"({','.join(conditions)})",
+            "payments.status": f"in.({','.join(statuses)})",
+        }
+        return await sb.get_many("payment_tickets", params, select=EMBED_SELECT)
+
+
+def _quote(value: str) -> str:
+    """Entrecomilla un valor para filtros or=(...) de PostgREST (comas, paréntesis)."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def shape_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Adapta filas embebidas de PostgREST al contrato del RPC verify_tickets."""
+    out = []
+    for r in rows:
+        p = r.get("payments") or r.get("payment") or {}
+        t = r.get("tickets") or r.get("ticket") or {}
+        rf = (t.get("raffles") or {}).get("name") if isinstance(t.get("raffles"), dict) else None
+        out.append({
+            "raffle_id": t.get("raffle_id"),
+            "raffle_name": rf,
+            "ticket_id": t.get("id"),
+            "ticket_number": t.get("ticket_number"),
+            "ticket_status": t.get("status"),
+            "payment_id": p.get("id"),
+            "payment_status": p.get("status"),
+            "created_at": p.get("created_at"),
+        })
+    return out
+
+
+_engine: Optional[VerifyEngine] = None
+_verify_cache: Optional[TTLCache] = None
+
+
+def get_verify_engine() -> VerifyEngine:
+    global _engine
+    if _engine is None:
+        _engine = VerifyEngine()
+    return _engine
+
+
+def _rows_with_payments(payment_ids: List[str]) -> Callable[[Any, Any], bool]:
+    """Regla de invalidación: resultados que contienen alguno de los pagos."""
+    pids = set(payment_ids)
+    return lambda _key, rows: any(str(r.get("payment_id")) in pids for r in rows or [])
+
+
+def verify_cache() -> TTLCache:
+    global _verify_cache
+    if _verify_cache is None:
+        s = get_settings()
+        _verify_cache = TTLCache("verify", maxsize=s.VERIFY_CACHE_MAXSIZE, ttl=s.VERIFY_CACHE_TTL, shared=True)
+        _verify_cache.add_rule(
+            "payments", _rows_with_payments, tags=lambda _key, rows: {str(r.get("payment_id")) for r in rows or []}
+        )
+    return _verify_cache
+
+
+def normalize_query(q: str) -> str:
+    """Clave de cache: la búsqueda no distingue mayúsculas ni espacios extra
+    (ni el RPC ni el ilike del fallback), así que "  Ana@X.com" == "ana@x.com"."""
+    return " ".join(q.split()).lower()
+
+
+async def cached_lookup(q: str, include_pending: bool = True) -> Tuple[List[Dict[str, Any]], VerifyTrace]:
+    """Como VerifyEngine.lookup pero con cache de TTL corto por (consulta normalizada,
+    include_pending). Búsquedas idénticas en vuelo se coalescen en una sola consulta."""
+    cache = verify_cache()
+    query = normalize_query(q)
+    key = (query, include_pending)
+    coalesced = cache.loading(key)
+    started = time.perf_counter()
+    loaded: List[VerifyTrace] = []
+
+    async def load() -> List[Dict[str, Any]]:
+        data, trace = await get_verify_engine().lookup(query, include_pending)
+        loaded.append(trace)
+        return data
+
+    data = await cache.get_or_load(key, load)
+    if loaded:
+        return data, loaded[0]
+    trace = VerifyTrace()
+    trace.path = "coalesced" if coalesced else "cache"
+    trace.add(trace.path, started)
+    return data, trace
+
+
+async def cached_page(
+    q: str, include_pending: bool, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str], VerifyTrace]:
+    """Una página de la búsqueda y el cursor de la siguiente (None si es la última).
+    Se pide una fila de más para saber si hay otra página sin una llamada extra.
+    Cacheada como cached_lookup, por (consulta, include_pending, limit, cursor)."""
+    after = decode_cursor(cursor) if cursor else None
+    cache = verify_cache()
+    query = normalize_query(q)
+    key = (query, include_pending, limit, cursor or "")
+    started = time.perf_counter()
+    loaded: List[VerifyTrace] = []
+
+    async def load() -> List[Dict[str, Any]]:
+        data, trace = await get_verify_engine().lookup(query, include_pending, limit + 1, after)
+        loaded.append(trace)
+        return data
+
+    data = await cache.get_or_load(key, load)
+    if loaded:
+        trace = loaded[0]
+    else:
+        trace = VerifyTrace()
+        trace.path = "cache"
+        trace.add(trace.path, started)
+    if len(data) > limit:
+        return data[:limit], encode_cursor(data[limit - 1]), trace
+    return data, None, trace
+
+
+def stream_lookup(
+    q: str,
+    include_pending: bool = True,
+    page_size: int = 500,
+    cursor: Optional[str] = None,
+    max_page_size: Optional[int] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Páginas de la búsqueda completa para respuestas en streaming (NDJSON); hay que
+    cerrarlo con ``aclose()``. Sin cache: es para compradores con miles de tickets,
+    donde guardar el resultado entero es justo lo que se quiere evitar."""
+    after = decode_cursor(cursor) if cursor else None
+    return get_verify_engine().pages(normalize_query(q), include_pending, page_size, after, max_page_size)
+
+
+def invalidate_payment(payment_id: str) -> int:
+    """Descarta resultados cacheados que contienen el pago (p. ej. tras aprobarlo)."""
+    return invalidate_payments([payment_id])
+
+
+def invalidate_payments(payment_ids: Iterable[str]) -> int:
+    """Como invalidate_payment para varios pagos, con una sola pasada por el cache."""
+    pids = {str(p) for p in payment_ids}
+    if not pids:
+        return 0
+    return verify_cache().invalidate_rule("payments", sorted(pids))
@@ -0,0 +1,4 @@
+"""Benchmarks y pruebas de carga locales de la API (sin Supabase real).
+
+Ejecutar desde apps/api, por ejemplo: ``python -m bench.supabase_client``.
+"""
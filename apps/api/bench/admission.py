@@ -0,0 +1,145 @@
+"""Benchmark: admisión de reservas (services/admission.py) con una venta sobrecargada.
+
+El stub simula la contención de locks de una rifa en ensure_and_reserve_random_tickets:
+la base atiende --db-slots reservas a la vez (--service-ms cada una) y cada transacción
+que espera un lock encarece a las demás (--contention, fracción extra por cada una en
+espera). Sin admisión todas las solicitudes llegan a la base y la cola crece con los
+clientes; con admisión la API deja pasar --admission-concurrency por rifa, encola el
+resto con espera máxima y responde 429 rápido cuando no hay lugar.
+
+Por concurrencia y modo reporta latencia de las reservas exitosas (p50/p99), latencia
+de los 429 y conteo por status. Un cliente "ansioso" (una sola sesión con
+--greedy-connections conexiones) compite con sesiones normales: ``greedy_ok_pct`` es
+su porción de las reservas exitosas (su porción de conexiones va en ``greedy_conn_pct``).
+
+Uso (desde apps/api):
+    python -m bench.admission --concurrency 32,128,512 --duration 10
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+import orjson
+
+from .common import percentile, print_table, serve_api, serve_process, write_json
+from .loadgen import Connection
+from .stub_supabase import StubPostgrest
+
+RAFFLE_ID = str(uuid.UUID(int=23))
+GREEDY_SESSION = str(uuid.UUID(int=(23 << 64)))
+
+
+def build_stub(args: argparse.Namespace) -> StubPostgrest:
+    stub = StubPostgrest()
+    stub.on_table("raffles", lambda params: [{"total_tickets": 100000, "is_free": False}])
+    slots = asyncio.Semaphore(args.db_slots)
+    waiting = 0
+
+    async def reserve(p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        nonlocal waiting
+        waiting += 1
+        async with slots:
+            waiting -= 1
+            # Cada transacción bloqueada esperando un lock alarga a las que lo tienen
+            await asyncio.sleep(args.service_ms / 1000.0 * (1 + args.contention * waiting))
+        return [{"id": str(uuid.uuid4()), "raffle_id": RAFFLE_ID, "status": "reserved"}
+                for _ in range(int(p.get("p_quantity") or 0))]
+
+    stub.on_rpc("ensure_and_reserve_random_tickets", reserve)
+    return stub
+
+
+async def overload(api_url: str, concurrency: int, args: argparse.Namespace) -> Dict[str, Any]:
+    url = urlsplit(api_url)
+    ok: List[float] = []
+    rejected: List[float] = []
+    statuses: Counter = Counter()
+    greedy_ok = 0
+    greedy = min(args.greedy_connections, concurrency // 4)
+    deadline = time.perf_counter() + args.duration
+    seq = iter(range(10 ** 9))
+
+    async def client(k: int) -> None:
+        nonlocal greedy_ok
+        conn = Connection(url.hostname or "127.0.0.1", url.port or 80)
+        try:
+            while time.perf_counter() < deadline:
+                i = next(seq)
+                session = GREEDY_SESSION if k < greedy else str(uuid.UUID(int=(1 << 64) + i))
+                body = orjson.dumps({"p_raffle_id": RAFFLE_ID, "p_session_id": session, "p_quantity": 2})
+                t0 = time.perf_counter()
+                try:
+                    status, _ = await conn.request("POST", "/reservations/random", body)
+                except (OSError, asyncio.IncompleteReadError):
+                    status = 0
+                elapsed = time.perf_counter() - t0
+                statuses[status] += 1
+                if status == 200:
+                    ok.append(elapsed)
+                    greedy_ok += k < greedy
+                elif status == 429:
+                    rejected.append(elapsed)
+                    # Como un cliente que respeta Retry-After (mínimo 1 s), con jitter
+                    await asyncio.sleep(random.uniform(0.5, 1.5) * args.backoff_ms / 1000.0)
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(k) for k in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "ok_rps": round(len(ok) / elapsed, 1),
+        "ok_p50_ms": round(percentile(ok, 50) * 1000, 1),
+        "ok_p99_ms": round(percentile(ok, 99) * 1000, 1),
+        "ok_max_ms": round(max(ok) * 1000, 1) if ok else 0.0,
+        "429_p99_ms": round(percentile(rejected, 99) * 1000, 1),
+        "greedy_conn_pct": round(100.0 * greedy / concurrency, 1),
+        "greedy_ok_pct": round(100.0 * greedy_ok / len(ok), 1) if ok else 0.0,
+        "statuses": " ".join(f"{k}:{v}" for k, v in sorted(statuses.items())),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="32,128,512", help="clientes concurrentes, separados por coma")
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos por medición")
+    parser.add_argument("--db-slots", type=int, default=4, help="reservas que la base atiende a la vez")
+    parser.add_argument("--service-ms", type=float, default=20.0, help="duración de una reserva sin contención")
+    parser.add_argument("--contention", type=float, default=0.01, help="costo extra por transacción en espera")
+    parser.add_argument("--admission-concurrency", type=int, default=8)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--max-wait", type=float, default=2.0)
+    parser.add_argument("--greedy-connections", type=int, default=16, help="conexiones de la sesión ansiosa")
+    parser.add_argument("--backoff-ms", type=float, default=1000.0, help="pausa media del cliente tras un 429")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    rows: List[Dict[str, Any]] = []
+    modes = {
+        "off": {"ADMISSION_ENABLED": "false"},
+        "on": {
+            "ADMISSION_ENABLED": "true",
+            "ADMISSION_RAFFLE_CONCURRENCY": str(args.admission_concurrency),
+            "ADMISSION_QUEUE_SIZE": str(args.queue_size),
+            "ADMISSION_MAX_WAIT": str(args.max_wait),
+        },
+    }
+    with serve_process(build_stub(args).app) as stub_url:
+        for mode, env in modes.items():
+            env = {**env, "RESERVATION_EXPIRY_ENABLED": "false", "COUNTERS_DRIFT_ENABLED": "false",
+                   "SUPABASE_BREAKER_ENABLED": "false", "SUPABASE_POOL_SIZE": "1000", "SUPABASE_KEEPALIVE": "1000"}
+            with serve_api(stub_url, env=env) as api_url:
+                for c in levels:
+                    rows.append({"admission": mode, "concurrency": c, **asyncio.run(overload(api_url, c, args))})
+    print_table(rows)
+    write_json(args.json, {"benchmark": "admission", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Benchmark: grilla de números de una rifa de 100k tickets.
+
+Compara lo que hace hoy el frontend (``listTickets``: páginas de 1000 filas
+``select=*`` directo a PostgREST) con ``GET /raffles/{id}/availability``:
+
+  rows        filas JSON paginadas (secuencial, como el front)
+  cold        primera llamada al endpoint (carga el snapshot desde PostgREST)
+  rle/bitmap  estado completo desde el snapshot en memoria
+  delta       ``since`` tras N reservas hechas por la API
+
+Se reportan bytes (crudos y con gzip) y latencia.
+
+Uso (desde apps/api):
+    python -m bench.availability --tickets 100000 --latency-ms 20
+"""
+import argparse
+import asyncio
+import gzip
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+import httpx
+
+from .common import percentile, print_table, serve_api, serve_process, write_json
+from .stub_supabase import StubPostgrest
+
+RAFFLE_ID = str(uuid.UUID(int=42))
+
+
+def build_stub(tickets: int, latency_ms: float) -> StubPostgrest:
+    created = datetime(2025, 1, 1, tzinfo=timezone.utc).isoformat()
+    rows: List[Dict[str, Any]] = []
+    rnd = random.Random(1)
+    for n in range(1, tickets + 1):
+        # Rifa a mitad de venta: ~30% vendidos y ~2% reservados, repartidos al azar
+        x = rnd.random()
+        status = "sold" if x < 0.30 else ("reserved" if x < 0.32 else "available")
+        rows.append({
+            "id": str(uuid.UUID(int=(1 << 64) + n)),
+            "raffle_id": RAFFLE_ID,
+            "ticket_number": str(n),
+            "status": status,
+            "reserved_until": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat() if status == "reserved" else None,
+            "reserved_by": str(uuid.UUID(int=n % 500)) if status == "reserved" else None,
+            "created_at": created,
+        })
+    by_id = {r["id"]: r for r in rows}
+
+    def tickets_table(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 1000))
+        page = rows[offset:offset + min(limit, 1000)]
+        select = params.get("select", "*")
+        if select == "*":
+            return page
+        cols = select.split(",")
+        return [{c: r.get(c) for c in cols} for r in page]
+
+    def reserve(p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        until = (datetime.now(timezone.utc) + timedelta(minutes=10)).isoformat()
+        out = []
+        for tid in p.get("p_ticket_ids", []):
+            r = by_id.get(tid)
+            if r and r["status"] == "available":
+                r.update(status="reserved", reserved_by=p["p_session_id"], reserved_until=until)
+                out.append(dict(r))
+        return out
+
+    def release(p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        for tid in p.get("p_ticket_ids", []):
+            r = by_id.get(tid)
+            if r and r["status"] == "reserved":
+                r.update(status="available", reserved_by=None, reserved_until=None)
+        return []
+
+    stub = StubPostgrest(latency_ms=latency_ms)
+    stub.on_table("tickets", tickets_table)
+    stub.on_table("raffles", lambda params: [{"total_tickets": tickets, "is_free": False}])
+    stub.on_rpc("reserve_tickets", reserve)
+    stub.on_rpc("release_tickets", release)
+    return stub
+
+
+def sizes(body: bytes) -> Dict[str, Any]:
+    return {"bytes": len(body), "gzip_bytes": len(gzip.compress(body, 6))}
+
+
+async def rows_like_frontend(stub_url: str) -> Dict[str, Any]:
+    """Como apps/web listTickets: páginas de 1000 con Range hasta una página corta."""
+    total = b""
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=stub_url, timeout=60.0) as client:
+        offset = 0
+        while True:
+            res = await client.get(
+                "/rest/v1/tickets",
+                params={"select": "*", "raffle_id": f"eq.{RAFFLE_ID}", "order": "ticket_number.asc",
+                        "offset": str(offset), "limit": "1000"},
+            )
+            res.raise_for_status()
+            total += res.content
+            if len(res.json()) < 1000:
+                break
+            offset += 1000
+    elapsed = time.perf_counter() - started
+    return {"mode": "rows (frontend)", "requests": offset // 1000 + 1, "ms": round(elapsed * 1000, 1), **sizes(total)}
+
+
+async def endpoint(api_url: str, runs: int, reservations: int) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    url = f"/raffles/{RAFFLE_ID}/availability"
+    async with httpx.AsyncClient(base_url=api_url, timeout=60.0) as client:
+        started = time.perf_counter()
+        res = await client.get(url)
+        res.raise_for_status()
+        out.append({"mode": "cold (load snapshot)", "requests": 1,
+                    "ms": round((time.perf_counter() - started) * 1000, 1), **sizes(res.content)})
+        version = res.json()["version"]
+
+        for encoding in ("rle", "bitmap"):
+            lat: List[float] = []
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                res = await client.get(url, params={"encoding": encoding})
+                lat.append(time.perf_counter() - t0)
+            out.append({"mode": f"full {encoding}", "requests": 1, "ms": round(percentile(lat, 50) * 1000, 2),
+                        "p99_ms": round(percentile(lat, 99) * 1000, 2), **sizes(res.content)})
+
+        # Reservas a través de la API: el snapshot se actualiza sin recargar
+        for k in range(reservations):
+            tid = str(uuid.UUID(int=(1 << 64) + 1 + k * 997))
+            await client.post("/reservations/ids", json={"p_ticket_ids": [tid], "p_session_id": str(uuid.uuid4())})
+        lat = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            res = await client.get(url, params={"since": version})
+            lat.append(time.perf_counter() - t0)
+        body = res.json()
+        out.append({"mode": f"delta ({reservations} reservas)", "requests": 1, "ms": round(percentile(lat, 50) * 1000, 2),
+                    "p99_ms": round(percentile(lat, 99) * 1000, 2), "changes": len(body.get("changes") or []),
+                    **sizes(res.content)})
+        res = await client.get(url, params={"since": body["version"]})
+        out.append({"mode": "delta (sin cambios)", "requests": 1, "changes": len(res.json().get("changes") or []),
+                    **sizes(res.content)})
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia simulada por request a PostgREST")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--reservations", type=int, default=20)
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    stub = build_stub(args.tickets, args.latency_ms)
+    with serve_process(stub.app) as stub_url, serve_api(stub_url) as api_url:
+        rows = [asyncio.run(rows_like_frontend(stub_url))]
+        rows += asyncio.run(endpoint(api_url, args.runs, args.reservations))
+    print_table(rows)
+    write_json(args.json, {"benchmark": "availability", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
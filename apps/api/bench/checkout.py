@@ -0,0 +1,168 @@
+"""Benchmark: checkout en varias llamadas (flujo actual del front) vs POST /checkout.
+
+El flujo ``multi`` es el de CheckoutForm hoy, paso por paso desde el navegador:
+
+  1. POST /reservations/random           (API -> ensure_and_reserve_random_tickets)
+  2. rpc ensure_session                  (navegador -> Supabase directo)
+  3. rpc create_payment_for_session      (navegador -> Supabase directo)
+  4. POST /payments/set-ci               (API -> PATCH payments)
+
+``single`` es un POST /checkout (API -> checkout_for_session, una transacción). La
+subida de la evidencia a Cloudinary es igual en ambos y no se mide.
+
+Cada paso paga el round trip del cliente (--client-rtt-ms, p. ej. un móvil) además
+de la latencia del stub por llamada a Supabase (--latency-ms); el RPC de checkout
+cobra --checkout-extra-ms por el trabajo adicional dentro de la base.
+
+Con --error-rate > 0 se repite con fallas inyectadas en el stub (esa fracción de
+llamadas a Supabase responde 503) y se cuenta cómo termina cada checkout: completo,
+fallido sin dejar nada, o ``partial`` (reservó o creó el pago y falló después: tickets
+retenidos sin pago o pago sin cédula).
+
+Uso (desde apps/api):
+    python -m bench.checkout --latency-ms 20 --client-rtt-ms 60 --concurrency 16 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+
+from .common import print_table, serve_api, serve_process, summarize, write_json
+from .rate_mirrors import FakeMirrors
+from .stub_supabase import StubPostgrest
+
+RAFFLE_ID = str(uuid.UUID(int=22))
+
+
+def build_stub(args: argparse.Namespace) -> StubPostgrest:
+    stub = StubPostgrest(latency_ms=args.latency_ms)
+    stub.on_table("raffles", lambda params: [{"total_tickets": 100000, "is_free": False}])
+
+    def tickets(n: int) -> List[Dict[str, Any]]:
+        return [{"id": str(uuid.uuid4()), "raffle_id": RAFFLE_ID, "ticket_number": str(k + 1), "status": "reserved"}
+                for k in range(n)]
+
+    stub.on_rpc("ensure_and_reserve_random_tickets", lambda p: tickets(int(p.get("p_quantity") or 0)))
+    stub.on_rpc("ensure_session", lambda p: None)
+    stub.on_rpc("create_payment_for_session", lambda p: str(uuid.uuid4()))
+
+    async def checkout(p: Dict[str, Any]) -> Dict[str, Any]:
+        await asyncio.sleep(args.checkout_extra_ms / 1000.0)
+        return {"payment_id": str(uuid.uuid4()), "status": "pending", "raffle_id": p["p_raffle_id"],
+                "reference": p.get("p_reference"), "ci": p.get("p_ci"), "amount_ves": 304,
+                "rate_used": p.get("p_rate_used"), "rate_source": p.get("p_rate_source"), "currency": "VES",
+                "tickets": tickets(int(p.get("p_quantity") or 0))}
+
+    stub.on_rpc("checkout_for_session", checkout)
+    return stub
+
+
+def form(i: int) -> Dict[str, Any]:
+    return {"email": f"buyer{i}@bench.test", "phone": "04121234567", "city": "Caracas", "ci": f"V-{10_000_000 + i}",
+            "instagram": "@bench", "method": "pago movil", "reference": f"REF{i:08d}", "quantity": 2}
+
+
+async def multi(api: httpx.AsyncClient, sb: httpx.AsyncClient, i: int, rtt: float) -> str:
+    """Devuelve complete | failed | partial."""
+    session = str(uuid.UUID(int=(1 << 64) + i))
+    f = form(i)
+    await asyncio.sleep(rtt)
+    res = await api.post("/reservations/random", json={"p_raffle_id": RAFFLE_ID, "p_session_id": session,
+                                                       "p_quantity": f["quantity"]})
+    if res.status_code >= 400:
+        return "failed"
+    await asyncio.sleep(rtt)
+    res = await sb.post("/rest/v1/rpc/ensure_session", json={"p_session_id": session})
+    # El front ignora el error de ensure_session y sigue
+    await asyncio.sleep(rtt)
+    res = await sb.post("/rest/v1/rpc/create_payment_for_session", json={
+        "p_raffle_id": RAFFLE_ID, "p_session_id": session, "p_email": f["email"], "p_phone": f["phone"],
+        "p_city": f["city"], "p_method": f["method"], "p_reference": f["reference"], "p_evidence_url": None,
+        "p_amount_ves": 304, "p_rate_used": 40.5, "p_rate_source": "bcv", "p_currency": "VES",
+        "p_ci": f["ci"], "p_instagram": f["instagram"],
+    })
+    if res.status_code >= 400:
+        return "partial"
+    payment_id = res.json()
+    await asyncio.sleep(rtt)
+    res = await api.post("/payments/set-ci", json={"payment_id": payment_id, "ci": f["ci"]})
+    return "partial" if res.status_code >= 400 else "complete"
+
+
+async def single(api: httpx.AsyncClient, i: int, rtt: float) -> str:
+    session = str(uuid.UUID(int=(2 << 64) + i))
+    await asyncio.sleep(rtt)
+    res = await api.post("/checkout", json={"raffle_id": RAFFLE_ID, "session_id": session, **form(i)})
+    return "failed" if res.status_code >= 400 else "complete"
+
+
+async def run(mode: str, api_url: str, stub_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    rtt = args.client_rtt_ms / 1000.0
+    latencies: List[float] = []
+    outcomes = {"complete": 0, "failed": 0, "partial": 0}
+    remaining = iter(range(args.checkouts))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=60.0) as api, \
+            httpx.AsyncClient(base_url=stub_url, limits=limits, timeout=60.0) as sb:
+
+        async def worker() -> None:
+            for i in remaining:
+                t0 = time.perf_counter()
+                outcome = await (multi(api, sb, i, rtt) if mode == "multi" else single(api, i, rtt))
+                latencies.append(time.perf_counter() - t0)
+                outcomes[outcome] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    result = summarize(latencies, elapsed, outcomes["failed"] + outcomes["partial"])
+    return {**result, **outcomes}
+
+
+async def set_faults(stub_url: str, **faults: float) -> None:
+    async with httpx.AsyncClient(base_url=stub_url) as client:
+        await client.post("/_faults", json=faults)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia del stub por llamada a Supabase")
+    parser.add_argument("--client-rtt-ms", type=float, default=60.0, help="round trip navegador -> servidor por paso")
+    parser.add_argument("--checkout-extra-ms", type=float, default=2.0, help="trabajo extra del RPC de checkout")
+    parser.add_argument("--checkouts", type=int, default=400, help="checkouts por medición")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de llamadas a Supabase que fallan")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    mirrors = FakeMirrors()
+    mirrors.set("bcv", latency=0.01)
+    rows: List[Dict[str, Any]] = []
+    with serve_process(build_stub(args).app) as stub_url, serve_process(mirrors.app) as mirrors_url:
+        env = {"RATE_MIRRORS": mirrors.urls(mirrors_url, ["bcv"])[0], "RESERVATION_EXPIRY_ENABLED": "false",
+               "COUNTERS_DRIFT_ENABLED": "false"}
+        with serve_api(stub_url, env=env) as api_url:
+
+            async def bench() -> None:
+                # Calentamiento: conexiones, cache de la rifa y tasa
+                for mode in ("multi", "single"):
+                    await run(mode, api_url, stub_url, argparse.Namespace(**{**vars(args), "checkouts": 20}))
+                for mode in ("multi", "single"):
+                    rows.append({"mode": mode, "errors_injected": 0.0, **await run(mode, api_url, stub_url, args)})
+                if args.error_rate > 0:
+                    await set_faults(stub_url, error_rate=args.error_rate, error_status=503)
+                    for mode in ("multi", "single"):
+                        rows.append({"mode": mode, "errors_injected": args.error_rate,
+                                     **await run(mode, api_url, stub_url, args)})
+                    await set_faults(stub_url)
+
+            asyncio.run(bench())
+    print_table(rows)
+    write_json(args.json, {"benchmark": "checkout", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
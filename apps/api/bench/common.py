@@ -0,0 +1,199 @@
+"""Utilidades comunes de los benchmarks: servidor en hilo, percentiles y reporte."""
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import httpx
+import uvicorn
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError("server did not start")
+            time.sleep(0.02)
+
+
+@contextmanager
+def serve_process(app: Any, port: Optional[int] = None) -> Iterator[str]:
+    """Como ``serve`` pero en un proceso aparte (fork), para que el stub no
+    compita por el GIL con el cliente que se está midiendo."""
+    port = port or free_port()
+    ctx = multiprocessing.get_context("fork")
+    proc = ctx.Process(
+        target=uvicorn.run, args=(app,), kwargs={"host": "127.0.0.1", "port": port, "log_level": "warning"}, daemon=True
+    )
+    proc.start()
+    try:
+        _wait_port(port)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.join(timeout=10)
+
+
+def _run_api(port: int, env: Dict[str, str]) -> None:
+    os.environ.update(env)
+    from app.core.config import get_settings
+
+    get_settings.cache_clear()
+    uvicorn.run("app.main:app", host="127.0.0.1", port=port, log_level="warning")
+
+
+@contextmanager
+def serve_api(
+    supabase_url: str, env: Optional[Dict[str, str]] = None, port: Optional[int] = None, workers: int = 1
+) -> Iterator[str]:
+    """Levanta la API real (app.main:app) en otro proceso apuntando al stub de Supabase.
+
+    Sin la corrección de raffle_counters salvo que ``env`` la pida: los stubs no
+    implementan refresh_raffle_counters y solo ensuciarían el log."""
+    port = port or free_port()
+    full_env = {"SUPABASE_URL": supabase_url, "SUPABASE_SERVICE_KEY": "bench-service-key", "SUPABASE_HTTP2": "false",
+                "COUNTERS_DRIFT_ENABLED": "false"}
+    full_env.update(env or {})
+    if workers > 1:
+        with _serve_api_workers(port, full_env, workers) as url:
+            yield url
+        return
+    ctx = multiprocessing.get_context("fork")
+    proc = ctx.Process(target=_run_api, args=(port, full_env), daemon=True)
+    proc.start()
+    try:
+        _wait_port(port)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.join(timeout=10)
+
+
+@contextmanager
+def _serve_api_workers(port: int, env: Dict[str, str], workers: int) -> Iterator[str]:
+    """Como se despliega: ``uvicorn --workers N`` (un supervisor y N procesos que
+    comparten el socket). Va por línea de comandos: el supervisor no puede ser hijo
+    de un proceso daemon."""
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, env={**os.environ, **env})
+    try:
+        _wait_port(port, timeout=30.0)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+async def run_load(
+    send: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]],
+    requests: int,
+    concurrency: int,
+    base_url: str = "",
+) -> Dict[str, Any]:
+    """Lanza ``requests`` solicitudes con ``concurrency`` clientes concurrentes.
+
+    ``send(client, i)`` hace la i-ésima solicitud; cuenta como error todo status >= 400.
+    """
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+
+        async def worker() -> None:
+            nonlocal errors
+            for i in remaining:
+                t0 = time.perf_counter()
+                try:
+                    res = await send(client, i)
+                    if res.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - t0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, errors)
+
+
+@contextmanager
+def serve(app: Any, port: Optional[int] = None) -> Iterator[str]:
+    """Levanta una app ASGI con uvicorn en un hilo y devuelve su URL base."""
+    port = port or free_port()
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("server did not start")
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, Any]:
+    """Resume latencias (segundos) en ms y calcula solicitudes por segundo."""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        return
+    # Unión de columnas en orden de aparición (los escenarios pueden tener campos distintos)
+    cols = list(dict.fromkeys(c for r in rows for c in r))
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in cols}
+    print("  ".join(c.ljust(widths[c]) for c in cols))
+    for r in rows:
+        print("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in cols))
+
+
+def write_json(path: Optional[str], payload: Any) -> None:
+    if not path:
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    print(f"results written to {path}")
@@ -0,0 +1,126 @@
+"""Generador de carga HTTP/1.1 mínimo sobre asyncio para la suite.
+
+Con muchos clientes concurrentes el pool de httpx gasta más CPU que la API
+medida (con 1 CPU, 128 conexiones: ~150 rps con httpx contra ~2900 con sockets
+crudos en GET /api/rate), así que la latencia reportada sería la del cliente.
+Aquí cada cliente es una conexión keep-alive que escribe la solicitud ya armada
+y lee status, headers y cuerpo (Content-Length o chunked); nada más.
+"""
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .common import percentile, summarize
+
+# (método, ruta con query, cuerpo JSON o None)
+Request = Tuple[str, str, Optional[bytes]]
+
+
+class Connection:
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + (body or b""))
+        try:
+            status, length, chunked, close = await self._read_head()
+            if chunked:
+                data = await self._read_chunked()
+            else:
+                data = await self.reader.readexactly(length) if length else b""
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+        if close:
+            self.close()
+        return status, data
+
+    async def _read_head(self) -> Tuple[int, int, bool, bool]:
+        raw = await self.reader.readuntil(b"\r\n\r\n")
+        lines = raw.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        length, chunked, close = 0, False, False
+        for line in lines[1:]:
+            key, _, value = line.partition(":")
+            key, value = key.strip().lower(), value.strip().lower()
+            if key == "content-length":
+                length = int(value)
+            elif key == "transfer-encoding":
+                chunked = "chunked" in value
+            elif key == "connection":
+                close = value == "close"
+        return status, length, chunked, close
+
+    async def _read_chunked(self) -> bytes:
+        parts: List[bytes] = []
+        while True:
+            size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                await self.reader.readuntil(b"\r\n")
+                return b"".join(parts)
+            parts.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_raw_load(
+    build: Callable[[int], Request],
+    requests: int,
+    concurrency: int,
+    base_url: str,
+) -> Dict[str, Any]:
+    """Como ``common.run_load`` pero con ``Connection``: ``build(i)`` arma la i-ésima
+    solicitud. Agrega ``statuses`` (conteo por código; error de conexión = 0).
+
+    Un 429 (admisión o rate limit) es la API descartando carga a propósito, no un
+    error: va en ``rejected``, y ``ok_rps`` / ``ok_p99_ms`` miden solo las respuestas
+    2xx (los 429 son rápidos y bajarían p99 o subirían rps sin que nada mejore).
+    """
+    url = urlsplit(base_url)
+    latencies: List[float] = []
+    ok: List[float] = []
+    statuses: Counter = Counter()
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        conn = Connection(url.hostname or "127.0.0.1", url.port or 80)
+        try:
+            for i in remaining:
+                method, path, body = build(i)
+                t0 = time.perf_counter()
+                try:
+                    status, _ = await conn.request(method, path, body)
+                except (OSError, asyncio.IncompleteReadError):
+                    status = 0
+                elapsed = time.perf_counter() - t0
+                latencies.append(elapsed)
+                if 200 <= status < 300:
+                    ok.append(elapsed)
+                statuses[status] += 1
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    errors = sum(n for status, n in statuses.items() if status == 0 or (status >= 400 and status != 429))
+    result = summarize(latencies, elapsed, errors)
+    result["rejected"] = statuses[429]
+    result["ok_rps"] = round(len(ok) / elapsed, 1) if elapsed > 0 else 0.0
+    result["ok_p99_ms"] = round(percentile(ok, 99) * 1000, 2)
+    result["statuses"] = " ".join(f"{k}:{v}" for k, v in sorted(statuses.items()))
+    return result
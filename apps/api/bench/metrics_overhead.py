@@ -0,0 +1,109 @@
+"""Costo de la instrumentación (/metrics) y del profiler por muestreo.
+
+Levanta la API contra el stub con ``METRICS_ENABLED`` apagado y encendido y mide:
+
+  health     GET /health: sin I/O, deja a la vista el costo del middleware
+  supabase   POST /reservations/release: una llamada a PostgREST por solicitud
+  profiler   lo mismo con el profiler muestreando el event loop cada --interval-ms
+
+Con métricas encendidas verifica que /metrics sea texto de Prometheus válido y
+que los conteos del histograma por ruta y por RPC coincidan con lo enviado.
+
+Uso (desde apps/api):
+    python -m bench.metrics_overhead --requests 5000 --concurrency 32
+"""
+import argparse
+import asyncio
+import re
+import sys
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+
+from .common import print_table, run_load, serve_api, serve_process, write_json
+from .stub_supabase import StubPostgrest
+
+_SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? [-+0-9.eE]+(Inf)?$')
+
+
+async def health(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.get("/health")
+
+
+async def release(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.post("/reservations/release", json={"p_ticket_ids": [], "p_session_id": str(uuid.UUID(int=i))})
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """``nombre{etiquetas}`` -> valor; lanza ValueError si una línea no es válida."""
+    samples: Dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("# HELP ") or line.startswith("# TYPE "):
+            continue
+        if not _SAMPLE.match(line):
+            raise ValueError(f"invalid sample line: {line!r}")
+        key, _, value = line.rpartition(" ")
+        samples[key] = float(value)
+    return samples
+
+
+async def load(api_url: str, args: argparse.Namespace, profile: bool = False) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    async with httpx.AsyncClient(base_url=api_url, timeout=30.0) as client:
+        if profile:
+            res = await client.post("/admin/profiler/start", json={"interval_ms": args.interval_ms, "duration": 120})
+            res.raise_for_status()
+        for name, send in (("health", health), ("supabase", release)):
+            await run_load(send, args.requests // 10, args.concurrency, api_url)  # calentamiento
+            rows.append({"scenario": name, **await run_load(send, args.requests, args.concurrency, api_url)})
+        if profile:
+            stats = (await client.post("/admin/profiler/stop")).json()
+            stacks = (await client.get("/admin/profiler/stacks", params={"limit": 20})).text
+            for row in rows:
+                row["scenario"] += " + profiler"
+            rows.append({"scenario": "profiler", "result": "PASS" if stats["samples"] and "run_endpoint_function" in stacks
+                         else "FAIL", "samples": stats["samples"], "stacks": stats["stacks"]})
+    return rows
+
+
+async def check(api_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=api_url, timeout=30.0) as client:
+        res = await client.get("/metrics")
+        res.raise_for_status()
+    samples = parse_metrics(res.text)
+    sent = args.requests + args.requests // 10
+    health_count = samples.get('prizo_http_request_duration_seconds_count{method="GET",route="/health"}')
+    rpc_count = samples.get('prizo_supabase_request_duration_seconds_count{kind="rpc",name="release_tickets"}')
+    ok = health_count == sent and rpc_count == sent and res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    return {"scenario": "/metrics", "result": "PASS" if ok else "FAIL", "series": len(samples),
+            "bytes": len(res.content), "health_count": health_count, "rpc_count": rpc_count}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="latencia simulada por request a PostgREST")
+    parser.add_argument("--interval-ms", type=float, default=5.0, help="intervalo de muestreo del profiler")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    stub = StubPostgrest(latency_ms=args.latency_ms)
+    results: List[Dict[str, Any]] = []
+    base = {"RESERVATION_EXPIRY_ENABLED": "false"}
+    with serve_process(stub.app) as stub_url:
+        with serve_api(stub_url, env={**base, "METRICS_ENABLED": "false"}) as api_url:
+            results += [{"metrics": "off", **r} for r in asyncio.run(load(api_url, args))]
+        with serve_api(stub_url, env={**base, "METRICS_ENABLED": "true"}) as api_url:
+            results += [{"metrics": "on", **r} for r in asyncio.run(load(api_url, args))]
+            results.append({"metrics": "on", **asyncio.run(check(api_url, args))})
+        with serve_api(stub_url, env={**base, "METRICS_ENABLED": "true", "PROFILER_ENABLED": "true"}) as api_url:
+            results += [{"metrics": "on", **r} for r in asyncio.run(load(api_url, args, profile=True))]
+    print_table(results)
+    write_json(args.json, {"benchmark": "metrics_overhead", "params": vars(args), "results": results})
+    sys.exit(0 if all(r.get("result", "PASS") == "PASS" for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Arnés para /api/rate con mirrors falsos locales (latencia y fallos inyectados).
+
+Escenarios:
+  race         carrera en paralelo vs recorrido secuencial (comportamiento anterior)
+  all_fail     todos los mirrors fallan: error rápido, acotado por el timeout
+  swr          stale-while-revalidate: se sirve el valor viejo y se refresca detrás
+  stale_error  si el refresco falla se conserva el último valor conocido
+  serve        latencia de lectura desde memoria (cache.get y endpoint HTTP)
+
+Uso (desde apps/api):
+    python -m bench.rate_mirrors
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from app.services.rate import RateCache, race_mirrors, scan
+
+from .common import percentile, print_table, serve, serve_api, write_json
+
+
+class FakeMirrors:
+    """Mirrors configurables: ``behaviors[name] = (latency_s, mode, rate)``.
+
+    Modos: ok, error (HTTP 500), garbage (no JSON), norate (JSON sin tasa).
+    """
+
+    def __init__(self) -> None:
+        self.behaviors: Dict[str, tuple] = {}
+        self.hits: Dict[str, int] = {}
+        self.app = Starlette(routes=[Route("/m/{name}", self._handle)])
+
+    def set(self, name: str, latency: float = 0.0, mode: str = "ok", rate: float = 36.5) -> None:
+        self.behaviors[name] = (latency, mode, rate)
+
+    def urls(self, base: str, names: List[str]) -> List[str]:
+        return [f"{base}/m/{n}" for n in names]
+
+    async def _handle(self, request: Request) -> Response:
+        name = request.path_params["name"]
+        self.hits[name] = self.hits.get(name, 0) + 1
+        latency, mode, rate = self.behaviors.get(name, (0.0, "error", 0.0))
+        await asyncio.sleep(latency)
+        if mode == "error":
+            return PlainTextResponse("boom", status_code=500)
+        if mode == "garbage":
+            return PlainTextResponse("<html>not json</html>")
+        if mode == "norate":
+            return JSONResponse({"monitors": {"enparalelo": {"price": "40,00"}}})
+        return JSONResponse({"monitors": {"bcv": {"price": f"{rate:.2f}".replace(".", ",")}}})
+
+
+async def sequential_legacy(mirrors: List[str], timeout: float) -> Optional[float]:
+    """Recorrido secuencial original de get_usdves_rate (referencia)."""
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        for url in mirrors:
+            try:
+                r = await client.get(url)
+                if r.status_code >= 400:
+                    continue
+                n = scan(r.json())
+                if n:
+                    return n
+            except Exception:
+                continue
+    return None
+
+
+def check(results: List[Dict[str, Any]], name: str, ok: bool, **info: Any) -> None:
+    results.append({"scenario": name, "result": "PASS" if ok else "FAIL", **info})
+
+
+async def run_scenarios(fake: FakeMirrors, base: str, timeout: float) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+
+    # Primeros mirrors lentos o rotos, como cuando un mirror está frío o caído
+    fake.set("down", mode="error")
+    fake.set("hang", latency=timeout + 1)
+    fake.set("html", mode="garbage")
+    fake.set("empty", latency=0.05, mode="norate")
+    fake.set("slow_ok", latency=1.5, rate=36.1)
+    fake.set("fast_ok", latency=0.1, rate=36.5)
+    order = ["down", "hang", "html", "empty", "slow_ok", "fast_ok"]
+    mirrors = fake.urls(base, order)
+
+    t0 = time.perf_counter()
+    legacy = await sequential_legacy(mirrors, timeout)
+    legacy_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    rate, mirror = await race_mirrors(mirrors, timeout)
+    race_s = time.perf_counter() - t0
+    check(
+        results, "race", mirror.endswith("/fast_ok") and race_s < 1.0,
+        detail=f"race={race_s:.3f}s via {mirror.rsplit('/', 1)[-1]} rate={rate}; sequential={legacy_s:.3f}s rate={legacy}",
+    )
+
+    t0 = time.perf_counter()
+    failing = fake.urls(base, ["down", "html", "empty"])
+    try:
+        await race_mirrors(failing, timeout)
+        raised = False
+    except RuntimeError:
+        raised = True
+    check(results, "all_fail", raised and time.perf_counter() - t0 < timeout, detail=f"{time.perf_counter() - t0:.3f}s")
+
+    fake.set("swr", latency=0.2, rate=40.0)
+    cache = RateCache(fake.urls(base, ["swr"]), refresh_interval=0, max_age=0.3, timeout=timeout)
+    first = await cache.get()
+    fake.set("swr", latency=0.2, rate=41.0)
+    await asyncio.sleep(0.35)
+    t0 = time.perf_counter()
+    stale = await cache.get()
+    stale_s = time.perf_counter() - t0
+    await asyncio.sleep(0.4)
+    fresh = await cache.get()
+    check(
+        results, "swr",
+        first["rate"] == 40.0 and stale["rate"] == 40.0 and stale["stale"] and stale_s < 0.01 and fresh["rate"] == 41.0,
+        detail=f"stale read {stale_s * 1e6:.0f}us, then rate={fresh['rate']} age={fresh['age_seconds']}s",
+    )
+
+    fake.set("swr", mode="error")
+    await asyncio.sleep(0.35)
+    await cache.get()
+    await asyncio.sleep(0.1)
+    kept = await cache.get()
+    check(results, "stale_error", kept["rate"] == 41.0 and cache.last_error is not None, detail=f"kept rate={kept['rate']}")
+
+    samples = []
+    for _ in range(10000):
+        t0 = time.perf_counter()
+        await cache.get()
+        samples.append(time.perf_counter() - t0)
+    await cache.stop()
+    p50_us = percentile(samples, 50) * 1e6
+    check(results, "serve", p50_us < 100, detail=f"cache.get p50={p50_us:.1f}us p99={percentile(samples, 99) * 1e6:.1f}us")
+    return results
+
+
+async def endpoint_latency(api_url: str, n: int) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=api_url) as client:
+        await client.get("/api/rate")  # arranque en frío
+        samples = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            r = await client.get("/api/rate")
+            samples.append(time.perf_counter() - t0)
+        body = r.json()
+    return {"p50_ms": round(percentile(samples, 50) * 1000, 2), "p99_ms": round(percentile(samples, 99) * 1000, 2), "body": body}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timeout", type=float, default=3.0, help="timeout por mirror (segundos)")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    fake = FakeMirrors()
+    with serve(fake.app) as base:
+        results = asyncio.run(run_scenarios(fake, base, args.timeout))
+        env = {"RATE_MIRRORS": ",".join(fake.urls(base, ["hang", "down", "fast_ok"])), "RATE_REFRESH_INTERVAL": "60"}
+        with serve_api("http://127.0.0.1:9", env=env) as api_url:
+            http = asyncio.run(endpoint_latency(api_url, 500))
+        check(
+            results, "endpoint", http["body"].get("mirror", "").endswith("/fast_ok"),
+            detail=f"GET /api/rate p50={http['p50_ms']}ms p99={http['p99_ms']}ms",
+        )
+
+    print_table(results)
+    write_json(args.json, {"benchmark": "rate_mirrors", "params": vars(args), "results": results})
+    sys.exit(0 if all(r["result"] == "PASS" for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Arnés de la liberación de reservas vencidas (services/expiry.py) contra el stub.
+
+La API real corre en otro proceso; el stub (en este proceso) devuelve reservas con
+``reserved_until`` a pocos segundos y registra cuándo llega cada
+``release_expired_tickets``. Escenarios:
+
+  prompt     desfase entre el vencimiento y la liberación, y tamaño de los lotes
+  release    tickets liberados por la sesión (/reservations/release) no se vuelven a liberar
+  renewed    una reserva renovada en la base se reprograma y se libera al nuevo vencimiento
+  reconcile  reservas existentes al arrancar se cargan desde la base y se liberan
+  retry      si el RPC falla, el lote se reintenta
+
+Con el job de pg_cron cada minuto el desfase es uniforme en [0, 60] s (media ~30 s).
+
+Uso (desde apps/api):
+    python -m bench.reservation_expiry
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import httpx
+
+from .common import percentile, print_table, serve, serve_api, write_json
+from .stub_supabase import StubError, StubPostgrest
+
+
+def iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+class ExpiryStub:
+    """Estado de tickets del stub: deadline por ticket y llamadas de liberación recibidas."""
+
+    def __init__(self, hold_seconds: float) -> None:
+        self.hold_seconds = hold_seconds
+        self.deadlines: Dict[str, float] = {}
+        self.renew: Dict[str, float] = {}
+        self.existing: List[Dict[str, Any]] = []
+        self.fail_next = 0
+        self.released: Dict[str, float] = {}
+        self.batches: List[int] = []
+        self.stub = StubPostgrest()
+        self.stub.on_rpc("reserve_tickets", self._reserve)
+        self.stub.on_rpc("release_tickets", self._release_session)
+        self.stub.on_rpc("release_expired_tickets", self._release_expired)
+        self.stub.on_table("tickets", self._tickets)
+        self.stub.on_table("raffles", lambda params: [])
+
+    def _reserve(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        until = time.time() + self.hold_seconds
+        for tid in p.get("p_ticket_ids", []):
+            self.deadlines[tid] = until
+        return [{"id": t, "status": "reserved", "reserved_until": iso(until)} for t in p.get("p_ticket_ids", [])]
+
+    def _release_session(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        for tid in p.get("p_ticket_ids", []):
+            self.deadlines.pop(tid, None)
+        return []
+
+    def _release_expired(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            raise StubError(503, "", "unavailable")
+        now = time.time()
+        ids = p.get("p_ticket_ids", [])
+        self.batches.append(len(ids))
+        out = []
+        for tid in ids:
+            if tid in self.renew:
+                self.deadlines[tid] = now + self.renew.pop(tid)
+            deadline = self.deadlines.get(tid)
+            if deadline is None:
+                continue
+            if deadline <= now:
+                del self.deadlines[tid]
+                self.released[tid] = now
+                out.append({"ticket_id": tid, "released": True, "reserved_until": None})
+            else:
+                out.append({"ticket_id": tid, "released": False, "reserved_until": iso(deadline)})
+        return out
+
+    def _tickets(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 1000))
+        return self.existing[offset:offset + limit]
+
+
+def check(results: List[Dict[str, Any]], name: str, ok: bool, **info: Any) -> None:
+    results.append({"scenario": name, "result": "PASS" if ok else "FAIL", **info})
+
+
+async def wait_for(cond, timeout: float) -> bool:
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        await asyncio.sleep(0.05)
+    return cond()
+
+
+async def reserve(client: httpx.AsyncClient, ids: List[str]) -> None:
+    res = await client.post("/reservations/ids", json={"p_ticket_ids": ids, "p_session_id": str(uuid.uuid4())})
+    res.raise_for_status()
+
+
+async def run_scenarios(state: ExpiryStub, api_url: str, tickets: int, grace: float) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    async with httpx.AsyncClient(base_url=api_url, timeout=30.0) as client:
+        # reconcile: las reservas previas al arranque ya deben estar liberadas o en cola
+        pre = [r["id"] for r in state.existing]
+        ok = await wait_for(lambda: all(t in state.released for t in pre), state.hold_seconds + grace + 5)
+        check(results, "reconcile", ok, tickets=len(pre), released=sum(t in state.released for t in pre))
+
+        # prompt: reservas escalonadas en el tiempo, en solicitudes de 1..5 tickets
+        ids = [str(uuid.uuid4()) for _ in range(tickets)]
+        deadlines: Dict[str, float] = {}
+        i = 0
+        while i < len(ids):
+            chunk = ids[i:i + 1 + i % 5]
+            await reserve(client, chunk)
+            for t in chunk:
+                deadlines[t] = state.deadlines[t]
+            i += len(chunk)
+            await asyncio.sleep(0.01)
+        batches_before = len(state.batches)
+        ok = await wait_for(lambda: all(t in state.released for t in ids), state.hold_seconds + grace + 10)
+        lags = [state.released[t] - deadlines[t] for t in ids if t in state.released]
+        batches = state.batches[batches_before:]
+        check(
+            results, "prompt", ok and percentile(lags, 99) < grace + 1.0,
+            tickets=len(ids), lag_p50_s=round(percentile(lags, 50), 3), lag_p99_s=round(percentile(lags, 99), 3),
+            batches=len(batches), max_batch=max(batches or [0]),
+        )
+
+        # release: liberados por la sesión antes de vencer -> no aparecen en ningún lote posterior
+        gone = [str(uuid.uuid4()) for _ in range(5)]
+        await reserve(client, gone)
+        await client.post("/reservations/release", json={"p_ticket_ids": gone, "p_session_id": str(uuid.uuid4())})
+        sent_before = sum(state.batches)
+        await asyncio.sleep(state.hold_seconds + grace + 1.0)
+        check(results, "release", not any(t in state.released for t in gone), extra_ids_sent=sum(state.batches) - sent_before)
+
+        # renewed: al vencer, la base informa un nuevo reserved_until (+2 s)
+        renewed = str(uuid.uuid4())
+        await reserve(client, [renewed])
+        first_deadline = state.deadlines[renewed]
+        state.renew[renewed] = 2.0
+        ok = await wait_for(lambda: renewed in state.released, state.hold_seconds + grace + 6)
+        delay = state.released.get(renewed, 0) - first_deadline
+        check(results, "renewed", ok and delay >= 2.0, released_after_s=round(delay, 3))
+
+        # retry: el primer intento de liberación falla
+        state.fail_next = 1
+        retried = str(uuid.uuid4())
+        await reserve(client, [retried])
+        ok = await wait_for(lambda: retried in state.released, state.hold_seconds + grace + 10)
+        check(results, "retry", ok and state.fail_next == 0)
+
+        health = (await client.get("/health/expiry")).json()
+    results.append({"scenario": "health/expiry", "result": "INFO", **{k: v for k, v in health.items() if k != "ok"}})
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=300)
+    parser.add_argument("--hold-seconds", type=float, default=2.0, help="duración de cada reserva en el stub")
+    parser.add_argument("--grace", type=float, default=0.2, help="RESERVATION_EXPIRY_GRACE de la API")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    state = ExpiryStub(args.hold_seconds)
+    start = time.time()
+    state.existing = [
+        {"id": str(uuid.uuid4()), "reserved_until": iso(start + 1.0 + i * 0.001)} for i in range(1500)
+    ]
+    for row in state.existing:
+        state.deadlines[row["id"]] = datetime.fromisoformat(row["reserved_until"]).timestamp()
+
+    env = {"RESERVATION_EXPIRY_GRACE": str(args.grace)}
+    with serve(state.stub.app) as stub_url, serve_api(stub_url, env=env) as api_url:
+        results = asyncio.run(run_scenarios(state, api_url, args.tickets, args.grace))
+    print_table(results)
+    write_json(args.json, {"benchmark": "reservation_expiry", "params": vars(args), "results": results})
+    sys.exit(0 if all(r["result"] in ("PASS", "INFO") for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark: carrito con varias rifas, llamadas por ítem vs /reservations/batch.
+
+Para cada tamaño de carrito (k ítems, mezcla de random e ids) se mide la latencia
+de completar el carrito de tres formas:
+
+* ``sequential``: k POST a /reservations/random|ids uno tras otro (como el front hoy).
+* ``concurrent``: los mismos k POST lanzados a la vez.
+* ``batch``: un solo POST /reservations/batch (un RPC ``reserve_tickets_batch``).
+
+El stub simula la latencia de Supabase por RPC; el RPC de lote cobra además un
+pequeño coste por ítem (``--item-ms``), ya que en la base hace el mismo trabajo.
+
+Uso (desde apps/api):
+    python -m bench.reservations_batch --latency-ms 50 --sizes 1,2,4,8 --concurrency 16
+"""
+import argparse
+import asyncio
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+
+from .common import print_table, run_load, serve_api, serve_process, write_json
+from .reservations_load import build_stub
+
+RAFFLES = [str(uuid.UUID(int=i + 1)) for i in range(8)]
+
+
+def _reserve_batch(p: Dict[str, Any]) -> Dict[str, Any]:
+    items = []
+    for i, item in enumerate(p.get("p_items") or []):
+        n = len(item.get("ticket_ids") or []) if item["type"] == "ids" else int(item.get("quantity") or 0)
+        reserved = [{"id": str(uuid.uuid4()), "raffle_id": item.get("raffle_id"), "ticket_number": str(j)} for j in range(n)]
+        items.append({"index": i, "type": item["type"], "raffle_id": item.get("raffle_id"),
+                      "requested": n, "reserved": reserved, "ok": True, "error": None})
+    return {"ok": True, "atomic": bool(p.get("p_atomic")), "items": items}
+
+
+def cart(size: int, i: int) -> List[Dict[str, Any]]:
+    """Carrito de ``size`` ítems: rifas distintas, alternando random y números elegidos."""
+    items = []
+    for k in range(size):
+        if k % 2 == 0:
+            items.append({"type": "random", "p_raffle_id": RAFFLES[k % len(RAFFLES)], "p_quantity": 2})
+        else:
+            items.append({"type": "ids", "p_ticket_ids": [str(uuid.UUID(int=(i << 8) + k))]})
+    return items
+
+
+def _single(client: httpx.AsyncClient, item: Dict[str, Any], session: str) -> Any:
+    if item["type"] == "random":
+        body = {"p_raffle_id": item["p_raffle_id"], "p_quantity": item["p_quantity"], "p_session_id": session}
+        return client.post("/reservations/random", json=body)
+    return client.post("/reservations/ids", json={"p_ticket_ids": item["p_ticket_ids"], "p_session_id": session})
+
+
+def make_sender(mode: str, size: int):
+    async def send(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        session = str(uuid.UUID(int=i + 1000))
+        items = cart(size, i)
+        if mode == "batch":
+            return await client.post("/reservations/batch", json={"p_session_id": session, "p_items": items})
+        if mode == "concurrent":
+            responses = await asyncio.gather(*(_single(client, it, session) for it in items))
+        else:
+            responses = [await _single(client, it, session) for it in items]
+        # El carrito falla si falla cualquiera de sus llamadas
+        return max(responses, key=lambda r: r.status_code)
+
+    return send
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="latencia simulada de cada RPC")
+    parser.add_argument("--item-ms", type=float, default=1.0, help="coste extra por ítem dentro del RPC de lote")
+    parser.add_argument("--sizes", default="1,2,4,8", help="tamaños de carrito separados por coma")
+    parser.add_argument("--concurrency", type=int, default=16, help="carritos concurrentes")
+    parser.add_argument("--carts", type=int, default=160, help="carritos por medición")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    stub = build_stub(args.latency_ms)
+
+    async def reserve_batch(p: Dict[str, Any]) -> Dict[str, Any]:
+        # Aproxima el trabajo por ítem que hace la base dentro del RPC de lote
+        await asyncio.sleep(args.item_ms * len(p.get("p_items") or []) / 1000.0)
+        return _reserve_batch(p)
+
+    stub.on_rpc("reserve_tickets_batch", reserve_batch)
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    rows: List[Dict[str, Any]] = []
+    with serve_process(stub.app) as stub_url, serve_api(stub_url) as api_url:
+        # Calienta el cache de metadatos de rifas para no medir la primera lectura
+        asyncio.run(run_load(make_sender("sequential", len(RAFFLES)), 2, 1, base_url=api_url))
+        for size in sizes:
+            for mode in ("sequential", "concurrent", "batch"):
+                result = asyncio.run(run_load(make_sender(mode, size), args.carts, args.concurrency, base_url=api_url))
+                http_calls = 1 if mode == "batch" else size
+                rows.append({"cart_size": size, "mode": mode, "http_calls": http_calls, **result})
+    print_table(rows)
+    write_json(args.json, {"benchmark": "reservations_batch", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Prueba de carga de /reservations con un stub local de los RPCs.
+
+Mide el throughput de la API con 1..N clientes concurrentes. Con los handlers
+asíncronos la concurrencia no queda limitada por el threadpool de Starlette
+(~40 hilos): mientras el stub simula la latencia de Supabase, el throughput
+debe crecer con los clientes hasta saturar la CPU.
+
+Uso (desde apps/api):
+    python -m bench.reservations_load --latency-ms 50 --concurrency 1,8,32,128,256
+"""
+import argparse
+import asyncio
+import uuid
+from typing import Any, Awaitable, Dict, List
+
+import httpx
+
+from .common import print_table, run_load, serve_api, serve_process, write_json
+from .stub_supabase import StubPostgrest
+
+RAFFLE_ID = str(uuid.UUID(int=1))
+
+
+def build_stub(latency_ms: float) -> StubPostgrest:
+    stub = StubPostgrest(latency_ms=latency_ms)
+    stub.on_table("raffles", lambda params: [{"total_tickets": 10000, "is_free": False}])
+    stub.on_rpc(
+        "ensure_and_reserve_random_tickets",
+        lambda p: [{"id": str(uuid.uuid4()), "status": "reserved"} for _ in range(int(p.get("p_quantity") or 0))],
+    )
+    stub.on_rpc("reserve_tickets", lambda p: [{"id": t, "status": "reserved"} for t in p.get("p_ticket_ids", [])])
+    stub.on_rpc("release_tickets", lambda p: [{"id": t, "status": "available"} for t in p.get("p_ticket_ids", [])])
+    return stub
+
+
+def send_mixed(client: httpx.AsyncClient, i: int) -> Awaitable[httpx.Response]:
+    """Mezcla de tráfico de una venta: random, selección por ids y liberación."""
+    session = str(uuid.UUID(int=i + 1000))
+    kind = i % 4
+    if kind in (0, 1):
+        body = {"p_raffle_id": RAFFLE_ID, "p_session_id": session, "p_quantity": 2}
+        return client.post("/reservations/random", json=body)
+    ticket = str(uuid.UUID(int=i + 10_000))
+    if kind == 2:
+        return client.post("/reservations/ids", json={"p_ticket_ids": [ticket], "p_session_id": session})
+    return client.post("/reservations/release", json={"p_ticket_ids": [ticket], "p_session_id": session})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="latencia simulada de cada RPC")
+    parser.add_argument("--concurrency", default="1,8,32,128,256", help="niveles de concurrencia separados por coma")
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    rows: List[Dict[str, Any]] = []
+    with serve_process(build_stub(args.latency_ms).app) as stub_url, serve_api(stub_url) as api_url:
+        for c in levels:
+            result = asyncio.run(run_load(send_mixed, c * args.requests_per_client, c, base_url=api_url))
+            rows.append({"concurrency": c, **result})
+    print_table(rows)
+    write_json(args.json, {"benchmark": "reservations_load", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
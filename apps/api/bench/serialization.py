@@ -0,0 +1,169 @@
+"""Serialización y compresión de respuestas grandes (en proceso, sin red).
+
+Payloads representativos:
+
+  verify        ``{"ok": true, "data": [...]}`` con --verify-rows filas de verify_tickets
+  availability  estado completo rle/bitmap de una rifa de --tickets números (~30% vendidos)
+
+Por payload mide CPU por respuesta de:
+
+  json          lo que hacía FastAPI: jsonable_encoder + json.dumps (JSONResponse)
+  json.dumps    solo json.dumps (lo que hacía /availability al armar el cuerpo)
+  orjson+enc    ORJSONResponse como default_response_class (la ruta devuelve un dict)
+  orjson        ORJSONResponse devuelto directamente (sin jsonable_encoder)
+  decode        lectura de la respuesta de PostgREST: ``res.json()`` frente a orjson.loads
+
+y bytes en el cable sin comprimir, con gzip y con br (si está instalado brotli),
+con el tiempo de comprimir. Al final pasa el payload verify por
+CompressionMiddleware y verifica que el cuerpo descomprimido sea idéntico.
+
+Uso (desde apps/api):
+    python -m bench.serialization --verify-rows 2000 --tickets 100000
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+import httpx
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+
+from app.services.availability import AVAILABLE, RESERVED, SOLD, AvailabilitySnapshot
+from app.services.compression import CompressionMiddleware, brotli, compress
+
+from .common import print_table, write_json
+
+
+def verify_payload(rows: int) -> Dict[str, Any]:
+    rnd = random.Random(1)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    data: List[Dict[str, Any]] = []
+    for i in range(rows):
+        paid = rnd.random() < 0.7
+        data.append({
+            "raffle_id": str(uuid.UUID(int=i // 100)),
+            "raffle_name": f"Rifa {i // 100} - Moto 0km",
+            "ticket_id": str(uuid.UUID(int=(1 << 64) + i)),
+            "ticket_number": str(rnd.randint(1, 100000)).zfill(5),
+            "ticket_status": "sold" if paid else "reserved",
+            "payment_id": str(uuid.UUID(int=(2 << 64) + i // 5)),
+            "payment_status": "approved" if paid else "pending",
+            "created_at": (base + timedelta(seconds=i * 37)).isoformat(),
+        })
+    return {"ok": True, "data": data}
+
+
+def availability_payload(tickets: int, encoding: str) -> Dict[str, Any]:
+    rnd = random.Random(2)
+    snap = AvailabilitySnapshot(str(uuid.UUID(int=42)))
+    updates = []
+    for n in range(1, tickets + 1):
+        x = rnd.random()
+        code = SOLD if x < 0.30 else (RESERVED if x < 0.32 else AVAILABLE)
+        updates.append((n, code, "s" if code == RESERVED else None))
+    snap.apply(updates)
+    return {"ok": True, "raffle_id": snap.raffle_id, "version": snap.version, "size": len(snap.codes),
+            "counts": snap.counts(), "full": True, "encoding": encoding, "data": snap.encode(encoding)}
+
+
+def cpu_us(fn: Callable[[], Any], budget: float) -> float:
+    """Microsegundos de CPU por llamada, repitiendo hasta gastar ``budget`` segundos."""
+    fn()
+    n = 0
+    started = time.process_time()
+    while True:
+        fn()
+        n += 1
+        elapsed = time.process_time() - started
+        if elapsed >= budget:
+            return elapsed / n * 1e6
+
+
+def measure(name: str, payload: Dict[str, Any], budget: float) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    raw = ORJSONResponse(payload).body
+    encoders = {
+        "json": lambda: JSONResponse(jsonable_encoder(payload)).body,
+        "json.dumps": lambda: json.dumps(payload, separators=(",", ":")).encode("utf-8"),
+        "orjson+enc": lambda: ORJSONResponse(jsonable_encoder(payload)).body,
+        "orjson": lambda: ORJSONResponse(payload).body,
+    }
+    base = None
+    for label, fn in encoders.items():
+        us = cpu_us(fn, budget)
+        base = base or us
+        rows.append({"payload": name, "step": f"encode {label}", "cpu_us": round(us, 1),
+                     "speedup": round(base / us, 2), "bytes": len(fn())})
+
+    res = httpx.Response(200, content=raw, headers={"content-type": "application/json"})
+    json_us = cpu_us(res.json, budget)
+    orjson_us = cpu_us(lambda: orjson.loads(res.content), budget)
+    rows.append({"payload": name, "step": "decode res.json()", "cpu_us": round(json_us, 1), "speedup": 1.0,
+                 "bytes": len(raw)})
+    rows.append({"payload": name, "step": "decode orjson", "cpu_us": round(orjson_us, 1),
+                 "speedup": round(json_us / orjson_us, 2), "bytes": len(raw)})
+
+    rows.append({"payload": name, "step": "wire identity", "bytes": len(raw), "ratio": 1.0})
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    for encoding in encodings:
+        data = compress(raw, encoding)
+        rows.append({"payload": name, "step": f"wire {encoding}", "bytes": len(data),
+                     "ratio": round(len(data) / len(raw), 3),
+                     "cpu_us": round(cpu_us(lambda: compress(raw, encoding), budget), 1)})
+    return rows
+
+
+async def check_middleware(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """El cuerpo comprimido por CompressionMiddleware se descomprime al original."""
+    raw = ORJSONResponse(payload).body
+
+    async def app(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        await Response(raw, media_type="application/json", headers={"ETag": '"x"'})(scope, receive, send)
+
+    transport = httpx.ASGITransport(app=CompressionMiddleware(app))
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for accept in ("gzip", "br, gzip", "identity"):
+            res = await client.get("/", headers={"Accept-Encoding": accept})
+            results[accept] = (res.headers.get("content-encoding"), len(res.content) == len(raw) and res.content == raw,
+                               res.headers.get("etag"), int(res.headers["content-length"]) < len(raw))
+    gz, br, plain = results["gzip"], results["br, gzip"], results["identity"]
+    ok = (gz[0] == "gzip" and gz[1] and gz[2] == 'W/"x"' and gz[3]
+          and br[0] == ("br" if brotli is not None else "gzip") and br[1]
+          and plain[0] is None and plain[1] and plain[2] == '"x"')
+    return {"payload": "verify", "step": "middleware", "result": "PASS" if ok else "FAIL",
+            "encodings": f"gzip->{gz[0]} br->{br[0]} identity->{plain[0]}"}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verify-rows", type=int, default=2000)
+    parser.add_argument("--tickets", type=int, default=100000)
+    parser.add_argument("--budget", type=float, default=0.5, help="segundos de CPU por medición")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    verify = verify_payload(args.verify_rows)
+    results = measure("verify", verify, args.budget)
+    for encoding in ("rle", "bitmap"):
+        results += measure(f"availability {encoding}", availability_payload(args.tickets, encoding), args.budget)
+    results.append(asyncio.run(check_middleware(verify)))
+    print_table(results)
+    if brotli is None:
+        print("brotli no instalado: solo gzip")
+    write_json(args.json, {"benchmark": "serialization", "params": vars(args), "results": results})
+    # orjson directo debe ganarle al encoder por defecto en el payload de verify
+    encode = {r["step"]: r["cpu_us"] for r in results if r["payload"] == "verify" and r["step"].startswith("encode")}
+    ok = results[-1]["result"] == "PASS" and encode["encode orjson"] < encode["encode json"]
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Benchmark: caches en proceso vs nivel compartido entre workers (services/shared_cache.py).
+
+1. Latencia de un acierto por nivel, en este proceso: cache en proceso (TTLCache.get),
+   nivel compartido SQLite (fallo en proceso, acierto compartido: lectura + orjson) y,
+   como referencia, un fallo completo contra el stub de PostgREST (--latency-ms).
+   Con dos valores: metadatos de una rifa y un resultado de /verify de --verify-rows filas.
+
+2. Arranque en frío con 1 y 4 workers, con CACHE_SHARED_BACKEND=none y =sqlite:
+   --queries búsquedas distintas de /verify repetidas hasta --requests solicitudes
+   repartidas entre --concurrency conexiones (uvicorn reparte las conexiones entre
+   workers). ``verify_rpc`` = llamadas que llegaron a verify_tickets y ``miss_pct`` su
+   porcentaje sobre las solicitudes; ``mirror_calls`` = consultas a los mirrors de la
+   tasa durante el arranque (cada worker refresca la suya).
+
+Uso (desde apps/api):
+    python -m bench.shared_cache --workers 1,4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlencode
+
+import httpx
+
+from app.services.cache import TTLCache, attach_shared_tier
+from app.services.shared_cache import SQLiteTier
+
+from .common import percentile, print_table, serve, serve_api, serve_process, write_json
+from .loadgen import run_raw_load
+from .rate_mirrors import FakeMirrors
+from .serialization import verify_payload
+from .stub_supabase import StubPostgrest
+
+
+def build_stub(args: argparse.Namespace) -> StubPostgrest:
+    stub = StubPostgrest(latency_ms=args.latency_ms)
+    rows = verify_payload(args.verify_rows)["data"]
+    stub.on_table("raffles", lambda params: [{"total_tickets": 100000, "is_free": False}])
+    stub.on_rpc("verify_tickets", lambda p: rows)
+    return stub
+
+
+def timed(fn, n: int) -> Dict[str, float]:
+    samples: List[float] = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return {"p50_us": round(percentile(samples, 50) * 1e6, 1), "p99_us": round(percentile(samples, 99) * 1e6, 1)}
+
+
+async def tier_latency(stub_url: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    values = {
+        "raffle_meta": ("9f0c2c4e-0000-0000-0000-000000000001", {"total_tickets": 100000, "is_free": False}),
+        f"verify_{args.verify_rows}_rows": (("buyer1@bench.test", True), verify_payload(args.verify_rows)["data"]),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        tier = SQLiteTier(os.path.join(tmp, "cache.sqlite3"))
+        attach_shared_tier(tier, "bench")
+        try:
+            for name, (key, value) in values.items():
+                cache = TTLCache(f"bench_{name}", maxsize=1024, ttl=60.0, shared=True)
+                cache.set(key, value)
+                rows.append({"tier": "process", "value": name, **timed(lambda: cache.get(key), args.iterations)})
+
+                def shared_hit() -> None:
+                    cache._data.clear()
+                    cache.get(key)
+
+                rows.append({"tier": "shared_sqlite", "value": name, **timed(shared_hit, args.iterations)})
+        finally:
+            attach_shared_tier(None)
+            tier.close()
+    # Referencia: un fallo paga el round trip a PostgREST
+    async with httpx.AsyncClient(base_url=stub_url) as client:
+        samples: List[float] = []
+        for _ in range(min(args.iterations, 200)):
+            t0 = time.perf_counter()
+            await client.post("/rest/v1/rpc/verify_tickets", json={"p_query": "buyer1@bench.test"})
+            samples.append(time.perf_counter() - t0)
+    rows.append({"tier": "miss_postgrest", "value": f"verify_{args.verify_rows}_rows",
+                 "p50_us": round(percentile(samples, 50) * 1e6, 1), "p99_us": round(percentile(samples, 99) * 1e6, 1)})
+    return rows
+
+
+async def stub_calls(stub_url: str) -> Dict[str, int]:
+    async with httpx.AsyncClient(base_url=stub_url) as client:
+        return (await client.get("/_faults")).json()["calls"]
+
+
+async def cold_start(api_url: str, stub_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    paths = ["/verify?" + urlencode({"q": f"buyer{i}@bench.test"}) for i in range(args.queries)]
+    before = (await stub_calls(stub_url)).get("rpc:verify_tickets", 0)
+    result = await run_raw_load(lambda i: ("GET", paths[i % len(paths)], None), args.requests, args.concurrency, api_url)
+    calls = (await stub_calls(stub_url)).get("rpc:verify_tickets", 0) - before
+    return {"verify_rpc": calls, "miss_pct": round(100.0 * calls / args.requests, 2),
+            "rps": result["rps"], "p50_ms": result["p50_ms"], "p99_ms": result["p99_ms"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia del stub por llamada a Supabase")
+    parser.add_argument("--verify-rows", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=20000, help="lecturas por nivel")
+    parser.add_argument("--workers", default="1,4", help="workers de uvicorn, separados por coma")
+    parser.add_argument("--queries", type=int, default=200, help="búsquedas distintas de /verify")
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    mirrors = FakeMirrors()
+    mirrors.set("bcv", latency=0.02)
+    tiers: List[Dict[str, Any]] = []
+    cold: List[Dict[str, Any]] = []
+    with serve_process(build_stub(args).app) as stub_url, serve(mirrors.app) as mirrors_url:
+        tiers = asyncio.run(tier_latency(stub_url, args))
+        for workers in [int(x) for x in args.workers.split(",") if x.strip()]:
+            for backend in ("none", "sqlite"):
+                with tempfile.TemporaryDirectory() as tmp:
+                    env = {
+                        "CACHE_SHARED_BACKEND": backend,
+                        "CACHE_SHARED_PATH": os.path.join(tmp, "cache.sqlite3"),
+                        "WEBHOOK_OUTBOX_PATH": os.path.join(tmp, "outbox.sqlite3"),
+                        "RATE_MIRRORS": mirrors.urls(mirrors_url, ["bcv"])[0],
+                        "VERIFY_CACHE_TTL": "300",
+                        "RESERVATION_EXPIRY_ENABLED": "false",
+                        "COUNTERS_DRIFT_ENABLED": "false",
+                    }
+                    mirrors.hits.clear()
+                    with serve_api(stub_url, env=env, workers=workers) as api_url:
+                        # Sin pausa: cada worker todavía está arrancando (en frío)
+                        row = asyncio.run(cold_start(api_url, stub_url, args))
+                        time.sleep(1.0)
+                    cold.append({"workers": workers, "shared": backend, **row,
+                                 "mirror_calls": sum(mirrors.hits.values())})
+    print_table(tiers)
+    print()
+    print_table(cold)
+    write_json(args.json, {"benchmark": "shared_cache", "params": vars(args), "tiers": tiers, "cold_start": cold})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Prueba de carga de ``GET /raffles/{id}/stream`` (SSE) contra el stub.
+
+Abre muchos suscriptores sobre sockets crudos (sin un cliente HTTP por
+conexión), reserva números a través de la API y mide:
+
+  fanout   latencia desde el POST de la reserva hasta que cada suscriptor recibe
+           el cambio (p50/p99/max) y bytes por suscriptor
+  slow     un cliente que no lee mientras hay
+           reservas: al reanudar recibe deltas coalescidos en vez de la cola de
+           eventos; se compara con un cliente que lee al día
+
+En ambos se verifica que el estado reconstruido (snapshot + deltas) sea igual
+al de ``/availability``.
+
+Uso (desde apps/api):
+    python -m bench.stream_fanout --subscribers 2000 --reservations 20
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from .availability import RAFFLE_ID, build_stub
+from .common import percentile, print_table, serve_api, serve_process, write_json
+
+
+def ticket_id(number: int) -> str:
+    return str(uuid.UUID(int=(1 << 64) + number))
+
+
+def decode_rle(data: List[int]) -> List[int]:
+    out: List[int] = []
+    for i in range(0, len(data), 2):
+        out.extend([data[i]] * data[i + 1])
+    return out
+
+
+class Subscriber:
+    """Conexión SSE sobre asyncio streams: decodifica chunked y aplica los eventos."""
+
+    def __init__(self, url: str, limit: int = 2 ** 16) -> None:
+        self.url = urlparse(url)
+        self.limit = limit
+        self.codes: List[int] = []
+        self.version: Optional[str] = None
+        self.frames: Dict[str, int] = {}
+        self.bytes = 0
+        self.seen: Dict[int, float] = {}
+        self.ready = asyncio.Event()
+        self.paused = asyncio.Event()
+        self.paused.set()
+        self.changed = asyncio.Event()
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self) -> asyncio.StreamReader:
+        # ``limit`` chico: el StreamReader deja de leer del socket con poco buffer
+        reader, self.writer = await asyncio.open_connection(self.url.hostname, self.url.port, limit=self.limit)
+        self.writer.write(
+            f"GET {self.url.path} HTTP/1.1\r\nHost: {self.url.netloc}\r\nAccept: text/event-stream\r\n\r\n".encode()
+        )
+        await self.writer.drain()
+        status = await reader.readline()
+        if b" 200 " not in status:
+            raise RuntimeError(f"stream failed: {status!r}")
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        return reader
+
+    async def run(self, reader: asyncio.StreamReader) -> None:
+        buf = b""
+        while True:
+            await self.paused.wait()
+            size = int((await reader.readline()).strip() or b"0", 16)
+            if size == 0:
+                return
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            self.bytes += size
+            buf += chunk
+            while b"\n\n" in buf:
+                raw, buf = buf.split(b"\n\n", 1)
+                self._event(raw)
+
+    def _event(self, raw: bytes) -> None:
+        fields: Dict[str, str] = {}
+        for line in raw.decode().split("\n"):
+            if line and not line.startswith(":"):
+                key, _, value = line.partition(": ")
+                fields[key] = value
+        event = fields.get("event")
+        if not event:
+            return
+        self.frames[event] = self.frames.get(event, 0) + 1
+        payload = json.loads(fields["data"])
+        if event == "snapshot":
+            self.codes = decode_rle(payload["data"])
+            self.ready.set()
+        elif event == "changes":
+            now = time.perf_counter()
+            for number, code in payload["changes"]:
+                self.codes[number - 1] = code
+                self.seen.setdefault(number, now)
+        self.version = payload["version"]
+        self.changed.set()
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def open_subscribers(url: str, count: int, wait: bool = True, **kwargs: Any) -> List[Subscriber]:
+    subs = [Subscriber(url, **kwargs) for _ in range(count)]
+    if not wait:
+        for s in subs:
+            s.paused.clear()
+
+    async def start(sub: Subscriber) -> None:
+        reader = await sub.connect()
+        asyncio.ensure_future(sub.run(reader))
+
+    # En tandas para no saturar el backlog de accept del servidor
+    for i in range(0, count, 200):
+        await asyncio.gather(*(start(s) for s in subs[i:i + 200]))
+    if wait:
+        await asyncio.wait_for(asyncio.gather(*(s.ready.wait() for s in subs)), timeout=120)
+    return subs
+
+
+async def wait_version(subs: List[Subscriber], version: str, timeout: float) -> bool:
+    async def one(sub: Subscriber) -> None:
+        while sub.version != version:
+            sub.changed.clear()
+            await sub.changed.wait()
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*(one(s) for s in subs)), timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def reserve(client: httpx.AsyncClient, numbers: List[int]) -> None:
+    res = await client.post("/reservations/ids", json={
+        "p_ticket_ids": [ticket_id(n) for n in numbers], "p_session_id": str(uuid.uuid4()),
+    })
+    res.raise_for_status()
+
+
+async def release(client: httpx.AsyncClient, numbers: List[int]) -> None:
+    res = await client.post("/reservations/release", json={
+        "p_ticket_ids": [ticket_id(n) for n in numbers], "p_session_id": str(uuid.uuid4()),
+    })
+    res.raise_for_status()
+
+
+async def current(client: httpx.AsyncClient) -> Dict[str, Any]:
+    res = await client.get(f"/raffles/{RAFFLE_ID}/availability")
+    res.raise_for_status()
+    return res.json()
+
+
+async def run(api_url: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    stream_url = f"{api_url}/raffles/{RAFFLE_ID}/stream"
+    async with httpx.AsyncClient(base_url=api_url, timeout=60.0) as client:
+        await current(client)
+        t0 = time.perf_counter()
+        subs = await open_subscribers(stream_url, args.subscribers)
+        connect_s = time.perf_counter() - t0
+        free = [i + 1 for i, c in enumerate(subs[0].codes) if c == 0]
+
+        # fanout: una reserva cada --interval segundos, latencia por suscriptor
+        sent: Dict[int, float] = {}
+        for number in free[:args.reservations]:
+            sent[number] = time.perf_counter()
+            await reserve(client, [number])
+            await asyncio.sleep(args.interval)
+        state = await current(client)
+        ok = await wait_version(subs, state["version"], timeout=30)
+        lat = [s.seen[n] - t for s in subs for n, t in sent.items() if n in s.seen]
+        missing = sum(n not in s.seen for s in subs for n in sent)
+        expected = decode_rle(state["data"])
+        mismatched = sum(s.codes != expected for s in subs)
+        results.append({
+            "scenario": "fanout", "result": "PASS" if ok and not missing and not mismatched else "FAIL",
+            "subscribers": len(subs), "connect_s": round(connect_s, 2), "events": len(sent) * len(subs),
+            "p50_ms": round(percentile(lat, 50) * 1000, 1), "p99_ms": round(percentile(lat, 99) * 1000, 1),
+            "max_ms": round(max(lat or [0]) * 1000, 1), "missing": missing, "mismatched": mismatched,
+            "bytes_per_sub": sum(s.bytes for s in subs) // len(subs),
+        })
+        fast = subs[0]
+        for s in subs[1:]:
+            s.close()
+
+        # slow: se conecta y no lee (ni el snapshot) mientras se reservan y liberan
+        # --slow-batch números por tanda. Los buffers de loopback absorben ~3 MB por
+        # conexión, así que hace falta volumen para que el servidor quede bloqueado.
+        # Solo queda abierto un suscriptor al día como referencia
+        slow = (await open_subscribers(stream_url, 1, wait=False, limit=4096))[0]
+        before = dict(fast.frames)
+        block = free[args.reservations:args.reservations + args.slow_batch]
+        for i in range(args.slow_updates):
+            if i % 2 == 0:
+                await reserve(client, block)
+            else:
+                await release(client, block)
+            await asyncio.sleep(args.batch_interval * 1.5)
+        state = await current(client)
+        version = state["version"]
+        await wait_version([fast], version, timeout=60)
+        t0 = time.perf_counter()
+        slow.paused.set()
+        ok = await wait_version([slow], version, timeout=60)
+        catchup_s = time.perf_counter() - t0
+        expected = decode_rle(state["data"])
+        mismatched = sum(s.codes != expected for s in (fast, slow))
+        results.append({
+            "scenario": "slow", "result": "PASS" if ok and not mismatched else "FAIL",
+            "updates": args.slow_updates,
+            "fast_frames": sum(fast.frames.values()) - sum(before.values()),
+            "slow_frames": sum(slow.frames.values()),
+            "fast_bytes": fast.bytes, "slow_bytes": slow.bytes, "catchup_s": round(catchup_s, 2),
+            "mismatched": mismatched,
+        })
+
+        health = (await client.get("/health/cache")).json()["stream"]
+        results.append({"scenario": "health/cache stream", "result": "INFO", "subscribers": health["subscribers"],
+                        "broadcasts": sum(c["broadcasts"] for c in health["channels"].values())})
+        fast.close()
+        slow.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--reservations", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.3, help="segundos entre reservas")
+    parser.add_argument("--slow-updates", type=int, default=100, help="tandas mientras el cliente lento no lee")
+    parser.add_argument("--slow-batch", type=int, default=10000, help="números por tanda")
+    parser.add_argument("--batch-interval", type=float, default=0.2, help="STREAM_BATCH_INTERVAL de la API")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latencia simulada por request a PostgREST")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    env = {"STREAM_BATCH_INTERVAL": str(args.batch_interval), "STREAM_MAX_SUBSCRIBERS": str(args.subscribers + 10)}
+    stub = build_stub(args.tickets, args.latency_ms)
+    with serve_process(stub.app) as stub_url, serve_api(stub_url, env=env) as api_url:
+        results = asyncio.run(run(api_url, args))
+    print_table(results)
+    write_json(args.json, {"benchmark": "stream_fanout", "params": vars(args), "results": results})
+    sys.exit(0 if all(r["result"] in ("PASS", "INFO") for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Stub local de PostgREST (``/rest/v1``) para benchmarks y pruebas de carga.
+
+Responde RPCs y lecturas de tablas con handlers configurables y una latencia
+artificial, de modo que la API se pueda medir sin tocar Supabase real.
+
+Fallas inyectables (``faults``, o ``POST /_faults`` con el stub en otro proceso;
+``GET /_faults`` devuelve además las llamadas recibidas):
+``error_rate``/``error_status`` (respuestas de error al azar), ``slow_rate``/``slow_ms``
+(cola de latencia) y ``hang_ms`` (cada request espera eso antes de responder).
+"""
+import asyncio
+import inspect
+import random
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+Handler = Callable[[Dict[str, Any]], Any]
+
+NO_FAULTS: Dict[str, float] = {"error_rate": 0.0, "error_status": 503, "slow_rate": 0.0, "slow_ms": 0.0, "hang_ms": 0.0}
+
+
+class StubError(Exception):
+    """Lanzar desde un handler para responder con un error HTTP de PostgREST."""
+
+    def __init__(self, status: int, code: str = "", message: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.body = {"code": code, "message": message}
+
+
+class StubPostgrest:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rpc_handlers: Dict[str, Handler] = {}
+        self.table_handlers: Dict[str, Handler] = {}
+        self.calls: Counter = Counter()
+        self.faults: Dict[str, float] = dict(NO_FAULTS)
+        self.app = Starlette(
+            routes=[
+                Route("/_faults", self._faults_route, methods=["GET", "POST"]),
+                Route("/rest/v1/rpc/{name}", self._rpc, methods=["POST"]),
+                Route("/rest/v1/{table}", self._table, methods=["GET", "PATCH"]),
+            ]
+        )
+
+    def on_rpc(self, name: str, handler: Handler) -> None:
+        """Registra la respuesta de un RPC; el handler recibe el payload JSON
+        (puede ser una corrutina)."""
+        self.rpc_handlers[name] = handler
+
+    def on_table(self, table: str, handler: Handler) -> None:
+        """Registra la respuesta de un GET/PATCH a una tabla; recibe los query params
+        (y ``_body`` en PATCH)."""
+        self.table_handlers[table] = handler
+
+    async def _delay(self) -> None:
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+
+    def set_faults(self, **faults: float) -> None:
+        """Reemplaza las fallas inyectadas (lo no indicado vuelve a cero)."""
+        self.faults = {**NO_FAULTS, **faults}
+
+    async def _faults_route(self, request: Request) -> JSONResponse:
+        if request.method == "POST":
+            self.set_faults(**(await request.json()))
+        return JSONResponse({"faults": self.faults, "calls": dict(self.calls)})
+
+    async def _fault(self) -> Optional[JSONResponse]:
+        f = self.faults
+        if f["hang_ms"]:
+            await asyncio.sleep(f["hang_ms"] / 1000.0)
+        if f["slow_rate"] and random.random() < f["slow_rate"]:
+            await asyncio.sleep(f["slow_ms"] / 1000.0)
+        if f["error_rate"] and random.random() < f["error_rate"]:
+            self.calls["fault:error"] += 1
+            return JSONResponse({"code": "", "message": "injected fault"}, status_code=int(f["error_status"]))
+        return None
+
+    async def _rpc(self, request: Request) -> JSONResponse:
+        name = request.path_params["name"]
+        self.calls[f"rpc:{name}"] += 1
+        payload = await request.json()
+        await self._delay()
+        fault = await self._fault()
+        if fault is not None:
+            return fault
+        handler: Optional[Handler] = self.rpc_handlers.get(name)
+        try:
+            result = handler(payload) if handler else []
+            if inspect.isawaitable(result):
+                result = await result
+            return JSONResponse(result)
+        except StubError as e:
+            return JSONResponse(e.body, status_code=e.status)
+
+    async def _table(self, request: Request) -> JSONResponse:
+        table = request.path_params["table"]
+        self.calls[f"{request.method.lower()}:{table}"] += 1
+        params: Dict[str, Any] = dict(request.query_params)
+        if request.method == "PATCH":
+            params["_body"] = await request.json()
+        await self._delay()
+        fault = await self._fault()
+        if fault is not None:
+            return fault
+        handler = self.table_handlers.get(table)
+        if handler:
+            try:
+                return JSONResponse(handler(params))
+            except StubError as e:
+                return JSONResponse(e.body, status_code=e.status)
+        return JSONResponse([params.get("_body", {})] if request.method == "PATCH" else [])
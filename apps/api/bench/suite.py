@@ -0,0 +1,248 @@
+"""Suite de carga reproducible de la API contra el stub de PostgREST.
+
+Levanta el stub (``/rest/v1`` y ``/rest/v1/rpc`` con latencia configurable), mirrors
+falsos de la tasa y la API real en procesos aparte, y corre cargas con guion:
+
+  sale_steady   POST /reservations/random con --steady-concurrency clientes
+  sale_spike    lo mismo con --spike-concurrency (apertura de una venta)
+  verify_storm  GET /verify con pocas búsquedas repetidas (todos refrescando a la vez);
+                ``rpc_calls`` = llamadas que llegaron a verify_tickets
+  webhook_burst POST /webhooks/payment, cada referencia --webhook-dupes veces;
+                ``drain_s`` = hasta que la cola queda sin pendientes
+  rate          GET /api/rate (desde memoria, refrescado contra los mirrors falsos)
+
+Cada carga reporta throughput, percentiles de latencia y conteo por status (el
+cliente es bench/loadgen.py: con cientos de conexiones, httpx mediría al cliente).
+En sale_spike la admisión responde 429 a lo que no cabe en la cola: esos van en
+``rejected`` (no son errores) y ``ok_rps`` / ``ok_p99_ms`` cuentan solo las 2xx.
+Con --json se guarda el resultado junto con el commit, y con --compare se compara
+contra un JSON anterior: ok_rps que baja o ok_p99_ms que sube más de --tolerance
+cuenta como regresión (exit 1). Para comparar commits, misma máquina y mismos parámetros.
+
+Uso (desde apps/api):
+    python -m bench.suite --json bench-$(git rev-parse --short HEAD).json
+    python -m bench.suite --compare bench-<commit anterior>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+from urllib.parse import urlencode
+
+import httpx
+
+from .common import print_table, serve_api, serve_process, write_json
+from .loadgen import run_raw_load
+from .rate_mirrors import FakeMirrors
+from .serialization import verify_payload
+from .stub_supabase import StubPostgrest
+
+RAFFLE_ID = str(uuid.UUID(int=7))
+
+# Métricas comparadas con --compare: (columna, True si más alto es mejor). Solo las
+# respuestas 2xx: los 429 rápidos de la admisión inflarían rps y bajarían p99
+COMPARED = (("ok_rps", True), ("ok_p99_ms", False))
+
+
+def build_stub(args: argparse.Namespace) -> StubPostgrest:
+    """Stub con lo que usan las cargas; todo determinístico a partir de --seed."""
+    stub = StubPostgrest(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    rows = verify_payload(args.verify_rows)["data"]
+    # Con id y status: el CountersDriftJob lee ``select=id`` de las rifas activas
+    stub.on_table("raffles", lambda params: [{"id": RAFFLE_ID, "status": "selling", "total_tickets": 100000,
+                                               "is_free": False}])
+    stub.on_rpc("refresh_raffle_counters", lambda p: [{"raffle_id": p["p_raffle_id"], "sold_drift": 0,
+                                                      "reserved_drift": 0}])
+    stub.on_rpc(
+        "ensure_and_reserve_random_tickets",
+        lambda p: [{"id": str(uuid.uuid4()), "status": "reserved"} for _ in range(int(p.get("p_quantity") or 0))],
+    )
+    stub.on_rpc("verify_tickets", lambda p: rows)
+
+    def payments(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Toda referencia REF-* tiene un pago pendiente con id derivado de la referencia
+        flt = params.get("reference", "")
+        refs = [r.strip('"') for r in flt[len("in.("):-1].split(",")] if flt.startswith("in.(") else [flt[3:]]
+        return [{"id": str(uuid.uuid5(uuid.NAMESPACE_URL, r)), "reference": r, "status": "pending"}
+                for r in refs if r.startswith("REF-")]
+
+    stub.on_table("payments", payments)
+    stub.on_rpc("approve_payments", lambda p: [
+        {"payment_id": pid, "outcome": "approved", "previous_status": "pending", "ticket_ids": []}
+        for pid in p["p_payment_ids"]
+    ])
+    return stub
+
+
+async def stub_calls(stub_url: str) -> Dict[str, int]:
+    async with httpx.AsyncClient(base_url=stub_url) as client:
+        return (await client.get("/_faults")).json()["calls"]
+
+
+async def wait_ready(api_url: str, path: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=api_url) as client:
+        while (await client.get(path)).status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{path} not ready")
+            await asyncio.sleep(0.1)
+
+
+async def sale(api_url: str, requests: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    rnd = random.Random(seed)
+    quantities = [rnd.choice((1, 2, 2, 3, 5)) for _ in range(requests)]
+
+    def build(i: int):
+        body = {"p_raffle_id": RAFFLE_ID, "p_session_id": str(uuid.UUID(int=seed * 1_000_000 + i)),
+                "p_quantity": quantities[i]}
+        return "POST", "/reservations/random", json.dumps(body).encode()
+
+    return await run_raw_load(build, requests, concurrency, api_url)
+
+
+async def verify_storm(api_url: str, stub_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    paths = ["/verify?" + urlencode({"q": f"buyer{i}@bench.test"}) for i in range(args.verify_queries)]
+    before = (await stub_calls(stub_url)).get("rpc:verify_tickets", 0)
+    result = await run_raw_load(lambda i: ("GET", paths[i % len(paths)], None), args.requests,
+                                args.storm_concurrency, api_url)
+    result["rpc_calls"] = (await stub_calls(stub_url)).get("rpc:verify_tickets", 0) - before
+    return result
+
+
+async def webhook_burst(api_url: str, stub_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    refs = [f"REF-{args.seed}-{i:06d}" for i in range(args.webhooks)]
+    order = [r for r in refs for _ in range(args.webhook_dupes)]
+    random.Random(args.seed).shuffle(order)
+
+    bodies = [json.dumps({"reference": ref, "status": "approved", "amount": 10}).encode() for ref in order]
+    started = time.perf_counter()
+    result = await run_raw_load(lambda i: ("POST", "/webhooks/payment", bodies[i]), len(order),
+                                args.storm_concurrency, api_url)
+    async with httpx.AsyncClient(base_url=api_url, timeout=30.0) as client:
+        while True:
+            health = (await client.get("/health/webhooks")).json()
+            if not health.get("pending") or time.perf_counter() - started > 120:
+                break
+            await asyncio.sleep(0.05)
+    result["drain_s"] = round(time.perf_counter() - started, 2)
+    result["done"] = health.get("states", {}).get("done", 0)
+    result["approve_rpc_calls"] = (await stub_calls(stub_url)).get("rpc:approve_payments", 0)
+    return result
+
+
+async def rate(api_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    await wait_ready(api_url, "/api/rate")
+    return await run_raw_load(lambda i: ("GET", "/api/rate", None), args.requests, args.storm_concurrency, api_url)
+
+
+def git_revision() -> Dict[str, Any]:
+    def git(*cmd: str) -> str:
+        try:
+            return subprocess.run(("git",) + cmd, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+
+    return {"commit": git("rev-parse", "--short", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--", "."))}
+
+
+def compare(results: List[Dict[str, Any]], path: str, tolerance: float) -> int:
+    """Marca en cada fila la variación frente a ``path``; devuelve cuántas regresiones hay."""
+    with open(path, encoding="utf-8") as f:
+        baseline = {r["workload"]: r for r in json.load(f)["results"]}
+    regressions = 0
+    for row in results:
+        old = baseline.get(row["workload"])
+        if old is None:
+            row["vs_baseline"] = "new"
+            continue
+        notes = []
+        for key, higher_is_better in COMPARED:
+            if not old.get(key) or row.get(key) is None:
+                continue
+            change = (row[key] - old[key]) / old[key]
+            worse = -change if higher_is_better else change
+            notes.append(f"{key} {change:+.0%}" + (" REGRESSION" if worse > tolerance else ""))
+            regressions += worse > tolerance
+        row["vs_baseline"] = ", ".join(notes)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia del stub por llamada")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--requests", type=int, default=2000, help="solicitudes por carga")
+    parser.add_argument("--steady-concurrency", type=int, default=8)
+    parser.add_argument("--spike-concurrency", type=int, default=256)
+    parser.add_argument("--storm-concurrency", type=int, default=128)
+    parser.add_argument("--verify-queries", type=int, default=20, help="búsquedas distintas en verify_storm")
+    parser.add_argument("--verify-rows", type=int, default=50, help="filas por respuesta de verify_tickets")
+    parser.add_argument("--webhooks", type=int, default=500)
+    parser.add_argument("--webhook-dupes", type=int, default=2)
+    parser.add_argument("--only", help="cargas a correr, separadas por coma")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="variación tolerada antes de marcar regresión")
+    args = parser.parse_args()
+    only = {w.strip() for w in args.only.split(",")} if args.only else None
+
+    mirrors = FakeMirrors()
+    mirrors.set("bcv", latency=0.05)
+    outbox = os.path.join(tempfile.mkdtemp(prefix="prizo-bench-"), "outbox.sqlite3")
+    results: List[Dict[str, Any]] = []
+
+    def record(workload: str, result: Dict[str, Any]) -> None:
+        results.append({"workload": workload, **result})
+        print(f"{workload}: {result}", file=sys.stderr)
+
+    with serve_process(build_stub(args).app) as stub_url, serve_process(mirrors.app) as mirrors_url:
+        env = {"WEBHOOK_OUTBOX_PATH": outbox, "RATE_MIRRORS": mirrors.urls(mirrors_url, ["bcv"])[0],
+               "COUNTERS_DRIFT_ENABLED": "true"}
+        with serve_api(stub_url, env=env) as api_url:
+
+            async def run() -> None:
+                await wait_ready(api_url, "/health")
+                # Calentamiento: conexiones del pool y caches de la rifa
+                await sale(api_url, 100, 8, args.seed + 1000)
+                workloads = {
+                    "sale_steady": lambda: sale(api_url, args.requests // 4, args.steady_concurrency, args.seed),
+                    "sale_spike": lambda: sale(api_url, args.requests, args.spike_concurrency, args.seed + 1),
+                    "verify_storm": lambda: verify_storm(api_url, stub_url, args),
+                    "webhook_burst": lambda: webhook_burst(api_url, stub_url, args),
+                    "rate": lambda: rate(api_url, args),
+                }
+                for name, workload in workloads.items():
+                    if only is None or name in only:
+                        record(name, await workload())
+
+            asyncio.run(run())
+
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else 0
+    print_table(results)
+    write_json(args.json, {
+        "benchmark": "suite",
+        "revision": git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": vars(args),
+        "results": results,
+    })
+    errors = sum(r.get("errors", 0) for r in results)
+    if regressions or errors:
+        print(f"{regressions} regression(s), {errors} error(s)", file=sys.stderr)
+    sys.exit(1 if regressions or errors else 0)
+
+
+if __name__ == "__main__":
+    main()
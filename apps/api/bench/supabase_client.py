@@ -0,0 +1,87 @@
+"""Benchmark: cliente por llamada (antes) vs cliente asíncrono compartido (después).
+
+"Antes" reproduce el patrón original de ``SupabaseClient``: un ``httpx.Client``
+nuevo por cada RPC, ejecutado en un pool de hilos. "Después" usa el
+``SupabaseClient`` actual con un único ``httpx.AsyncClient`` y keep-alive.
+
+Uso (desde apps/api):
+    python -m bench.supabase_client --requests 2000 --concurrency 32 --latency-ms 2
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import httpx
+
+from app.core.config import Settings
+from app.services.supabase import SupabaseClient, build_http_client
+
+from .common import print_table, serve_process, summarize, write_json
+from .stub_supabase import StubPostgrest
+
+KEY = "bench-service-key"
+PAYLOAD = {"p_raffle_id": "00000000-0000-0000-0000-000000000001", "p_quantity": 1}
+
+
+def _legacy_call(base_url: str) -> float:
+    start = time.perf_counter()
+    with httpx.Client(timeout=20.0) as client:
+        res = client.post(
+            f"{base_url}/rest/v1/rpc/bench_rpc",
+            json=PAYLOAD,
+            headers={"apikey": KEY, "Authorization": f"Bearer {KEY}"},
+        )
+        res.raise_for_status()
+        res.json()
+    return time.perf_counter() - start
+
+
+def run_before(base_url: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda _: _legacy_call(base_url), range(requests)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run_after(base_url: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    settings = Settings(SUPABASE_URL=base_url, SUPABASE_SERVICE_KEY=KEY, SUPABASE_POOL_SIZE=concurrency)
+    sb = SupabaseClient(base_url, KEY, http=build_http_client(settings))
+    latencies: List[float] = []
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            t0 = time.perf_counter()
+            await sb.call_rpc("bench_rpc", PAYLOAD)
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await sb.aclose()
+    return summarize(latencies, elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="latencia artificial del stub")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    stub = StubPostgrest(latency_ms=args.latency_ms)
+    stub.on_rpc("bench_rpc", lambda payload: [{"id": "t1", "status": "reserved"}])
+    with serve_process(stub.app) as base_url:
+        before = run_before(base_url, args.requests, args.concurrency)
+        after = asyncio.run(run_after(base_url, args.requests, args.concurrency))
+
+    rows = [{"variant": "before (client per call)", **before}, {"variant": "after (pooled async)", **after}]
+    print_table(rows)
+    write_json(args.json, {"benchmark": "supabase_client", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Capa de resiliencia hacia Supabase contra un stub con fallas inyectadas.
+
+Escenarios (cliente = ``SupabaseClient`` en este proceso, stub en otro):
+
+  flaky    --error-rate de las lecturas responde 503: errores vistos sin y con
+           reintentos, y reintentos gastados frente al presupuesto (con una tasa
+           de errores mayor que SUPABASE_RETRY_BUDGET el presupuesto se agota a
+           propósito y los errores vuelven a verse)
+  storm    todas las lecturas fallan: cuántas requests recibe el stub por
+           lectura (los reintentos no deben multiplicar la carga)
+  tail     --slow-rate de las lecturas tarda --slow-ms: p50/p99 sin y con
+           hedging, y lecturas duplicadas
+  outage   el stub deja de responder: ``POST /reservations/ids`` contra la API
+           sin y con circuit breaker (latencia y 503), y recuperación al volver
+
+Uso (desde apps/api):
+    python -m bench.supabase_faults --reads 2000 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from app.services.resilience import RetryBudget
+from app.services.supabase import SupabaseClient
+
+from .common import percentile, print_table, serve_api, serve_process, write_json
+from .stub_supabase import StubPostgrest
+
+KEY = "bench-service-key"
+
+
+async def set_faults(stub_url: str, **faults: float) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=stub_url) as client:
+        return (await client.post("/_faults", json=faults)).json()
+
+
+async def stub_calls(stub_url: str) -> Dict[str, int]:
+    async with httpx.AsyncClient(base_url=stub_url) as client:
+        return (await client.get("/_faults")).json()["calls"]
+
+
+async def reads(sb: SupabaseClient, n: int, concurrency: int) -> Tuple[List[float], int]:
+    """``n`` lecturas con ``concurrency`` en paralelo; devuelve latencias y errores."""
+    queue = iter(range(n))
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        for _ in queue:
+            t0 = time.perf_counter()
+            try:
+                await sb.get_many("raffles", {"limit": "1"}, select="id")
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def client(stub_url: str, retries: int = 0, hedge: bool = False, ratio: float = 0.1) -> SupabaseClient:
+    http = httpx.AsyncClient(limits=httpx.Limits(max_connections=64), timeout=10.0)
+    budget = RetryBudget(ratio=ratio) if retries or hedge else None
+    return SupabaseClient(stub_url, KEY, http=http, read_retries=retries, budget=budget, hedge=hedge,
+                          read_timeout=5.0, retry_base=0.01, retry_max=0.1, hedge_min_delay=0.01)
+
+
+async def client_scenarios(stub_url: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    n = args.reads
+
+    await set_faults(stub_url, error_rate=args.error_rate)
+    for label, retries in (("no retries", 0), (f"retries={args.retries}", args.retries)):
+        sb = client(stub_url, retries=retries)
+        lat, errors = await reads(sb, n, args.concurrency)
+        spent = sb.budget.spent if sb.budget else 0
+        rows.append({"scenario": "flaky", "client": label, "reads": n, "error_pct": round(100 * errors / n, 2),
+                     "retries": spent, "p99_ms": round(percentile(lat, 99) * 1000, 1),
+                     "result": "PASS" if spent <= 0.1 * n + 10 else "FAIL"})
+        await sb.aclose()
+    flaky = rows[-2:]
+    if not flaky[1]["error_pct"] < flaky[0]["error_pct"] / 4:
+        flaky[1]["result"] = "FAIL"
+
+    await set_faults(stub_url, error_rate=1.0)
+    before = (await stub_calls(stub_url)).get("get:raffles", 0)
+    sb = client(stub_url, retries=args.retries)
+    await reads(sb, n, args.concurrency)
+    sent = (await stub_calls(stub_url)).get("get:raffles", 0) - before
+    amplification = sent / n
+    rows.append({"scenario": "storm", "client": f"retries={args.retries}", "reads": n, "error_pct": 100.0,
+                 "retries": sb.budget.spent, "stub_requests_per_read": round(amplification, 3),
+                 "result": "PASS" if amplification <= 1.1 + 10 / n else "FAIL"})
+    await sb.aclose()
+
+    await set_faults(stub_url, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    for label, hedge in (("no hedge", False), ("hedge", True)):
+        sb = client(stub_url, hedge=hedge)
+        await reads(sb, 200, args.concurrency)  # calentamiento: p95 por operación
+        spent = sb.budget.spent if sb.budget else 0
+        lat, errors = await reads(sb, n, args.concurrency)
+        extra = (sb.budget.spent - spent) if sb.budget else 0
+        rows.append({"scenario": "tail", "client": label, "reads": n, "error_pct": round(100 * errors / n, 2),
+                     "hedged": extra, "p50_ms": round(percentile(lat, 50) * 1000, 1),
+                     "p99_ms": round(percentile(lat, 99) * 1000, 1), "result": "INFO"})
+        await sb.aclose()
+    tail = rows[-2:]
+    tail[1]["result"] = "PASS" if tail[1]["p99_ms"] < tail[0]["p99_ms"] / 2 else "FAIL"
+    await set_faults(stub_url)
+    return rows
+
+
+async def reserve_load(api_url: str, n: int, concurrency: int) -> Dict[str, Any]:
+    queue = iter(range(n))
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    async with httpx.AsyncClient(base_url=api_url, timeout=60.0) as http:
+
+        async def worker() -> None:
+            for i in queue:
+                t0 = time.perf_counter()
+                res = await http.post("/reservations/ids", json={
+                    "p_ticket_ids": [str(uuid.UUID(int=i))], "p_session_id": str(uuid.uuid4()),
+                })
+                latencies.append(time.perf_counter() - t0)
+                statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"requests": n, "elapsed_s": round(elapsed, 2), "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "statuses": " ".join(f"{k}:{v}" for k, v in sorted(statuses.items()))}
+
+
+def outage(stub_url: str, args: argparse.Namespace, breaker: bool) -> List[Dict[str, Any]]:
+    env = {
+        "RESERVATION_EXPIRY_ENABLED": "false", "SUPABASE_TIMEOUT": str(args.timeout),
+        "SUPABASE_BREAKER_ENABLED": str(breaker).lower(), "SUPABASE_BREAKER_COOLDOWN": "1",
+        "SUPABASE_BREAKER_MIN_CALLS": "10",
+    }
+    rows: List[Dict[str, Any]] = []
+    label = "breaker" if breaker else "no breaker"
+    with serve_api(stub_url, env=env) as api_url:
+        asyncio.run(set_faults(stub_url, hang_ms=args.timeout * 1000 * 5))
+        down = asyncio.run(reserve_load(api_url, args.outage_requests, args.concurrency))
+        rows.append({"scenario": "outage", "client": label, **down})
+        asyncio.run(set_faults(stub_url))
+        time.sleep(1.5)
+        up = asyncio.run(reserve_load(api_url, args.outage_requests, args.concurrency))
+        # Con breaker, mientras la primera solicitud hace de prueba (half-open) las
+        # concurrentes reciben 503; después todo 200
+        rejected = int(up["statuses"].partition("503:")[2].split(" ")[0] or 0)
+        ok = f"200:{args.outage_requests - rejected}" in up["statuses"] and rejected < args.concurrency
+        rows.append({"scenario": "recovered", "client": label, **up, "result": "PASS" if ok else "FAIL"})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latencia base del stub")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="fracción de lecturas lentas (tail)")
+    parser.add_argument("--slow-ms", type=float, default=300.0)
+    parser.add_argument("--timeout", type=float, default=2.0, help="SUPABASE_TIMEOUT de la API en outage")
+    parser.add_argument("--outage-requests", type=int, default=200)
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    stub = StubPostgrest(latency_ms=args.latency_ms)
+    with serve_process(stub.app) as stub_url:
+        results = asyncio.run(client_scenarios(stub_url, args))
+        plain = outage(stub_url, args, breaker=False)
+        guarded = outage(stub_url, args, breaker=True)
+    ok = guarded[0]["elapsed_s"] < plain[0]["elapsed_s"] / 3 and "503:" in guarded[0]["statuses"]
+    plain[0]["result"] = "INFO"
+    guarded[0]["result"] = "PASS" if ok else "FAIL"
+    results += plain + guarded
+    print_table(results)
+    write_json(args.json, {"benchmark": "supabase_faults", "params": vars(args), "results": results})
+    sys.exit(0 if all(r.get("result") in ("PASS", "INFO") for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Benchmark: /verify para un comprador con muchos tickets (--tickets, 20k por defecto).
+
+Modos, cada uno contra una API recién levantada (la memoria pico es del proceso):
+
+- ``json``: como hasta ahora, todas las filas en una respuesta (una llamada a
+  verify_tickets que devuelve todo; la API arma la lista y el cuerpo completos).
+- ``paged``: ``?limit=--page-size`` siguiendo ``next_cursor`` hasta el final
+  (``ttfb_ms`` = primera página).
+- ``ndjson``: ``?format=ndjson``, las filas salen a medida que llegan las páginas del
+  RPC (la primera de --page-size filas, luego duplicando hasta --page-max).
+
+El stub implementa el RPC paginado (p_limit / p_after_*) sobre filas fijas y cobra
+--latency-ms por llamada más --row-us por fila devuelta (la base produciendo y
+enviando filas). Reporta tiempo al primer byte, tiempo total, KB recibidos
+(``wire_kb``; el cliente acepta gzip) y ``peak_rss_mb`` / ``rss_growth_mb``: pico de
+memoria residente de la API (VmHWM) y cuánto creció sobre el pico tras el
+calentamiento. Solo Linux (/proc).
+
+Uso (desde apps/api):
+    python -m bench.verify_stream --tickets 20000 --page-size 500
+"""
+import argparse
+import asyncio
+import bisect
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+import orjson
+
+from app.services.verify import row_cursor
+
+from .common import print_table, serve_api, serve_process, write_json
+from .stub_supabase import StubPostgrest
+
+QUERY = "reseller@bench.test"
+AFTER = ("p_after_created_at", "p_after_raffle_name", "p_after_ticket_number", "p_after_ticket_id")
+RAFFLE_NAMES = ("Gran Rifa Aniversario", "Rifa Moto 0km", "Rifa Relámpago iPhone")
+
+
+def buyer_rows(n: int) -> List[Dict[str, Any]]:
+    """Filas de verify_tickets de un revendedor: pagos de 10 tickets, en el orden del RPC."""
+    rows = []
+    for i in range(n):
+        payment = i // 10
+        rows.append({
+            "raffle_id": str(uuid.UUID(int=payment % len(RAFFLE_NAMES) + 1)),
+            "raffle_name": RAFFLE_NAMES[payment % len(RAFFLE_NAMES)],
+            "ticket_id": str(uuid.UUID(int=(25 << 64) + i)),
+            "ticket_number": f"{i:06d}",
+            "ticket_status": "sold" if payment % 4 else "reserved",
+            "payment_id": str(uuid.UUID(int=(26 << 64) + payment)),
+            "payment_status": "approved" if payment % 4 else "pending",
+            "created_at": f"2026-{1 + payment % 12:02d}-{1 + payment % 28:02d}T{payment % 24:02d}:{payment % 60:02d}:00.{payment:06d}+00:00",
+        })
+    rows.sort(key=lambda r: row_cursor(r)[1:])
+    rows.sort(key=lambda r: row_cursor(r)[0], reverse=True)
+    return rows
+
+
+def build_stub(args: argparse.Namespace) -> StubPostgrest:
+    stub = StubPostgrest(latency_ms=args.latency_ms)
+    rows = buyer_rows(args.tickets)
+    # Clave que crece en el orden del RPC (created_at desc, sin fecha primero): para buscar el cursor con bisect
+    keys = [(_desc(c[0]), *c[1:]) for c in map(row_cursor, rows)]
+
+    async def verify(p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if p.get("p_query") != QUERY:
+            return []
+        start = 0
+        if any(p.get(k) for k in AFTER):
+            after = (p.get("p_after_created_at") or "", p.get("p_after_raffle_name") or "",
+                     p.get("p_after_ticket_number") or "", p.get("p_after_ticket_id") or "")
+            start = bisect.bisect_right(keys, (_desc(after[0]), *after[1:]))
+        limit = p.get("p_limit")
+        page = rows[start:start + limit] if limit else rows[start:]
+        await asyncio.sleep(len(page) * args.row_us / 1e6)
+        return page
+
+    stub.on_rpc("verify_tickets", verify)
+    return stub
+
+
+def _desc(value: str) -> Tuple[int, ...]:
+    return tuple(-ord(ch) for ch in value)
+
+
+def children() -> Set[int]:
+    """Procesos hijos de este (para encontrar el pid de la API recién levantada)."""
+    me = str(os.getpid())
+    out = set()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                if f.read().rsplit(")", 1)[1].split()[1] == me:
+                    out.add(int(pid))
+        except (OSError, IndexError):
+            continue
+    return out
+
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def reset_peak(pid: int) -> None:
+    """Vuelve VmHWM al RSS actual (Linux >= 4.0); si no se puede, se mide el pico absoluto."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+async def fetch(client: httpx.AsyncClient, params: Dict[str, Any]) -> Tuple[float, float, int, bytes]:
+    """(primer byte, total, bytes en el cable, cuerpo) de un GET /verify (con gzip, como un navegador)."""
+    t0 = time.perf_counter()
+    ttfb: Optional[float] = None
+    chunks = []
+    async with client.stream("GET", "/verify", params={"q": QUERY, **params}) as res:
+        res.raise_for_status()
+        async for chunk in res.aiter_bytes():
+            if ttfb is None:
+                ttfb = time.perf_counter() - t0
+            chunks.append(chunk)
+        wire = res.num_bytes_downloaded
+    return ttfb or 0.0, time.perf_counter() - t0, wire, b"".join(chunks)
+
+
+async def run(mode: str, api_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=api_url, timeout=120.0) as client:
+        if mode == "json":
+            ttfb, total, size, body = await fetch(client, {})
+            rows = len(orjson.loads(body)["data"])
+        elif mode == "ndjson":
+            ttfb, total, size, body = await fetch(client, {"format": "ndjson"})
+            rows = body.count(b"\n")
+        else:
+            ttfb, total, size, rows, cursor = 0.0, 0.0, 0, 0, None
+            while True:
+                params: Dict[str, Any] = {"limit": args.page_size}
+                if cursor:
+                    params["cursor"] = cursor
+                first, elapsed, n, body = await fetch(client, params)
+                page = orjson.loads(body)
+                ttfb = ttfb or first
+                total += elapsed
+                size += n
+                rows += len(page["data"])
+                cursor = page.get("next_cursor")
+                if not cursor:
+                    break
+    return {"rows": rows, "ttfb_ms": round(ttfb * 1000, 1), "total_ms": round(total * 1000, 1),
+            "wire_kb": round(size / 1024, 1)}
+
+
+async def warm(api_url: str) -> None:
+    async with httpx.AsyncClient(base_url=api_url, timeout=30.0) as client:
+        for params in ({"q": "warmup@bench.test"}, {"q": "warmup@bench.test", "format": "ndjson"}):
+            await client.get("/verify", params=params)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=20000, help="filas del comprador")
+    parser.add_argument("--page-size", type=int, default=500, help="página de ?limit= y primera página del stream")
+    parser.add_argument("--page-max", type=int, default=2000, help="página máxima del stream (VERIFY_STREAM_PAGE_MAX)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia del stub por llamada a Supabase")
+    parser.add_argument("--row-us", type=float, default=5.0, help="costo del stub por fila devuelta (µs)")
+    parser.add_argument("--modes", default="json,paged,ndjson")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    rows: List[Dict[str, Any]] = []
+    env = {"VERIFY_STREAM_PAGE_SIZE": str(args.page_size), "VERIFY_STREAM_PAGE_MAX": str(args.page_max),
+           "VERIFY_PAGE_MAX": str(max(args.page_size, 1000)),
+           "RESERVATION_EXPIRY_ENABLED": "false", "COUNTERS_DRIFT_ENABLED": "false"}
+    with serve_process(build_stub(args).app) as stub_url:
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            before = children()
+            with serve_api(stub_url, env=env) as api_url:
+                pid = max(children() - before)
+                asyncio.run(warm(api_url))
+                reset_peak(pid)
+                baseline = peak_rss_mb(pid)
+                result = asyncio.run(run(mode, api_url, args))
+                peak = peak_rss_mb(pid)
+            rows.append({"mode": mode, **result, "peak_rss_mb": round(peak, 1),
+                         "rss_growth_mb": round(peak - baseline, 1)})
+    print_table(rows)
+    write_json(args.json, {"benchmark": "verify_stream", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Arnés de la cola de webhooks de pago (services/outbox.py) contra el stub.
+
+El stub (en este proceso) guarda los pagos, cuenta cada aprobación por pago
+(``approve_payments`` en lote, o ``approve_payment`` con --no-bulk, como si el
+patch no estuviera instalado) y puede fallar a propósito. Escenarios:
+
+  inline     costo de lo que hacía el endpoint antes por webhook (lookup + approve
+             contra PostgREST), como referencia de la latencia de respuesta
+  ingest     cada webhook se entrega --dupes veces en paralelo: latencia del ack,
+             tiempo hasta aprobar todo y aprobaciones exactamente una por pago
+  failures   approve_payment falla al azar: todo termina aprobado, con reintentos
+  unknown    referencia sin pago: se reintenta con backoff y queda como ``dead``
+  restart    los webhooks aceptados mientras Supabase falla se aprueban tras
+             reiniciar la API con el mismo archivo de la cola
+  reconcile  POST /admin/payments/by-reference con todas las referencias: desde
+             el cache que llenó la cola y con ``fresh`` (consultas en lotes)
+
+Uso (desde apps/api):
+    python -m bench.webhook_outbox --payments 500 --dupes 3 --latency-ms 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List
+
+import httpx
+
+from .common import percentile, print_table, serve, serve_api, write_json
+from .stub_supabase import StubError, StubPostgrest
+
+
+class PaymentsStub:
+    def __init__(self, latency_ms: float) -> None:
+        self.payments: Dict[str, Dict[str, Any]] = {}
+        self.approvals: Counter = Counter()
+        self.fail_rate = 0.0
+        self.stub = StubPostgrest(latency_ms=latency_ms)
+        self.stub.on_table("payments", self._payments)
+        self.stub.on_table("payment_tickets", lambda params: [])
+        self.stub.on_rpc("approve_payment", self._approve)
+        self.stub.on_rpc("approve_payments", self._approve_many)
+        self.bulk = True
+
+    def add(self, n: int) -> List[str]:
+        refs = []
+        for _ in range(n):
+            ref = f"REF-{uuid.uuid4().hex[:10]}"
+            self.payments[ref] = {"id": str(uuid.uuid4()), "reference": ref, "status": "pending"}
+            refs.append(ref)
+        return refs
+
+    def _payments(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        flt = params.get("reference", "")
+        if flt.startswith("eq."):
+            refs = [flt[3:]]
+        else:
+            refs = [m.replace('\\"', '"') for m in re.findall(r'"((?:[^"\\]|\\.)*)"', flt)]
+        return [dict(self.payments[r]) for r in refs if r in self.payments]
+
+    def _approve(self, p: Dict[str, Any]) -> None:
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise StubError(503, "", "unavailable")
+        pid = p["p_payment_id"]
+        self.approvals[pid] += 1
+        for row in self.payments.values():
+            if row["id"] == pid:
+                row["status"] = "approved"
+        return None
+
+    def _approve_many(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if not self.bulk:
+            raise StubError(404, "PGRST202", "function not found")
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise StubError(503, "", "unavailable")
+        by_id = {row["id"]: row for row in self.payments.values()}
+        out = []
+        for pid in dict.fromkeys(p["p_payment_ids"]):
+            row = by_id.get(pid)
+            if row is None:
+                out.append({"payment_id": pid, "outcome": "not_found", "previous_status": None, "ticket_ids": []})
+                continue
+            previous = row["status"]
+            if previous == "approved":
+                outcome = "already_approved"
+            else:
+                row["status"] = "approved"
+                self.approvals[pid] += 1
+                outcome = "approved"
+            out.append({"payment_id": pid, "outcome": outcome, "previous_status": previous, "ticket_ids": []})
+        return out
+
+    def approved(self, refs: List[str]) -> int:
+        return sum(self.payments[r]["status"] == "approved" for r in refs)
+
+    def double_approved(self, refs: List[str]) -> int:
+        return sum(self.approvals[self.payments[r]["id"]] > 1 for r in refs)
+
+
+async def wait_for(cond, timeout: float) -> bool:
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        await asyncio.sleep(0.05)
+    return cond()
+
+
+async def deliver(api_url: str, refs: List[str], dupes: int, concurrency: int) -> List[float]:
+    """Envía cada webhook ``dupes`` veces (en orden aleatorio) y devuelve las latencias."""
+    jobs = [ref for ref in refs for _ in range(dupes)]
+    random.shuffle(jobs)
+    queue = iter(jobs)
+    latencies: List[float] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=30.0) as client:
+
+        async def worker() -> None:
+            for ref in queue:
+                t0 = time.perf_counter()
+                res = await client.post("/webhooks/payment", json={"reference": ref, "status": "approved", "amount": 10})
+                res.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def inline_baseline(stub_url: str, refs: List[str], concurrency: int) -> List[float]:
+    """Lo que hacía el endpoint antes de responder: buscar el pago y aprobarlo."""
+    queue = iter(refs)
+    latencies: List[float] = []
+    headers = {"apikey": "k", "Authorization": "Bearer k"}
+    async with httpx.AsyncClient(base_url=stub_url, headers=headers, timeout=30.0) as client:
+
+        async def worker() -> None:
+            for ref in queue:
+                t0 = time.perf_counter()
+                res = await client.get("/rest/v1/payments", params={"reference": f"eq.{ref}", "select": "id,reference,status"})
+                pid = res.json()[0]["id"]
+                await client.post("/rest/v1/rpc/approve_payment", json={"p_payment_id": pid, "p_approved_by": "bench"})
+                latencies.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def lat_row(name: str, lat: List[float], **extra: Any) -> Dict[str, Any]:
+    return {"scenario": name, "requests": len(lat), "ack_p50_ms": round(percentile(lat, 50) * 1000, 1),
+            "ack_p99_ms": round(percentile(lat, 99) * 1000, 1), **extra}
+
+
+async def run(state: PaymentsStub, stub_url: str, api_url: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+
+    refs = state.add(args.payments)
+    lat = await inline_baseline(stub_url, refs, args.concurrency)
+    results.append(lat_row("inline (antes)", lat, result="INFO"))
+    for ref in refs:
+        state.payments[ref]["status"] = "pending"
+    state.approvals.clear()
+
+    # ingest: duplicados concurrentes, aprobación en lotes
+    refs = state.add(args.payments)
+    seen = list(refs)
+    t0 = time.perf_counter()
+    lat = await deliver(api_url, refs, args.dupes, args.concurrency)
+    ack_s = time.perf_counter() - t0
+    ok = await wait_for(lambda: state.approved(refs) == len(refs), 60)
+    drain_s = time.perf_counter() - t0
+    doubles = state.double_approved(refs)
+    results.append(lat_row(
+        "ingest", lat, result="PASS" if ok and not doubles else "FAIL",
+        ack_s=round(ack_s, 2), drain_s=round(drain_s, 2), approved=state.approved(refs), double_approved=doubles,
+    ))
+
+    # failures: 30% de los approve fallan
+    state.fail_rate = args.fail_rate
+    refs = state.add(args.payments // 5)
+    seen += refs
+    lat = await deliver(api_url, refs, 1, args.concurrency)
+    ok = await wait_for(lambda: state.approved(refs) == len(refs), 60)
+    state.fail_rate = 0.0
+    results.append(lat_row(
+        "failures", lat, result="PASS" if ok and not state.double_approved(refs) else "FAIL",
+        approved=state.approved(refs), double_approved=state.double_approved(refs),
+    ))
+
+    async with httpx.AsyncClient(base_url=api_url, timeout=30.0) as client:
+        # unknown: nunca aparece el pago
+        await client.post("/webhooks/payment", json={"reference": "REF-missing", "status": "paid"})
+        ok = False
+        end = time.time() + 30
+        while time.time() < end:
+            health = (await client.get("/health/webhooks")).json()
+            if health["states"].get("dead"):
+                ok = True
+                break
+            await asyncio.sleep(0.1)
+        results.append({"scenario": "unknown", "result": "PASS" if ok else "FAIL", "retries": health["retries"],
+                        "dead": health["states"].get("dead", 0)})
+        health = (await client.get("/health/webhooks")).json()
+
+        # reconcile: la cola dejó en cache las referencias que aprobó
+        for fresh in (False, True):
+            before = state.stub.calls["get:payments"]
+            res = await client.post("/admin/payments/by-reference",
+                                    json={"references": seen + ["REF-missing"], "fresh": fresh})
+            body = res.json()
+            lookups = state.stub.calls["get:payments"] - before
+            approved = sum(p["status"] == "approved" for p in body["payments"].values())
+            expected_lookups = 1 + (len(seen) // 200 if fresh else 0)
+            results.append({"scenario": "reconcile" + (" fresh" if fresh else ""),
+                            "result": "PASS" if approved == len(seen) and body["missing"] == ["REF-missing"]
+                            and lookups == expected_lookups else "FAIL",
+                            "requests": len(seen) + 1, "approved": approved, "stub_lookups": lookups})
+    results.append({"scenario": "health/webhooks", "result": "INFO",
+                    **{k: health[k] for k in ("pending", "lag_p50_seconds", "lag_p99_seconds", "commits", "batches",
+                                              "received", "duplicates", "approved", "already_approved")}})
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--dupes", type=int, default=3, help="entregas por webhook (reintentos del proveedor)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="latencia simulada por request a PostgREST")
+    parser.add_argument("--fail-rate", type=float, default=0.3)
+    parser.add_argument("--no-bulk", action="store_true", help="sin approve_payments (RPC de lote) en el stub")
+    parser.add_argument("--json", help="ruta para guardar resultados en JSON")
+    args = parser.parse_args()
+
+    state = PaymentsStub(args.latency_ms)
+    state.bulk = not args.no_bulk
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            "WEBHOOK_OUTBOX_PATH": os.path.join(tmp, "outbox.sqlite3"),
+            "WEBHOOK_RETRY_BASE": "0.1", "WEBHOOK_RETRY_MAX": "1", "WEBHOOK_MAX_ATTEMPTS": "8",
+            "RESERVATION_EXPIRY_ENABLED": "false",
+        }
+        with serve(state.stub.app) as stub_url:
+            with serve_api(stub_url, env=env) as api_url:
+                results = asyncio.run(run(state, stub_url, api_url, args))
+
+            # restart: Supabase cae, los webhooks se aceptan igual; la API se reinicia
+            refs = state.add(50)
+            state.fail_rate = 1.0
+            env["WEBHOOK_MAX_ATTEMPTS"] = "1000"
+            with serve_api(stub_url, env=env) as api_url:
+                lat = asyncio.run(deliver(api_url, refs, 1, 8))
+                time.sleep(0.5)
+            pending_after_stop = len(refs) - state.approved(refs)
+            state.fail_rate = 0.0
+            with serve_api(stub_url, env=env):
+                ok = asyncio.run(wait_for(lambda: state.approved(refs) == len(refs), 30))
+            results.insert(-1, lat_row(
+                "restart", lat, result="PASS" if ok and pending_after_stop == len(refs) else "FAIL",
+                pending_before_restart=pending_after_stop, approved=state.approved(refs),
+            ))
+    print_table(results)
+    write_json(args.json, {"benchmark": "webhook_outbox", "params": vars(args), "results": results})
+    sys.exit(0 if all(r["result"] in ("PASS", "INFO") for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
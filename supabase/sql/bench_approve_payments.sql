@@ -0,0 +1,79 @@
+-- Benchmark de approve_payments (lote) frente a approve_payment (uno por pago).
+-- Solo contra una base local/desechable (no en producción): crea una rifa de prueba con
+-- id fijo c0000000-0000-0000-0000-000000000001 y dos grupos de pagos pendientes.
+--
+--   psql "$DATABASE_URL" -v payments=2000 -v per=5 -f supabase/sql/bench_approve_payments.sql
+--
+-- Mide solo el tiempo dentro de la base; por la API, cada approve_payment además es un
+-- round trip. Al final verifica que todos los tickets de los pagos quedaron vendidos y
+-- que una segunda pasada responde already_approved sin tocar nada.
+
+\if :{?payments}
+\else
+  \set payments 2000
+\endif
+\if :{?per}
+\else
+  \set per 5
+\endif
+
+set search_path = public;
+\set raffle '\'c0000000-0000-0000-0000-000000000001\''
+
+delete from payments where raffle_id = :raffle;
+delete from raffles where id = :raffle;
+insert into raffles (id, name, status, total_tickets, is_free)
+values (:raffle, 'bench approve', 'selling', 2 * :payments * :per, false);
+select ensure_tickets_for_raffle(:raffle, 2 * :payments * :per) as tickets_created;
+
+-- Grupo 1 (single) y 2 (bulk): cada pago con :per tickets reservados consecutivos
+drop table if exists bench_approve_payments;
+create table bench_approve_payments as
+select gen_random_uuid() as id, g as n, case when g <= :payments then 'single' else 'bulk' end as grp
+from generate_series(1, 2 * :payments) g;
+
+insert into payments (id, raffle_id, reference, status, amount_ves)
+select id, :raffle, 'bench-' || n, 'pending', 10 from bench_approve_payments;
+
+insert into payment_tickets (payment_id, ticket_id)
+select b.id, t.id
+from bench_approve_payments b
+join tickets t on t.raffle_id = :raffle
+ and t.ticket_number::int between (b.n - 1) * :per + 1 and b.n * :per;
+
+update tickets set status = 'reserved' where raffle_id = :raffle;
+analyze payments; analyze payment_tickets; analyze tickets;
+
+do $$
+declare
+  v_start timestamptz;
+  v_single interval;
+  v_bulk interval;
+  v_id uuid;
+  v_ids uuid[];
+  v_n int;
+begin
+  v_start := clock_timestamp();
+  for v_id in select id from bench_approve_payments where grp = 'single' order by n loop
+    perform approve_payment(v_id, 'bench');
+  end loop;
+  v_single := clock_timestamp() - v_start;
+
+  select array_agg(id order by n) into v_ids from bench_approve_payments where grp = 'bulk';
+  v_start := clock_timestamp();
+  select count(*) into v_n from approve_payments(v_ids, 'bench') where outcome = 'approved';
+  v_bulk := clock_timestamp() - v_start;
+
+  raise notice 'approve_payment x %: % ms', array_length(v_ids, 1), round(extract(epoch from v_single) * 1000, 1);
+  raise notice 'approve_payments (1 llamada, % aprobados): % ms', v_n, round(extract(epoch from v_bulk) * 1000, 1);
+end $$;
+
+-- Verificación
+select 'unsold tickets' as check, count(*) as value
+from payment_tickets pt join tickets t on t.id = pt.ticket_id
+join bench_approve_payments b on b.id = pt.payment_id
+where t.status <> 'sold'
+union all
+select 'second pass: ' || outcome, count(*)
+from approve_payments((select array_agg(id) from bench_approve_payments where grp = 'bulk'), 'bench')
+group by outcome;
@@ -0,0 +1,180 @@
+-- Benchmark de los contadores de tickets: vista agregada (patch_raffle_ticket_counters_include_pending.sql)
+-- frente a la tabla raffle_counters (patch_raffle_counters_table.sql).
+-- Solo contra una base local/desechable (no en producción): crea :raffles rifas de prueba
+-- con ids fijos c0000000-0000-0000-0000-1000000000NN de :total tickets cada una, ~30%
+-- vendidos y ~5% reservados (un tercio de ellos con pago pendiente y sin vencimiento).
+--
+--   psql "$DATABASE_URL" -v total=100000 -v raffles=5 -f supabase/sql/bench_raffle_counters.sql
+--
+-- Mide una rifa (lo que pide cada barra de progreso) y todas las rifas (lo que hacía la
+-- web con rpc('raffle_ticket_counters')), el costo del trigger en una venta masiva y al
+-- final verifica que la tabla coincide con la vista.
+
+\if :{?total}
+\else
+  \set total 100000
+\endif
+\if :{?raffles}
+\else
+  \set raffles 5
+\endif
+\if :{?calls}
+\else
+  \set calls 20
+\endif
+
+set search_path = public;
+
+-- La vista anterior, tal cual
+create or replace function pg_temp.counters_old()
+returns table (raffle_id uuid, total_tickets int, sold bigint, reserved bigint, available bigint)
+language sql stable as $$
+select
+  r.id as raffle_id,
+  r.total_tickets,
+  coalesce(sum(case when t.status = 'sold' then 1 else 0 end),0)::bigint as sold,
+  coalesce(sum(
+    case
+      when t.status = 'reserved' and t.reserved_until is not null and t.reserved_until > now() then 1
+      when t.status = 'reserved' and exists (
+        select 1 from payment_tickets pt
+        join payments p on p.id = pt.payment_id
+        where pt.ticket_id = t.id and p.status in ('pending','underpaid','overpaid','ref_mismatch')
+      ) then 1
+      else 0
+    end
+  ),0)::bigint as reserved,
+  greatest(0, (r.total_tickets - (coalesce(sum(case when t.status = 'sold' then 1 else 0 end),0) + coalesce(sum(
+    case
+      when t.status = 'reserved' and t.reserved_until is not null and t.reserved_until > now() then 1
+      when t.status = 'reserved' and exists (
+        select 1 from payment_tickets pt
+        join payments p on p.id = pt.payment_id
+        where pt.ticket_id = t.id and p.status in ('pending','underpaid','overpaid','ref_mismatch')
+      ) then 1
+      else 0
+    end
+  ),0))))::bigint as available
+from raffles r
+left join tickets t on t.raffle_id = r.id
+group by r.id, r.total_tickets;
+$$;
+
+delete from payments where reference like 'bench-counters-%';
+delete from raffles where id::text like 'c0000000-0000-0000-0000-1000000000%';
+insert into raffles (id, name, status, total_tickets, is_free)
+select ('c0000000-0000-0000-0000-1' || lpad(g::text, 11, '0'))::uuid, 'bench counters ' || g, 'selling', :total, false
+from generate_series(1, :raffles) g;
+select sum(ensure_tickets_for_raffle(id, :total)) as tickets_created
+from raffles where id::text like 'c0000000-0000-0000-0000-1000000000%';
+
+-- Venta masiva: 30% vendidos en una sola sentencia, una rifa sin el trigger y otra con él
+do $$
+declare
+  v_start timestamptz;
+begin
+  alter table tickets disable trigger trg_tickets_raffle_counters_upd;
+  v_start := clock_timestamp();
+  update tickets set status = 'sold'
+   where raffle_id = 'c0000000-0000-0000-0000-100000000001' and ticket_number::int % 10 < 3;
+  raise notice 'venta 30%% de una rifa sin trigger: % ms', round(extract(epoch from clock_timestamp() - v_start) * 1000, 1);
+  alter table tickets enable trigger trg_tickets_raffle_counters_upd;
+  perform refresh_raffle_counters('c0000000-0000-0000-0000-100000000001');
+
+  v_start := clock_timestamp();
+  update tickets set status = 'sold'
+   where raffle_id = 'c0000000-0000-0000-0000-100000000002' and ticket_number::int % 10 < 3;
+  raise notice 'venta 30%% de una rifa con trigger: % ms', round(extract(epoch from clock_timestamp() - v_start) * 1000, 1);
+
+  update tickets set status = 'sold'
+   where raffle_id::text like 'c0000000-0000-0000-0000-1000000000%'
+     and raffle_id not in ('c0000000-0000-0000-0000-100000000001', 'c0000000-0000-0000-0000-100000000002')
+     and ticket_number::int % 10 < 3;
+end $$;
+
+-- 5% reservados con vencimiento futuro; de ellos, uno de cada tres retenido por un
+-- pago pendiente (reserved_until null, como deja create_payment)
+update tickets set status = 'reserved', reserved_until = now() + interval '1 hour'
+ where raffle_id::text like 'c0000000-0000-0000-0000-1000000000%' and ticket_number::int % 20 = 3;
+
+insert into payments (id, raffle_id, email, reference, status, amount_ves)
+select gen_random_uuid(), id, 'counters@bench.test', 'bench-counters-' || id, 'pending', 10
+from raffles where id::text like 'c0000000-0000-0000-0000-1000000000%';
+
+insert into payment_tickets (payment_id, ticket_id)
+select p.id, t.id
+from payments p
+join tickets t on t.raffle_id = p.raffle_id and t.ticket_number::int % 60 = 3
+where p.reference like 'bench-counters-%';
+
+update tickets set reserved_until = null
+ where raffle_id::text like 'c0000000-0000-0000-0000-1000000000%' and ticket_number::int % 60 = 3;
+analyze tickets; analyze payment_tickets; analyze payments; analyze raffle_counters;
+
+\set ON_ERROR_STOP 1
+select set_config('bench.calls', :'calls', false) as calls;
+
+do $$
+declare
+  v_raffle uuid := 'c0000000-0000-0000-0000-100000000001';
+  v_calls int := current_setting('bench.calls')::int;
+  v_start timestamptz;
+  v_old_one interval;
+  v_new_one interval;
+  v_old_all interval;
+  v_new_all interval;
+begin
+  v_start := clock_timestamp();
+  for i in 1..v_calls loop
+    perform * from pg_temp.counters_old() c where c.raffle_id = v_raffle;
+  end loop;
+  v_old_one := clock_timestamp() - v_start;
+
+  v_start := clock_timestamp();
+  for i in 1..v_calls loop
+    perform * from ticket_counters_for_raffle(v_raffle);
+  end loop;
+  v_new_one := clock_timestamp() - v_start;
+
+  v_start := clock_timestamp();
+  for i in 1..v_calls loop
+    perform * from pg_temp.counters_old();
+  end loop;
+  v_old_all := clock_timestamp() - v_start;
+
+  v_start := clock_timestamp();
+  for i in 1..v_calls loop
+    perform * from raffle_ticket_counters();
+  end loop;
+  v_new_all := clock_timestamp() - v_start;
+
+  raise notice 'una rifa, vista (anterior):                 % ms/llamada', round(extract(epoch from v_old_one) * 1000 / v_calls, 3);
+  raise notice 'una rifa, ticket_counters_for_raffle:       % ms/llamada', round(extract(epoch from v_new_one) * 1000 / v_calls, 3);
+  raise notice 'todas, vista (anterior):                    % ms/llamada', round(extract(epoch from v_old_all) * 1000 / v_calls, 3);
+  raise notice 'todas, raffle_ticket_counters() (tabla):    % ms/llamada', round(extract(epoch from v_new_all) * 1000 / v_calls, 3);
+end $$;
+
+-- Verificación: diferencias entre la vista y la tabla en las rifas de prueba (0 y 0 =
+-- correcto). Se rechaza el pago pendiente de una rifa y se vuelve a comparar.
+select 'diff' as check,
+       (select count(*) from (select * from pg_temp.counters_old() where raffle_id::text like 'c0000000-0000-0000-0000-1000000000%'
+                              except select * from raffle_ticket_counters()) d) as old_minus_new,
+       (select count(*) from (select * from raffle_ticket_counters() where raffle_id::text like 'c0000000-0000-0000-0000-1000000000%'
+                              except select * from pg_temp.counters_old()) d) as new_minus_old;
+
+select count(*) as rejected from reject_payments(
+  (select array_agg(id) from payments where reference = 'bench-counters-c0000000-0000-0000-0000-100000000002'), 'bench');
+
+select 'diff after reject' as check,
+       (select count(*) from (select * from pg_temp.counters_old() where raffle_id::text like 'c0000000-0000-0000-0000-1000000000%'
+                              except select * from raffle_ticket_counters()) d) as old_minus_new,
+       (select count(*) from (select * from raffle_ticket_counters() where raffle_id::text like 'c0000000-0000-0000-0000-1000000000%'
+                              except select * from pg_temp.counters_old()) d) as new_minus_old;
+
+-- Corrección periódica: sin cambios por fuera de los triggers no hay nada que corregir
+select c.* from raffles r cross join lateral refresh_raffle_counters(r.id) c
+ where r.id::text like 'c0000000-0000-0000-0000-1000000000%'
+ order by 1;
+
+explain (analyze, costs off, timing off, summary on)
+select * from ticket_counters_for_raffle('c0000000-0000-0000-0000-100000000001');
@@ -0,0 +1,28 @@
+-- Verificación tras bench_reserve_random.pgbench: cada línea debe dar 0 problemas.
+\pset pager off
+set search_path = public;
+
+\echo '=== Resumen por rifa'
+select c.raffle_id,
+       count(*) as claims,
+       count(distinct c.session_id) as sessions,
+       (select count(*) from tickets t where t.raffle_id = c.raffle_id and t.status = 'reserved') as reserved_in_table
+from bench_reserve_claims c
+group by c.raffle_id
+order by c.raffle_id;
+
+\echo '=== Problemas (todos deben ser 0)'
+select
+  (select count(*) from (
+     select ticket_id from bench_reserve_claims group by ticket_id having count(distinct session_id) > 1
+   ) d) as double_booked,
+  (select count(*) from bench_reserve_claims c join tickets t on t.id = c.ticket_id
+    where t.reserved_by is distinct from c.session_id or t.status <> 'reserved') as claim_not_held,
+  (select count(*) from tickets t
+    where t.raffle_id::text like 'b0000000-0000-0000-0000-%' and t.status = 'reserved'
+      and not exists (select 1 from bench_reserve_claims c where c.ticket_id = t.id)) as held_not_claimed,
+  (select count(*) from (
+     select raffle_id, ticket_number from tickets
+     where raffle_id::text like 'b0000000-0000-0000-0000-%'
+     group by raffle_id, ticket_number having count(*) > 1
+   ) n) as duplicate_numbers;
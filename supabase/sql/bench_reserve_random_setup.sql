@@ -0,0 +1,42 @@
+-- Stress de ensure_and_reserve_random_tickets con muchas sesiones en paralelo (pgbench).
+-- Solo contra una base local/desechable (no en producción): crea rifas de prueba con
+-- ids fijos b0000000-0000-0000-0000-00000000000N y la tabla bench_reserve_claims.
+--
+--   psql "$DATABASE_URL" -v total=100000 -v raffles=2 -f supabase/sql/bench_reserve_random_setup.sql
+--   pgbench "$DATABASE_URL" -n -f supabase/sql/bench_reserve_random.pgbench \
+--     -D total=100000 -D raffles=2 -D maxqty=10 -c 32 -j 4 -T 30
+--   psql "$DATABASE_URL" -f supabase/sql/bench_reserve_random_check.sql
+--
+-- pgbench reporta el throughput (tps = reservas por segundo); el check verifica que
+-- ningún ticket se entregó a dos sesiones.
+
+\if :{?total}
+\else
+  \set total 100000
+\endif
+\if :{?raffles}
+\else
+  \set raffles 2
+\endif
+
+set search_path = public;
+
+drop table if exists bench_reserve_claims;
+create table bench_reserve_claims (
+  session_id uuid not null,
+  raffle_id uuid not null,
+  ticket_id uuid not null,
+  claimed_at timestamptz not null default clock_timestamp()
+);
+
+delete from raffles where id::text like 'b0000000-0000-0000-0000-%';
+
+insert into raffles (id, name, status, total_tickets, is_free)
+select ('b0000000-0000-0000-0000-' || lpad(g::text, 12, '0'))::uuid, 'bench ' || g, 'selling', :total, false
+from generate_series(1, :raffles) g;
+
+-- Materializa los tickets antes de medir (el primer uso de cada rifa)
+select ensure_tickets_for_raffle(id, total_tickets) as tickets_created
+from raffles where id::text like 'b0000000-0000-0000-0000-%';
+
+vacuum analyze tickets;
@@ -0,0 +1,152 @@
+-- Benchmark del ranking de top compradores: agregado en cada llamada (versión anterior de
+-- top_buyers_for_raffle) frente a la tabla raffle_top_buyers (patch_top_buyers_leaderboard.sql).
+-- Solo contra una base local/desechable (no en producción): crea una rifa de prueba con
+-- id fijo c0000000-0000-0000-0000-000000000002 con :payments pagos de :per tickets
+-- repartidos entre :buyers compradores.
+--
+--   psql "$DATABASE_URL" -v payments=50000 -v buyers=5000 -f supabase/sql/bench_top_buyers.sql
+--
+-- Mide también cuánto agrega el trigger a la aprobación en lote y al final verifica que
+-- la tabla coincide con el agregado completo, antes y después de rechazar pagos.
+
+\if :{?payments}
+\else
+  \set payments 50000
+\endif
+\if :{?per}
+\else
+  \set per 2
+\endif
+\if :{?buyers}
+\else
+  \set buyers 5000
+\endif
+\if :{?calls}
+\else
+  \set calls 50
+\endif
+
+set search_path = public;
+\set raffle '\'c0000000-0000-0000-0000-000000000002\''
+
+delete from payments where raffle_id = :raffle;
+delete from raffles where id = :raffle;
+insert into raffles (id, name, status, total_tickets, is_free)
+values (:raffle, 'bench top buyers', 'selling', :payments * :per, false);
+select ensure_tickets_for_raffle(:raffle, :payments * :per) as tickets_created;
+
+-- La versión anterior de top_buyers_for_raffle, tal cual
+create or replace function pg_temp.top_buyers_old(p_raffle_id uuid, p_limit int default 20)
+returns table(buyer_email text, tickets bigint, payments_count bigint,
+              first_payment timestamptz, last_payment timestamptz, instagram text)
+language sql stable as $$
+  select p.email, count(pt.ticket_id)::bigint, count(distinct p.id)::bigint,
+         min(p.created_at), max(p.created_at),
+         (select coalesce(p2.instagram_user, p2.instagram) from payments p2
+           where p2.raffle_id = p_raffle_id and p2.email = p.email
+             and coalesce(p2.instagram_user, p2.instagram) is not null
+           order by p2.created_at desc limit 1)
+    from payments p
+    join payment_tickets pt on pt.payment_id = p.id
+   where p.status = 'approved' and p.raffle_id = p_raffle_id and p.email is not null
+   group by p.email
+   order by 2 desc, 5 desc
+   limit p_limit;
+$$;
+
+-- Compradores con cantidades desiguales (unos pocos compran mucho), instagram en un
+-- tercio de los pagos
+drop table if exists bench_top_buyers;
+create table bench_top_buyers as
+select gen_random_uuid() as id, g as n,
+       'buyer' || (floor(:buyers * power(random(), 2)))::int || '@bench.test' as email,
+       now() - make_interval(secs => :payments - g) as created_at
+from generate_series(1, :payments) g;
+
+insert into payments (id, raffle_id, email, reference, status, amount_ves, created_at, instagram)
+select id, :raffle, email, 'bench-top-' || n, 'pending', 10, created_at,
+       case when n % 3 = 0 then '@' || split_part(email, '@', 1) || '_' || n end
+from bench_top_buyers;
+
+insert into payment_tickets (payment_id, ticket_id)
+select b.id, t.id
+from bench_top_buyers b
+cross join generate_series(1, :per) k
+join tickets t on t.raffle_id = :raffle and t.ticket_number = ((b.n - 1) * :per + k)::text;
+
+update tickets set status = 'reserved' where raffle_id = :raffle;
+analyze payments; analyze payment_tickets; analyze tickets;
+
+-- Aprobación en lote del 90% de los pagos, la primera mitad sin el trigger y la
+-- segunda con el trigger (costo de mantener el ranking)
+do $$
+declare
+  v_ids uuid[];
+  v_start timestamptz;
+  v_half int;
+begin
+  select array_agg(id order by n) into v_ids from bench_top_buyers where n % 10 <> 0;
+  v_half := array_length(v_ids, 1) / 2;
+
+  alter table payments disable trigger trg_payments_top_buyers_upd;
+  v_start := clock_timestamp();
+  perform approve_payments(v_ids[1:v_half], 'bench');
+  raise notice 'approve_payments % pagos sin trigger: % ms', v_half,
+    round(extract(epoch from clock_timestamp() - v_start) * 1000, 1);
+  alter table payments enable trigger trg_payments_top_buyers_upd;
+
+  v_start := clock_timestamp();
+  perform approve_payments(v_ids[v_half + 1:], 'bench');
+  raise notice 'approve_payments % pagos con trigger: % ms', array_length(v_ids, 1) - v_half,
+    round(extract(epoch from clock_timestamp() - v_start) * 1000, 1);
+end $$;
+
+-- La primera mitad se aprobó sin trigger: reconstruir la rifa
+select refresh_raffle_top_buyers(:raffle) as rebuilt_rows;
+analyze raffle_top_buyers;
+
+\set ON_ERROR_STOP 1
+select set_config('bench.raffle', :raffle, false) as raffle, set_config('bench.calls', :'calls', false) as calls;
+
+do $$
+declare
+  v_raffle uuid := current_setting('bench.raffle')::uuid;
+  v_calls int := current_setting('bench.calls')::int;
+  v_start timestamptz;
+  v_old interval;
+  v_new interval;
+begin
+  v_start := clock_timestamp();
+  for i in 1..v_calls loop
+    perform * from pg_temp.top_buyers_old(v_raffle, 20);
+  end loop;
+  v_old := clock_timestamp() - v_start;
+
+  v_start := clock_timestamp();
+  for i in 1..v_calls loop
+    perform * from top_buyers_for_raffle(v_raffle, 20);
+  end loop;
+  v_new := clock_timestamp() - v_start;
+
+  raise notice 'agregado por llamada (anterior): % ms/llamada', round(extract(epoch from v_old) * 1000 / v_calls, 3);
+  raise notice 'raffle_top_buyers (nueva):       % ms/llamada', round(extract(epoch from v_new) * 1000 / v_calls, 3);
+end $$;
+
+-- Verificación: diferencias entre el agregado completo y la tabla (0 y 0 = correcto).
+-- Se rechaza un pago aprobado de cada 7 y se vuelve a comparar.
+select 'diff before reject' as check,
+       (select count(*) from (select * from pg_temp.top_buyers_old(:raffle, 1000000)
+                              except select * from top_buyers_for_raffle(:raffle, 1000000)) d) as old_minus_new,
+       (select count(*) from (select * from top_buyers_for_raffle(:raffle, 1000000)
+                              except select * from pg_temp.top_buyers_old(:raffle, 1000000)) d) as new_minus_old;
+
+update payments set status = 'rejected'
+where id in (select id from bench_top_buyers where n % 7 = 0 and n % 10 <> 0);
+
+select 'diff after reject' as check,
+       (select count(*) from (select * from pg_temp.top_buyers_old(:raffle, 1000000)
+                              except select * from top_buyers_for_raffle(:raffle, 1000000)) d) as old_minus_new,
+       (select count(*) from (select * from top_buyers_for_raffle(:raffle, 1000000)
+                              except select * from pg_temp.top_buyers_old(:raffle, 1000000)) d) as new_minus_old;
+
+explain (analyze, costs off, timing off, summary on) select * from top_buyers_for_raffle(:raffle, 20);
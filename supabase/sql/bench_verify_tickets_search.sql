@@ -0,0 +1,112 @@
+-- Benchmark (EXPLAIN) de la búsqueda de verify_tickets: ilike sobre email/ci vs
+-- columnas normalizadas con índices trigram (patch_verify_tickets_normalized_search.sql).
+--
+-- Ejecutar con psql contra una base local/desechable (no en producción):
+--   psql "$DATABASE_URL" -f supabase/sql/bench_verify_tickets_search.sql
+--   psql "$DATABASE_URL" -v n=200000 -f supabase/sql/bench_verify_tickets_search.sql
+--
+-- Crea todo en el esquema bench_verify (dataset sintético de :n pagos, 1M por defecto)
+-- y lo elimina al terminar.
+
+\if :{?n}
+\else
+  \set n 1000000
+\endif
+\timing on
+\pset pager off
+
+create extension if not exists pg_trgm;
+drop schema if exists bench_verify cascade;
+create schema bench_verify;
+set search_path = bench_verify, public;
+
+create table payments (
+  id bigint primary key,
+  email text,
+  ci text,
+  status text not null,
+  created_at timestamptz not null,
+  email_norm text,
+  ci_digits text
+);
+
+-- Emails y cédulas con formatos mixtos ("V-12.345.678", "12345678", "v 12345678")
+insert into payments (id, email, ci, status, created_at)
+select g,
+       case when g % 7 = 0 then upper('buyer' || g || '@mail' || (g % 40) || '.com')
+            else 'buyer' || g || '@mail' || (g % 40) || '.com' end,
+       case g % 3 when 0 then 'V-' || to_char(10000000 + g, 'FM99G999G999')
+                  when 1 then (10000000 + g)::text
+                  else 'v ' || (10000000 + g) end,
+       (array['approved','approved','approved','pending','rejected'])[1 + g % 5],
+       now() - make_interval(mins => g)
+from generate_series(1, :n) g;
+
+update payments
+   set email_norm = nullif(lower(btrim(email)), ''),
+       ci_digits = nullif(regexp_replace(coalesce(ci, ''), '[^0-9]', '', 'g'), '');
+
+create index on payments (email_norm);
+create index on payments (ci_digits);
+create index on payments using gin (email_norm gin_trgm_ops);
+create index on payments using gin (ci_digits gin_trgm_ops);
+analyze payments;
+
+-- Consultas de ejemplo (sobre una fila existente): email completo, fragmento y cédula con prefijo
+select 'buyer' || k || '@mail' || (k % 40) || '.com' as q_email,
+       'buyer' || (k / 10) as q_part,
+       'V-' || to_char(10000000 + k, 'FM99G999G999') as q_ci,
+       (10000000 + k)::text as q_ci_digits
+from (select (:n / 2 + 1)::bigint as k) s \gset
+
+\echo '=== ANTES: email/ci ilike (full scan) — email completo'
+explain (analyze, buffers, costs off)
+select id from payments
+where (email ilike '%' || :'q_email' || '%' or ci ilike '%' || :'q_email' || '%')
+  and status in ('approved','pending');
+
+\echo '=== DESPUÉS: email_norm like (trigram) — email completo'
+explain (analyze, buffers, costs off)
+select id from payments
+where email_norm like '%' || lower(:'q_email') || '%'
+  and status in ('approved','pending');
+
+\echo '=== ANTES: fragmento de email'
+explain (analyze, buffers, costs off)
+select id from payments
+where (email ilike '%' || :'q_part' || '%' or ci ilike '%' || :'q_part' || '%')
+  and status in ('approved','pending');
+
+\echo '=== DESPUÉS: fragmento de email'
+explain (analyze, buffers, costs off)
+select id from payments
+where email_norm like '%' || lower(:'q_part') || '%'
+  and status in ('approved','pending');
+
+\echo '=== ANTES: cédula con prefijo (no encuentra "10777777"; la API hacía un 2º intento solo con dígitos)'
+explain (analyze, buffers, costs off)
+select id from payments
+where (email ilike '%' || :'q_ci' || '%' or ci ilike '%' || :'q_ci' || '%')
+  and status in ('approved','pending');
+
+\echo '=== ANTES: 2º intento solo dígitos'
+explain (analyze, buffers, costs off)
+select id from payments
+where ci ilike '%' || :'q_ci_digits' || '%'
+  and status in ('approved','pending');
+
+\echo '=== DESPUÉS: cédula normalizada (un solo paso, BitmapOr email/ci)'
+explain (analyze, buffers, costs off)
+select id from payments
+where (email_norm like '%' || lower(:'q_ci') || '%'
+       or ci_digits like '%' || regexp_replace(:'q_ci', '[^0-9]', '', 'g') || '%')
+  and status in ('approved','pending');
+
+\echo '=== DESPUÉS: cédula exacta (btree)'
+explain (analyze, buffers, costs off)
+select id from payments
+where ci_digits = regexp_replace(:'q_ci', '[^0-9]', '', 'g')
+  and status in ('approved','pending');
+
+reset search_path;
+drop schema bench_verify cascade;
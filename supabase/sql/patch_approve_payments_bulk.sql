@@ -0,0 +1,117 @@
+-- Patch: aprobación y rechazo de pagos en lote (POST /admin/approve-payments, /admin/reject-payments)
+-- Mismo efecto que approve_payment / reject_payment, pero para muchos pagos en una sola
+-- llamada: un UPDATE sobre payments y uno sobre tickets para todo el lote, en vez de dos
+-- por pago y un round trip por pago.
+--
+-- Devuelve una fila por id recibido con el resultado:
+--   approve_payments: approved | already_approved | not_found | invalid_status
+--   reject_payments:  rejected | already_rejected | not_found | invalid_status
+-- invalid_status: en lote no se aprueban pagos rechazados/cancelados (sus tickets pueden
+-- ser ya de otro comprador) ni se rechazan pagos aprobados (liberaría tickets vendidos);
+-- para esos casos siguen estando approve_payment / reject_payment de a uno.
+-- ticket_ids son los tickets que cambiaron de estado (para refrescar caches en la API).
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+create or replace function public.approve_payments(p_payment_ids uuid[], p_approved_by text)
+returns table (payment_id uuid, outcome text, previous_status text, ticket_ids uuid[])
+language sql
+security definer
+set search_path = public, pg_temp
+as $$
+  with req as (
+    select distinct x as id from unnest(p_payment_ids) x where x is not null
+  ),
+  -- Bloquea los pagos del lote: dos aprobaciones concurrentes del mismo pago no
+  -- pasan las dos por la rama 'approved'
+  cur as (
+    select p.id, p.status::text as status
+    from payments p join req on req.id = p.id
+    order by p.id
+    for update of p
+  ),
+  pay as (
+    update payments p
+       set status = 'approved', approved_by = p_approved_by, approved_at = now()
+      from cur
+     where p.id = cur.id
+       and cur.status not in ('approved', 'rejected', 'cancelled')
+    returning p.id
+  ),
+  tix as (
+    update tickets t
+       set status = 'sold', reserved_by = null, reserved_until = null
+      from payment_tickets pt join pay on pay.id = pt.payment_id
+     where pt.ticket_id = t.id
+    returning pt.payment_id, t.id
+  ),
+  agg as (
+    select tix.payment_id, array_agg(tix.id) as ids from tix group by tix.payment_id
+  )
+  select req.id,
+         case
+           when cur.id is null then 'not_found'
+           when pay.id is not null then 'approved'
+           when cur.status = 'approved' then 'already_approved'
+           else 'invalid_status'
+         end,
+         cur.status,
+         coalesce(agg.ids, array[]::uuid[])
+  from req
+  left join cur on cur.id = req.id
+  left join pay on pay.id = req.id
+  left join agg on agg.payment_id = req.id;
+$$;
+
+create or replace function public.reject_payments(p_payment_ids uuid[], p_rejected_by text)
+returns table (payment_id uuid, outcome text, previous_status text, ticket_ids uuid[])
+language sql
+security definer
+set search_path = public, pg_temp
+as $$
+  with req as (
+    select distinct x as id from unnest(p_payment_ids) x where x is not null
+  ),
+  cur as (
+    select p.id, p.status::text as status
+    from payments p join req on req.id = p.id
+    order by p.id
+    for update of p
+  ),
+  pay as (
+    update payments p
+       set status = 'rejected', approved_by = p_rejected_by, approved_at = now()
+      from cur
+     where p.id = cur.id
+       and cur.status not in ('approved', 'rejected', 'cancelled')
+    returning p.id
+  ),
+  tix as (
+    update tickets t
+       set status = 'available', reserved_by = null, reserved_until = null
+      from payment_tickets pt join pay on pay.id = pt.payment_id
+     where pt.ticket_id = t.id
+    returning pt.payment_id, t.id
+  ),
+  agg as (
+    select tix.payment_id, array_agg(tix.id) as ids from tix group by tix.payment_id
+  )
+  select req.id,
+         case
+           when cur.id is null then 'not_found'
+           when pay.id is not null then 'rejected'
+           when cur.status = 'rejected' then 'already_rejected'
+           else 'invalid_status'
+         end,
+         cur.status,
+         coalesce(agg.ids, array[]::uuid[])
+  from req
+  left join cur on cur.id = req.id
+  left join pay on pay.id = req.id
+  left join agg on agg.payment_id = req.id;
+$$;
+
+-- Solo la API (service_role) aprueba o rechaza
+revoke all on function public.approve_payments(uuid[], text) from public, anon, authenticated;
+revoke all on function public.reject_payments(uuid[], text) from public, anon, authenticated;
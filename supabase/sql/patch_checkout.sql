@@ -0,0 +1,174 @@
+-- Patch: checkout en una sola llamada (reserva + pago) para POST /checkout de la API
+-- El checkout del sitio encadenaba /reservations/random o /reservations/ids,
+-- create_payment_for_session y /payments/set-ci: un round trip por paso y, si alguno
+-- fallaba a mitad de camino, quedaban reservas sin pago o pagos sin cédula.
+--
+-- checkout_for_session hace todo en una transacción: reserva los tickets, crea el pago
+-- pendiente con cédula, email, referencia y tasa, lo vincula a esos tickets y los
+-- retiene (como create_payment_for_session) y devuelve el estado final. Si algo falla
+-- no queda nada a medias. Qué tickets entran al pago:
+--   * p_ticket_ids: exactamente esos (disponibles o ya reservados por la sesión);
+--     respeta allow_manual = false como reserve_tickets;
+--   * p_quantity: primero los que la sesión ya tiene reservados en la rifa, el resto
+--     al azar con claim_random_tickets; las reservas sobrantes de la sesión se liberan;
+--   * ninguno de los dos: las reservas vigentes de la sesión en la rifa.
+-- El monto, si no se indica, es ticket_price_cents * tickets * tasa / 100 (redondeado).
+-- Errores (excepción P0001, PostgREST responde 400 con el mensaje):
+--   raffle_not_found, raffle_not_selling, free_raffle, manual_selection_disabled,
+--   tickets_unavailable, not_enough_tickets, no_reserved_tickets, below_min_purchase.
+-- Requiere patch_reserve_random_set_based.sql (claim_random_tickets).
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+create or replace function public.checkout_for_session(
+  p_raffle_id uuid,
+  p_session_id uuid,
+  p_quantity int default null,
+  p_ticket_ids uuid[] default null,
+  p_minutes int default 10,
+  p_email text default null,
+  p_phone text default null,
+  p_city text default null,
+  p_ci text default null,
+  p_instagram text default null,
+  p_method text default null,
+  p_reference text default null,
+  p_evidence_url text default null,
+  p_amount_ves numeric default null,
+  p_rate_used numeric default null,
+  p_rate_source text default null,
+  p_currency text default 'VES'
+) returns jsonb
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_raffle jsonb;
+  v_until timestamptz := now() + make_interval(mins => coalesce(p_minutes, 10));
+  v_ids uuid[];
+  v_count int;
+  v_amount numeric;
+  v_payment_id uuid;
+begin
+  -- to_jsonb: allow_manual y min_ticket_purchase son columnas opcionales (patches aparte)
+  select to_jsonb(r) into v_raffle from raffles r where r.id = p_raffle_id;
+  if v_raffle is null then
+    raise exception 'raffle_not_found' using errcode = 'P0001';
+  end if;
+  if v_raffle->>'status' not in ('published', 'selling') then
+    raise exception 'raffle_not_selling' using errcode = 'P0001';
+  end if;
+  -- Las rifas gratis validan participación única en create_payment_for_session
+  if (v_raffle->>'is_free')::boolean then
+    raise exception 'free_raffle' using errcode = 'P0001';
+  end if;
+
+  perform ensure_session(p_session_id);
+
+  if coalesce(array_length(p_ticket_ids, 1), 0) > 0 then
+    if coalesce((v_raffle->>'allow_manual')::boolean, true) = false then
+      raise exception 'manual_selection_disabled' using errcode = 'P0001';
+    end if;
+    -- Sin skip locked: si otra sesión los está tomando se espera y se vuelve a
+    -- evaluar el status con su resultado
+    with picked as (
+      select t.id from tickets t
+       where t.id = any(p_ticket_ids)
+         and t.raffle_id = p_raffle_id
+         and (t.status = 'available' or (t.status = 'reserved' and t.reserved_by = p_session_id))
+       for update
+    ), upd as (
+      update tickets t
+         set status = 'reserved', reserved_by = p_session_id, reserved_until = v_until
+        from picked
+       where t.id = picked.id
+      returning t.id
+    )
+    select array_agg(id) into v_ids from upd;
+    if coalesce(array_length(v_ids, 1), 0) < (select count(distinct x) from unnest(p_ticket_ids) x) then
+      raise exception 'tickets_unavailable' using errcode = 'P0001';
+    end if;
+  else
+    select array_agg(t.id order by t.reserved_until, t.id) into v_ids
+      from tickets t
+     where t.raffle_id = p_raffle_id
+       and t.reserved_by = p_session_id
+       and t.status = 'reserved'
+       and (t.reserved_until is null or t.reserved_until > now());
+
+    if p_quantity is not null then
+      if p_quantity < 1 then
+        raise exception 'not_enough_tickets' using errcode = 'P0001';
+      end if;
+      v_ids := coalesce(v_ids[1:p_quantity], array[]::uuid[]);
+      if array_length(v_ids, 1) is distinct from p_quantity then
+        v_ids := v_ids || coalesce((
+          select array_agg(c.id)
+            from claim_random_tickets(p_raffle_id, p_session_id, p_quantity - coalesce(array_length(v_ids, 1), 0), v_until) as c(id)
+        ), array[]::uuid[]);
+      end if;
+      if coalesce(array_length(v_ids, 1), 0) < p_quantity then
+        raise exception 'not_enough_tickets' using errcode = 'P0001';
+      end if;
+    elsif coalesce(array_length(v_ids, 1), 0) = 0 then
+      raise exception 'no_reserved_tickets' using errcode = 'P0001';
+    end if;
+  end if;
+
+  v_count := array_length(v_ids, 1);
+  if v_count < coalesce((v_raffle->>'min_ticket_purchase')::int, 1) then
+    raise exception 'below_min_purchase' using errcode = 'P0001';
+  end if;
+
+  -- Lo que la sesión tenía reservado en la rifa y no entra al pago se libera
+  update tickets t
+     set status = 'available', reserved_by = null, reserved_until = null
+   where t.raffle_id = p_raffle_id
+     and t.reserved_by = p_session_id
+     and t.status = 'reserved'
+     and not (t.id = any(v_ids));
+
+  v_amount := coalesce(
+    p_amount_ves,
+    round((v_raffle->>'ticket_price_cents')::numeric * v_count * p_rate_used / 100)
+  );
+
+  insert into payments (raffle_id, session_id, email, phone, city, method, reference, evidence_url,
+                        amount_ves, rate_used, rate_source, currency, status, ci, instagram)
+  values (p_raffle_id, p_session_id, p_email, p_phone, p_city, p_method, p_reference, p_evidence_url,
+          v_amount, p_rate_used, p_rate_source, coalesce(p_currency, 'VES'), 'pending', p_ci, p_instagram)
+  returning id into v_payment_id;
+
+  insert into payment_tickets (payment_id, ticket_id)
+  select v_payment_id, x from unnest(v_ids) x;
+
+  -- Retenidos por el pago: sin vencimiento ni sesión, como create_payment_for_session
+  update tickets t
+     set reserved_until = null, reserved_by = null
+   where t.id = any(v_ids);
+
+  return jsonb_build_object(
+    'payment_id', v_payment_id,
+    'status', 'pending',
+    'raffle_id', p_raffle_id,
+    'reference', p_reference,
+    'ci', p_ci,
+    'amount_ves', v_amount,
+    'rate_used', p_rate_used,
+    'rate_source', p_rate_source,
+    'currency', coalesce(p_currency, 'VES'),
+    'tickets', (
+      select coalesce(jsonb_agg(jsonb_build_object('id', t.id, 'ticket_number', t.ticket_number, 'raffle_id', t.raffle_id)
+                                order by t.ticket_number::int), '[]'::jsonb)
+        from tickets t
+       where t.id = any(v_ids)
+    )
+  );
+end;
+$$;
+
+-- La API llama con la key de servicio (tasa del lado del servidor); no se expone a anon
+revoke all on function public.checkout_for_session(uuid, uuid, int, uuid[], int, text, text, text, text, text, text, text, text, numeric, numeric, text, text)
+  from public, anon, authenticated;
@@ -0,0 +1,21 @@
+-- Patch: índice para buscar pagos por referencia (webhooks del proveedor, conciliación)
+-- La cola de webhooks de la API y POST /admin/payments/by-reference consultan
+-- payments?reference=in.(...); sin índice cada consulta recorre toda la tabla.
+--
+-- No es único: la referencia la escribe el comprador y puede repetirse (dos pagos con
+-- la misma transferencia, reintentos del formulario). Para revisar duplicados:
+--   select reference, count(*) from payments where reference is not null
+--   group by reference having count(*) > 1 order by 2 desc;
+--
+-- En una tabla grande y con tráfico, crear el índice fuera de una transacción sin
+-- bloquear escrituras (no funciona dentro del editor SQL si envuelve en transacción):
+--   create index concurrently if not exists idx_payments_reference
+--     on public.payments (reference) where reference is not null;
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+-- Parcial: los pagos sin referencia (rifas gratis) no ocupan el índice
+create index if not exists idx_payments_reference
+  on public.payments (reference)
+  where reference is not null;
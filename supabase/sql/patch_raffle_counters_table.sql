@@ -0,0 +1,262 @@
+-- Patch: contadores de tickets por rifa mantenidos de forma incremental (raffle_counters)
+-- La vista raffle_ticket_counters hacía un GROUP BY sobre todos los tickets de todas
+-- las rifas y, por cada ticket reservado, dos EXISTS correlacionados contra
+-- payment_tickets/payments; cada barra de progreso del sitio la leía.
+--
+-- Ahora los contadores (sold, reserved) viven en raffle_counters y los mantiene un
+-- trigger por sentencia sobre tickets: cubre la reserva (claim_random_tickets,
+-- reserve_tickets_batch), release_tickets, approve_payment(s), reject_payment(s), el
+-- vencimiento (release_expired_tickets y el barrido release_expired_reservations) y
+-- cambios hechos a mano. Cada rifa tiene hasta 16 filas (shards): cada conexión suma en
+-- la suya (pg_backend_pid() % 16), así reservas concurrentes de la misma rifa no se
+-- turnan sobre una fila caliente; la lectura suma los shards.
+--
+-- Diferencia con la vista: un ticket cuenta como reservado mientras su status sea
+-- 'reserved' (no se mira reserved_until contra now()). Una reserva vencida deja de
+-- contar cuando se libera (la API lo hace al vencer; el barrido de pg_cron es la red
+-- de seguridad), que es también cuando vuelve a poder reservarse.
+--
+-- refresh_raffle_counters(rifa) recalcula una rifa desde tickets y devuelve la
+-- diferencia que corrigió (la API lo corre periódicamente sobre las rifas activas).
+-- raffle_ticket_counters (vista y/o función, según cuál exista) y la nueva
+-- ticket_counters_for_raffle leen de la tabla con las mismas columnas.
+--
+-- Al aplicarlo se llena la tabla con los tickets existentes (bloquea escrituras en
+-- tickets mientras tanto). Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+create table if not exists public.raffle_counters (
+  raffle_id uuid not null references public.raffles(id) on delete cascade,
+  shard smallint not null,
+  sold bigint not null default 0,
+  reserved bigint not null default 0,
+  primary key (raffle_id, shard)
+);
+
+-- Solo se lee a través de las funciones security definer de abajo
+alter table public.raffle_counters enable row level security;
+revoke all on table public.raffle_counters from public, anon, authenticated;
+
+-- Suma una diferencia en el shard de la conexión actual
+create or replace function public.add_raffle_counters(p_raffle_id uuid, p_sold bigint, p_reserved bigint)
+returns void
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+begin
+  if p_sold = 0 and p_reserved = 0 then
+    return;
+  end if;
+  -- Compartido entre escritores; refresh_raffle_counters lo toma exclusivo para
+  -- recalcular sin diferencias a medio aplicar
+  perform pg_advisory_xact_lock_shared(hashtextextended('prizo.counters:' || p_raffle_id::text, 0));
+  -- Si la rifa se está borrando (cascade a tickets) no hay nada que contar
+  insert into raffle_counters as c (raffle_id, shard, sold, reserved)
+  select p_raffle_id, pg_backend_pid() % 16, p_sold, p_reserved
+   where exists (select 1 from raffles where id = p_raffle_id)
+  on conflict (raffle_id, shard) do update
+     set sold = c.sold + excluded.sold,
+         reserved = c.reserved + excluded.reserved;
+end;
+$$;
+
+revoke all on function public.add_raffle_counters(uuid, bigint, bigint) from public, anon, authenticated;
+
+-- Trigger por sentencia con tablas de transición: suma por rifa la diferencia entre
+-- filas nuevas y viejas (una reserva de 5 tickets es un solo upsert). Las sentencias
+-- que no cambian status (p. ej. renovar reserved_until) no escriben nada. Las rifas se
+-- recorren ordenadas para tomar los locks siempre en el mismo orden.
+create or replace function public.trg_tickets_raffle_counters()
+returns trigger
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  r record;
+begin
+  if tg_op = 'INSERT' then
+    for r in
+      select n.raffle_id, count(*) filter (where n.status = 'sold') as sold,
+             count(*) filter (where n.status = 'reserved') as reserved
+        from new_rows n
+       where n.status in ('sold', 'reserved')
+       group by n.raffle_id
+       order by n.raffle_id
+    loop
+      perform add_raffle_counters(r.raffle_id, r.sold, r.reserved);
+    end loop;
+  elsif tg_op = 'UPDATE' then
+    for r in
+      select x.raffle_id, sum(x.sold)::bigint as sold, sum(x.reserved)::bigint as reserved
+        from old_rows o
+        join new_rows n on n.id = o.id
+        cross join lateral (values
+          (n.raffle_id, (n.status = 'sold')::int, (n.status = 'reserved')::int),
+          (o.raffle_id, -(o.status = 'sold')::int, -(o.status = 'reserved')::int)
+        ) as x(raffle_id, sold, reserved)
+       where o.status is distinct from n.status or o.raffle_id <> n.raffle_id
+       group by x.raffle_id
+       order by x.raffle_id
+    loop
+      perform add_raffle_counters(r.raffle_id, r.sold, r.reserved);
+    end loop;
+  else
+    for r in
+      select o.raffle_id, count(*) filter (where o.status = 'sold') as sold,
+             count(*) filter (where o.status = 'reserved') as reserved
+        from old_rows o
+       where o.status in ('sold', 'reserved')
+       group by o.raffle_id
+       order by o.raffle_id
+    loop
+      perform add_raffle_counters(r.raffle_id, -r.sold, -r.reserved);
+    end loop;
+  end if;
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_tickets_raffle_counters_ins on public.tickets;
+create trigger trg_tickets_raffle_counters_ins
+  after insert on public.tickets
+  referencing new table as new_rows
+  for each statement
+  execute procedure public.trg_tickets_raffle_counters();
+
+drop trigger if exists trg_tickets_raffle_counters_upd on public.tickets;
+create trigger trg_tickets_raffle_counters_upd
+  after update on public.tickets
+  referencing old table as old_rows new table as new_rows
+  for each statement
+  execute procedure public.trg_tickets_raffle_counters();
+
+drop trigger if exists trg_tickets_raffle_counters_del on public.tickets;
+create trigger trg_tickets_raffle_counters_del
+  after delete on public.tickets
+  referencing old table as old_rows
+  for each statement
+  execute procedure public.trg_tickets_raffle_counters();
+
+-- Recalcula una rifa desde tickets, deja un solo shard y devuelve lo corregido
+-- (actual - contado). El lock exclusivo espera a que terminen las transacciones que
+-- ya sumaron en la rifa; las que cambien tickets después suman al terminar este.
+create or replace function public.refresh_raffle_counters(p_raffle_id uuid)
+returns table (raffle_id uuid, sold_drift bigint, reserved_drift bigint)
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_sold bigint;
+  v_reserved bigint;
+  v_old_sold bigint;
+  v_old_reserved bigint;
+begin
+  if not exists (select 1 from raffles r where r.id = p_raffle_id) then
+    return;
+  end if;
+  perform pg_advisory_xact_lock(hashtextextended('prizo.counters:' || p_raffle_id::text, 0));
+
+  select count(*) filter (where t.status = 'sold'), count(*) filter (where t.status = 'reserved')
+    into v_sold, v_reserved
+    from tickets t
+   where t.raffle_id = p_raffle_id
+     and t.status in ('sold', 'reserved');
+
+  with gone as (
+    delete from raffle_counters c where c.raffle_id = p_raffle_id returning c.sold, c.reserved
+  )
+  select coalesce(sum(gone.sold), 0), coalesce(sum(gone.reserved), 0)
+    into v_old_sold, v_old_reserved
+    from gone;
+
+  insert into raffle_counters (raffle_id, shard, sold, reserved)
+  values (p_raffle_id, 0, v_sold, v_reserved);
+
+  return query select p_raffle_id, v_sold - v_old_sold, v_reserved - v_old_reserved;
+end;
+$$;
+
+revoke all on function public.refresh_raffle_counters(uuid) from public, anon, authenticated;
+
+-- Contadores de una rifa visible (mismas columnas que raffle_ticket_counters); lo usa
+-- GET /raffles/{id}/counters
+create or replace function public.ticket_counters_for_raffle(p_raffle_id uuid)
+returns table (raffle_id uuid, total_tickets int, sold bigint, reserved bigint, available bigint)
+language sql
+stable
+security definer
+set search_path = public, pg_temp
+as $$
+  select r.id, r.total_tickets, coalesce(c.sold, 0), coalesce(c.reserved, 0),
+         greatest(0, r.total_tickets - coalesce(c.sold, 0) - coalesce(c.reserved, 0))
+    from raffles r
+    left join lateral (
+      select sum(s.sold)::bigint as sold, sum(s.reserved)::bigint as reserved
+        from raffle_counters s
+       where s.raffle_id = r.id
+    ) c on true
+   where r.id = p_raffle_id
+     and r.status in ('published', 'selling', 'closed', 'drawn');
+$$;
+
+grant execute on function public.ticket_counters_for_raffle(uuid) to anon, authenticated;
+
+-- La web prueba primero rpc('raffle_ticket_counters'): misma firma que la versión de
+-- patch_security_hardening_extra.sql, ahora sobre la tabla y solo rifas visibles
+-- (antes lo filtraba la RLS de raffles)
+drop function if exists public.raffle_ticket_counters();
+create function public.raffle_ticket_counters()
+returns table (raffle_id uuid, total_tickets int, sold bigint, reserved bigint, available bigint)
+language sql
+stable
+security definer
+set search_path = public, pg_temp
+as $$
+  select r.id, r.total_tickets, coalesce(c.sold, 0), coalesce(c.reserved, 0),
+         greatest(0, r.total_tickets - coalesce(c.sold, 0) - coalesce(c.reserved, 0))
+    from raffles r
+    left join (
+      select s.raffle_id, sum(s.sold)::bigint as sold, sum(s.reserved)::bigint as reserved
+        from raffle_counters s
+       group by s.raffle_id
+    ) c on c.raffle_id = r.id
+   where r.status in ('published', 'selling', 'closed', 'drawn');
+$$;
+
+grant execute on function public.raffle_ticket_counters() to anon, authenticated;
+
+-- Si la vista sigue existiendo (no se aplicó patch_security_hardening_extra.sql), se
+-- reemplaza por una lectura de la tabla; la usa auto_transition_raffles
+do $$
+begin
+  if exists (select 1 from pg_views where schemaname = 'public' and viewname = 'raffle_ticket_counters') then
+    create or replace view public.raffle_ticket_counters as
+    select r.id as raffle_id,
+           r.total_tickets,
+           coalesce(c.sold, 0)::bigint as sold,
+           coalesce(c.reserved, 0)::bigint as reserved,
+           greatest(0, r.total_tickets - coalesce(c.sold, 0) - coalesce(c.reserved, 0))::bigint as available
+      from raffles r
+      left join (
+        select s.raffle_id, sum(s.sold) as sold, sum(s.reserved) as reserved
+          from raffle_counters s
+         group by s.raffle_id
+      ) c on c.raffle_id = r.id;
+  end if;
+end;$$;
+
+-- Llenado inicial con los tickets existentes; el lock evita perder reservas que
+-- ocurran mientras se cuenta
+begin;
+lock table public.tickets in share row exclusive mode;
+delete from public.raffle_counters;
+insert into public.raffle_counters (raffle_id, shard, sold, reserved)
+select t.raffle_id, 0, count(*) filter (where t.status = 'sold'), count(*) filter (where t.status = 'reserved')
+  from public.tickets t
+ where t.status in ('sold', 'reserved')
+ group by t.raffle_id;
+commit;
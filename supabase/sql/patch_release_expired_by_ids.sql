@@ -0,0 +1,65 @@
+-- Patch: liberación de reservas vencidas por eventos (API) + barrido de respaldo indexado
+-- La API mantiene en memoria los vencimientos de las reservas que crea y, al cumplirse,
+-- libera esos tickets en lote con release_expired_tickets(ids). El job de pg_cron queda
+-- solo como red de seguridad (cada 5 minutos) y usa un índice parcial sobre reserved_until.
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+-- Solo tickets reservados: el índice se mantiene pequeño aunque la tabla crezca
+create index if not exists idx_tickets_reserved_expiry
+  on public.tickets (reserved_until)
+  where status = 'reserved';
+
+-- Libera, de los ids indicados, los que siguen reservados y ya vencieron.
+-- Devuelve una fila por ticket liberado (released = true) y, para los que siguen
+-- reservados con un vencimiento futuro (renovados), su reserved_until actual.
+create or replace function public.release_expired_tickets(p_ticket_ids uuid[])
+returns table (ticket_id uuid, released boolean, reserved_until timestamptz)
+language sql
+security definer
+set search_path = public, pg_temp
+as $$
+  with rel as (
+    update tickets t
+       set status = 'available', reserved_by = null, reserved_until = null
+     where t.id = any(p_ticket_ids)
+       and t.status = 'reserved'
+       and t.reserved_until is not null
+       and t.reserved_until < now()
+    returning t.id
+  )
+  select rel.id, true, null::timestamptz from rel
+  union all
+  select t.id, false, t.reserved_until
+  from tickets t
+  where t.id = any(p_ticket_ids)
+    and t.status = 'reserved'
+    and t.reserved_until >= now();
+$$;
+
+revoke all on function public.release_expired_tickets(uuid[]) from public, anon, authenticated;
+
+-- Barrido de respaldo: mismo contrato, predicado alineado con el índice parcial
+create or replace function public.release_expired_reservations()
+returns void
+language sql
+security definer
+set search_path = public, pg_temp
+as $$
+  update tickets
+     set status = 'available', reserved_by = null, reserved_until = null
+   where status = 'reserved' and reserved_until < now();
+$$;
+
+-- Con la API liberando al vencer, el job pasa de cada minuto a cada 5 minutos
+do $$
+begin
+  if exists (select 1 from pg_extension where extname = 'pg_cron') then
+    perform cron.schedule(
+      'release-expired-reservations',
+      '*/5 * * * *',
+      'SELECT public.release_expired_reservations();'
+    );
+  end if;
+end;$$;
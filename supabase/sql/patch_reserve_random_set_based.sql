@@ -0,0 +1,213 @@
+-- Patch: reserva aleatoria por conjuntos para rifas grandes (10k–100k números)
+-- Antes, en cada llamada a ensure_and_reserve_random_tickets:
+--   * ensure_tickets_for_raffle volvía a insertar 1..total con ON CONFLICT (100k sondeos de índice);
+--   * el sorteo hacía ORDER BY random() sobre todos los disponibles (recorrido + sort completos);
+--   * en rifas gratis ilimitadas se bloqueaba la fila de raffles (fila caliente).
+-- Ahora:
+--   * los tickets se materializan una sola vez por rifa (si ya existe el número "total", no se hace nada);
+--   * claim_random_tickets sortea números candidatos y los reclama en una sola operación
+--     UPDATE ... FOR UPDATE SKIP LOCKED usando el índice único (raffle_id, ticket_number).
+--     Sesiones concurrentes reciben candidatos distintos y no se esperan entre sí; solo si la
+--     rifa está casi agotada se cae al ORDER BY random() sobre los pocos disponibles;
+--   * la numeración de rifas gratis usa un advisory lock por rifa y un índice numérico.
+-- Mismo contrato: ensure_and_reserve_random_tickets(uuid, int, uuid, int, int) returns setof tickets.
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+-- max(número) de una rifa sin recorrerla (rifas gratis con numeración dinámica)
+create index if not exists idx_tickets_raffle_number_int on public.tickets (raffle_id, (ticket_number::int));
+-- liberar las reservas propias de la sesión sin recorrer la rifa
+create index if not exists idx_tickets_reserved_by on public.tickets (reserved_by) where reserved_by is not null;
+
+create or replace function public.ensure_tickets_for_raffle(
+  p_raffle_id uuid,
+  p_total int
+) returns int
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  inserted int := 0;
+  v_total int;
+  v_allowed int;
+begin
+  select total_tickets into v_total from raffles where id = p_raffle_id;
+
+  -- Si la rifa es gratuita y tiene total_tickets = 0, permitimos creación dinámica
+  if v_total is null or v_total = 0 then
+    v_allowed := p_total;
+  else
+    v_allowed := v_total;
+  end if;
+  if p_total > v_allowed then
+    p_total := v_allowed;
+  end if;
+  if coalesce(p_total, 0) <= 0 then
+    return 0;
+  end if;
+
+  -- Ya materializada: 1..total se inserta en una sola sentencia, así que si existe
+  -- el último número existen todos (una búsqueda en el índice único)
+  if exists (select 1 from tickets where raffle_id = p_raffle_id and ticket_number = p_total::text) then
+    return 0;
+  end if;
+
+  -- Solo una sesión materializa; las demás esperan y encuentran los tickets creados
+  perform pg_advisory_xact_lock(hashtextextended('prizo.tickets:' || p_raffle_id::text, 0));
+  insert into tickets (raffle_id, ticket_number, status)
+  select p_raffle_id, gs::text, 'available'
+  from generate_series(1, p_total) as gs
+  on conflict (raffle_id, ticket_number) do nothing;
+  get diagnostics inserted = row_count;
+  return inserted;
+end;
+$$;
+
+-- Reclama hasta p_quantity tickets disponibles al azar para la sesión y devuelve sus ids.
+-- Uso interno (ensure_and_reserve_random_tickets, reserve_tickets_batch); no se expone a anon.
+create or replace function public.claim_random_tickets(
+  p_raffle_id uuid,
+  p_session_id uuid,
+  p_quantity int,
+  p_until timestamptz
+) returns setof uuid
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_total int;
+  v_is_free boolean;
+  v_need int := greatest(0, coalesce(p_quantity, 0));
+  v_got int;
+  v_round int := 0;
+  v_sample int;
+  v_ids uuid[];
+begin
+  if v_need = 0 then
+    return;
+  end if;
+  select r.total_tickets, r.is_free into v_total, v_is_free from raffles r where r.id = p_raffle_id;
+  if v_total is null then
+    return;
+  end if;
+
+  if v_is_free and v_total = 0 then
+    -- Rifa gratis ilimitada: numeración nueva serializada por rifa (sin bloquear la fila de raffles)
+    perform pg_advisory_xact_lock(hashtextextended('prizo.tickets:' || p_raffle_id::text, 0));
+    return query
+    with base as (
+      select coalesce((
+        select ticket_number::int from tickets
+        where raffle_id = p_raffle_id
+        order by ticket_number::int desc
+        limit 1
+      ), 0) as maxn
+    )
+    insert into tickets (raffle_id, ticket_number, status, reserved_by, reserved_until)
+    select p_raffle_id, (b.maxn + g)::text, 'reserved', p_session_id, p_until
+    from base b, generate_series(1, v_need) g
+    on conflict (raffle_id, ticket_number) do nothing
+    returning id;
+    return;
+  end if;
+
+  -- Sorteo por muestreo: números candidatos al azar, reclamados en una sola operación.
+  -- La muestra crece por ronda para compensar los ya vendidos/reservados o bloqueados.
+  while v_need > 0 and v_round < 3 loop
+    v_round := v_round + 1;
+    v_sample := least(v_total, (v_need * 2 + 8) * (4 ^ (v_round - 1))::int);
+    with cand as (
+      select distinct (1 + floor(random() * v_total))::int::text as n
+      from generate_series(1, v_sample)
+    ), picked as (
+      select t.id
+      from tickets t
+      join cand on t.raffle_id = p_raffle_id and t.ticket_number = cand.n
+      where t.status = 'available'
+      limit v_need
+      for update of t skip locked
+    ), upd as (
+      update tickets t
+         set status = 'reserved', reserved_by = p_session_id, reserved_until = p_until
+      from picked
+      where t.id = picked.id
+      returning t.id
+    )
+    select array_agg(id) into v_ids from upd;
+
+    v_got := coalesce(array_length(v_ids, 1), 0);
+    if v_got > 0 then
+      return query select unnest(v_ids);
+    end if;
+    v_need := v_need - v_got;
+  end loop;
+
+  -- Rifa casi agotada: quedan pocos disponibles, se recorren directamente
+  while v_need > 0 loop
+    with picked as (
+      select id from tickets
+      where raffle_id = p_raffle_id and status = 'available'
+      order by random()
+      limit v_need
+      for update skip locked
+    ), upd as (
+      update tickets t
+         set status = 'reserved', reserved_by = p_session_id, reserved_until = p_until
+      from picked
+      where t.id = picked.id
+      returning t.id
+    )
+    select array_agg(id) into v_ids from upd;
+
+    v_got := coalesce(array_length(v_ids, 1), 0);
+    exit when v_got = 0;
+    return query select unnest(v_ids);
+    v_need := v_need - v_got;
+  end loop;
+end;
+$$;
+
+revoke all on function public.claim_random_tickets(uuid, uuid, int, timestamptz) from public, anon, authenticated;
+
+create or replace function public.ensure_and_reserve_random_tickets(
+  p_raffle_id uuid,
+  p_total int,
+  p_session_id uuid,
+  p_quantity int,
+  p_minutes int default 10
+) returns setof tickets
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_until timestamptz := now() + make_interval(mins => p_minutes);
+  v_ids uuid[];
+begin
+  perform ensure_session(p_session_id);
+  perform ensure_tickets_for_raffle(p_raffle_id, p_total);
+
+  -- Liberar reservas previas de la sesión en esta rifa (salvo las de pagos pendientes)
+  update tickets
+     set status = 'available', reserved_by = null, reserved_until = null
+   where reserved_by = p_session_id and raffle_id = p_raffle_id and status = 'reserved'
+     and not exists (
+       select 1 from payment_tickets pt
+       join payments p on p.id = pt.payment_id
+       where pt.ticket_id = tickets.id and p.status = 'pending'
+     );
+
+  select array_agg(id) into v_ids
+  from claim_random_tickets(p_raffle_id, p_session_id, p_quantity, v_until) as c(id);
+
+  return query
+  select t.* from tickets t
+  where t.id = any(coalesce(v_ids, array[]::uuid[]))
+  order by t.ticket_number::int;
+end;
+$$;
+
+grant execute on function public.ensure_and_reserve_random_tickets(uuid, int, uuid, int, int) to anon, authenticated;
@@ -0,0 +1,147 @@
+-- Patch: reservas en lote para carritos con varias rifas (POST /reservations/batch)
+-- Un solo RPC recibe operaciones heterogéneas y devuelve un resultado por ítem:
+--   {"type":"ids","ticket_ids":[...]}                   -> reservar números elegidos
+--   {"type":"random","raffle_id":"...","quantity":N}    -> reservar N al azar
+-- p_atomic = true: todo o nada (si un ítem no se completa, no queda ninguna reserva).
+-- p_atomic = false: best-effort, cada ítem se aplica por separado.
+--
+-- A diferencia de reserve_tickets / ensure_and_reserve_random_tickets, el lote es aditivo:
+-- no libera otras reservas de la sesión (varias operaciones del mismo carrito sobre la
+-- misma rifa se pisarían entre sí). Las reservas propias incluidas se renuevan.
+-- Requiere patch_reserve_random_set_based.sql (claim_random_tickets).
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+create or replace function public.reserve_tickets_batch(
+  p_session_id uuid,
+  p_items jsonb,
+  p_minutes int default 10,
+  p_atomic boolean default false
+) returns jsonb
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_until timestamptz := now() + make_interval(mins => greatest(1, coalesce(p_minutes, 10)));
+  v_item jsonb;
+  v_idx int := 0;
+  v_results jsonb := '[]'::jsonb;
+  v_result jsonb;
+  v_ids uuid[];
+  v_raffle_id uuid;
+  v_quantity int;
+  v_total int;
+  v_reserved jsonb;
+  v_count int;
+  v_all_ok boolean := true;
+begin
+  perform ensure_session(p_session_id);
+
+  begin
+    for v_item in select value from jsonb_array_elements(coalesce(p_items, '[]'::jsonb))
+    loop
+      v_reserved := '[]'::jsonb;
+      v_count := 0;
+      v_raffle_id := null;
+      v_quantity := 0;
+      begin
+        if v_item->>'type' = 'ids' then
+          select coalesce(array_agg(x::uuid), array[]::uuid[]) into v_ids
+          from jsonb_array_elements_text(coalesce(v_item->'ticket_ids', '[]'::jsonb)) x;
+          v_quantity := coalesce(array_length(v_ids, 1), 0);
+
+          if exists (
+            select 1 from tickets t join raffles r on r.id = t.raffle_id
+            where t.id = any(v_ids) and coalesce(r.allow_manual, true) = false
+          ) then
+            raise exception 'manual_selection_disabled';
+          end if;
+
+          with picked as (
+            select id from tickets
+            where id = any(v_ids)
+              and (status = 'available' or (status = 'reserved' and reserved_by = p_session_id))
+            order by id
+            for update skip locked
+          ), upd as (
+            update tickets t
+               set status = 'reserved', reserved_by = p_session_id, reserved_until = v_until
+            from picked
+            where t.id = picked.id
+            returning t.id, t.raffle_id, t.ticket_number
+          )
+          select coalesce(jsonb_agg(jsonb_build_object('id', id, 'raffle_id', raffle_id, 'ticket_number', ticket_number)), '[]'::jsonb), count(*)
+            into v_reserved, v_count
+          from upd;
+
+        elsif v_item->>'type' = 'random' then
+          v_raffle_id := (v_item->>'raffle_id')::uuid;
+          v_quantity := greatest(0, coalesce((v_item->>'quantity')::int, 0));
+          select r.total_tickets into v_total from raffles r where r.id = v_raffle_id;
+          if v_total is null then
+            raise exception 'raffle_not_found';
+          end if;
+
+          perform ensure_tickets_for_raffle(v_raffle_id, v_total);
+          -- En dos sentencias: los tickets que inserta claim_random_tickets (rifas gratis)
+          -- no son visibles en el snapshot de la misma sentencia
+          select coalesce(array_agg(c.id), array[]::uuid[]) into v_ids
+          from claim_random_tickets(v_raffle_id, p_session_id, v_quantity, v_until) as c(id);
+          select coalesce(jsonb_agg(jsonb_build_object('id', t.id, 'raffle_id', t.raffle_id, 'ticket_number', t.ticket_number)), '[]'::jsonb), count(*)
+            into v_reserved, v_count
+          from tickets t where t.id = any(v_ids);
+        else
+          raise exception 'invalid_item_type';
+        end if;
+
+        v_result := jsonb_build_object(
+          'index', v_idx, 'type', v_item->>'type', 'raffle_id', v_raffle_id,
+          'requested', v_quantity, 'reserved', v_reserved,
+          'ok', v_count = v_quantity and v_quantity > 0,
+          'error', case when v_count = v_quantity and v_quantity > 0 then null else 'not_enough_available' end
+        );
+      exception when others then
+        -- best-effort: este ítem se deshace solo (subtransacción del bloque)
+        v_result := jsonb_build_object(
+          'index', v_idx, 'type', v_item->>'type', 'raffle_id', v_raffle_id,
+          'requested', v_quantity, 'reserved', '[]'::jsonb, 'ok', false, 'error', sqlerrm
+        );
+      end;
+
+      v_all_ok := v_all_ok and (v_result->>'ok')::boolean;
+      v_results := v_results || v_result;
+      v_idx := v_idx + 1;
+
+      if p_atomic and not v_all_ok then
+        raise exception 'batch_incomplete' using errcode = 'P0001';
+      end if;
+    end loop;
+  exception when sqlstate 'P0001' then
+    if sqlerrm <> 'batch_incomplete' then
+      raise;
+    end if;
+    -- todo o nada: se revierte todo el lote; los ítems ya aplicados quedan sin reservas
+    select coalesce(jsonb_agg(
+             r || jsonb_build_object('reserved', '[]'::jsonb, 'ok', false,
+                                     'error', coalesce(r->>'error', 'rolled_back'))
+           ), '[]'::jsonb)
+      into v_results
+    from jsonb_array_elements(v_results) r;
+    -- ítems posteriores al fallo no se llegaron a intentar
+    select v_results || coalesce(jsonb_agg(jsonb_build_object(
+             'index', e.ord - 1, 'type', e.value->>'type', 'raffle_id', e.value->>'raffle_id',
+             'requested', coalesce(jsonb_array_length(e.value->'ticket_ids'), (e.value->>'quantity')::int, 0),
+             'reserved', '[]'::jsonb, 'ok', false, 'error', 'skipped'
+           ) order by e.ord), '[]'::jsonb)
+      into v_results
+    from jsonb_array_elements(p_items) with ordinality e(value, ord)
+    where e.ord > v_idx;
+  end;
+
+  return jsonb_build_object('ok', v_all_ok, 'atomic', coalesce(p_atomic, false), 'items', v_results);
+end;
+$$;
+
+grant execute on function public.reserve_tickets_batch(uuid, jsonb, int, boolean) to anon, authenticated;
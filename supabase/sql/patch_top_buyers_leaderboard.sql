@@ -0,0 +1,315 @@
+-- Patch: ranking de top compradores materializado (raffle_top_buyers)
+-- top_buyers_for_raffle agregaba en cada llamada todos los pagos aprobados de la rifa
+-- con sus payment_tickets (más una subconsulta de instagram por comprador): con decenas
+-- de miles de pagos cada visita a la página de la rifa recorría todo.
+--
+-- Ahora hay una fila por (rifa, email) con los mismos campos que devolvía la función,
+-- mantenida por triggers sobre payments y payment_tickets: cubre approve_payment,
+-- reject_payment, los lotes approve_payments / reject_payments y cambios hechos a mano
+-- desde el panel. Cada cambio recalcula solo las filas de los compradores afectados en
+-- esa rifa (usa idx_payments_raffle_email), no la rifa entera. top_buyers_for_raffle mantiene firma,
+-- columnas y orden, y lee de la tabla.
+--
+-- Al aplicarlo se llena la tabla con los pagos existentes (bloquea escrituras en
+-- payments mientras tanto; con muchos pagos, ejecutarlo fuera de horas de venta).
+-- Para reconstruir una rifa si hiciera falta:  select refresh_raffle_top_buyers('<rifa>');
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+create table if not exists public.raffle_top_buyers (
+  raffle_id uuid not null references public.raffles(id) on delete cascade,
+  buyer_email text not null,
+  tickets bigint not null,
+  payments_count bigint not null,
+  first_payment timestamptz,
+  last_payment timestamptz,
+  instagram text,
+  updated_at timestamptz not null default now(),
+  primary key (raffle_id, buyer_email)
+);
+
+-- Top N de una rifa en el orden del ranking sin ordenar
+create index if not exists idx_raffle_top_buyers_rank
+  on public.raffle_top_buyers (raffle_id, tickets desc, last_payment desc);
+
+-- Recalcular un comprador sin recorrer todos los pagos de la rifa
+create index if not exists idx_payments_raffle_email
+  on public.payments (raffle_id, email, created_at desc);
+
+-- Solo se lee a través de top_buyers_for_raffle (security definer)
+alter table public.raffle_top_buyers enable row level security;
+revoke all on table public.raffle_top_buyers from public, anon, authenticated;
+
+-- Recalcula la fila de un comprador desde payments/payment_tickets (la borra si ya no
+-- tiene pagos aprobados con tickets). Mismas reglas que la versión anterior de
+-- top_buyers_for_raffle.
+create or replace function public.refresh_raffle_top_buyer(p_raffle_id uuid, p_email text)
+returns void
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_tickets bigint;
+  v_payments bigint;
+  v_first timestamptz;
+  v_last timestamptz;
+  v_instagram text;
+begin
+  if p_raffle_id is null or p_email is null then
+    return;
+  end if;
+  -- Dos transacciones que cambian pagos del mismo comprador se turnan: la segunda
+  -- recalcula después del commit de la primera y ve sus cambios (read committed)
+  perform pg_advisory_xact_lock(hashtextextended('raffle_top_buyers:' || p_raffle_id::text || ':' || p_email, 0));
+
+  -- Filtra por status en el join y no en el where: así el plan siempre va por
+  -- idx_payments_raffle_email (con estadísticas viejas, p. ej. durante un
+  -- approve_payments grande, el planner prefería idx_payments_raffle_status y
+  -- recorría todos los aprobados de la rifa por cada pago)
+  select count(pt.ticket_id), count(distinct pt.payment_id),
+         min(p.created_at) filter (where pt.payment_id is not null),
+         max(p.created_at) filter (where pt.payment_id is not null)
+    into v_tickets, v_payments, v_first, v_last
+    from payments p
+    left join payment_tickets pt on p.status = 'approved' and pt.payment_id = p.id
+   where p.raffle_id = p_raffle_id
+     and p.email = p_email;
+
+  if v_tickets = 0 then
+    delete from raffle_top_buyers where raffle_id = p_raffle_id and buyer_email = p_email;
+    return;
+  end if;
+
+  -- Último instagram de ese email en la rifa (de cualquier pago, como antes)
+  select coalesce(p.instagram_user, p.instagram) into v_instagram
+    from payments p
+   where p.raffle_id = p_raffle_id
+     and p.email = p_email
+     and coalesce(p.instagram_user, p.instagram) is not null
+   order by p.created_at desc
+   limit 1;
+
+  insert into raffle_top_buyers as t
+    (raffle_id, buyer_email, tickets, payments_count, first_payment, last_payment, instagram, updated_at)
+  values (p_raffle_id, p_email, v_tickets, v_payments, v_first, v_last, v_instagram, now())
+  on conflict (raffle_id, buyer_email) do update
+     set tickets = excluded.tickets,
+         payments_count = excluded.payments_count,
+         first_payment = excluded.first_payment,
+         last_payment = excluded.last_payment,
+         instagram = excluded.instagram,
+         updated_at = excluded.updated_at;
+end;
+$$;
+
+revoke all on function public.refresh_raffle_top_buyer(uuid, text) from public, anon, authenticated;
+
+-- Triggers por sentencia con tablas de transición: un approve_payments de miles de pagos
+-- recalcula cada comprador una vez, no una vez por pago. Las claves se recorren
+-- ordenadas para tomar los advisory locks siempre en el mismo orden.
+create or replace function public.trg_payments_top_buyers()
+returns trigger
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  r record;
+begin
+  if tg_op = 'INSERT' then
+    -- Un pago nuevo (pending) solo importa si trae instagram para un comprador que ya
+    -- está en el ranking; create_payment no paga el recálculo
+    for r in
+      select distinct n.raffle_id, n.email
+        from new_rows n
+       where n.raffle_id is not null and n.email is not null
+         and (n.status = 'approved'
+              or (coalesce(n.instagram_user, n.instagram) is not null
+                  and exists (select 1 from raffle_top_buyers t
+                               where t.raffle_id = n.raffle_id and t.buyer_email = n.email)))
+       order by 1, 2
+    loop
+      perform refresh_raffle_top_buyer(r.raffle_id, r.email);
+    end loop;
+
+  elsif tg_op = 'DELETE' then
+    for r in
+      select distinct o.raffle_id, o.email
+        from old_rows o
+       where o.raffle_id is not null and o.email is not null
+         and (o.status = 'approved' or coalesce(o.instagram_user, o.instagram) is not null)
+       order by 1, 2
+    loop
+      perform refresh_raffle_top_buyer(r.raffle_id, r.email);
+    end loop;
+
+  else
+    -- UPDATE: solo los cambios que afectan el ranking; si cambió la rifa o el email
+    -- se recalculan las dos filas
+    for r in
+      select distinct k.raffle_id, k.email
+        from new_rows n
+        join old_rows o on o.id = n.id
+        cross join lateral (values (n.raffle_id, n.email), (o.raffle_id, o.email)) k(raffle_id, email)
+       where k.raffle_id is not null and k.email is not null
+         and ((o.status = 'approved') is distinct from (n.status = 'approved')
+              or o.raffle_id is distinct from n.raffle_id
+              or o.email is distinct from n.email
+              or o.created_at is distinct from n.created_at
+              or o.instagram_user is distinct from n.instagram_user
+              or o.instagram is distinct from n.instagram)
+       order by 1, 2
+    loop
+      perform refresh_raffle_top_buyer(r.raffle_id, r.email);
+    end loop;
+  end if;
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_payments_top_buyers_ins on public.payments;
+create trigger trg_payments_top_buyers_ins
+  after insert on public.payments
+  referencing new table as new_rows
+  for each statement
+  execute procedure public.trg_payments_top_buyers();
+
+drop trigger if exists trg_payments_top_buyers_upd on public.payments;
+create trigger trg_payments_top_buyers_upd
+  after update on public.payments
+  referencing old table as old_rows new table as new_rows
+  for each statement
+  execute procedure public.trg_payments_top_buyers();
+
+drop trigger if exists trg_payments_top_buyers_del on public.payments;
+create trigger trg_payments_top_buyers_del
+  after delete on public.payments
+  referencing old table as old_rows
+  for each statement
+  execute procedure public.trg_payments_top_buyers();
+
+-- Tickets agregados/quitados de un pago ya aprobado (raro, p. ej. corrección manual)
+create or replace function public.trg_payment_tickets_top_buyers()
+returns trigger
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  r record;
+begin
+  if tg_op = 'INSERT' then
+    for r in
+      select distinct p.raffle_id, p.email
+        from new_rows c join payments p on p.id = c.payment_id
+       where p.status = 'approved' and p.raffle_id is not null and p.email is not null
+       order by 1, 2
+    loop
+      perform refresh_raffle_top_buyer(r.raffle_id, r.email);
+    end loop;
+  else
+    for r in
+      select distinct p.raffle_id, p.email
+        from old_rows c join payments p on p.id = c.payment_id
+       where p.status = 'approved' and p.raffle_id is not null and p.email is not null
+       order by 1, 2
+    loop
+      perform refresh_raffle_top_buyer(r.raffle_id, r.email);
+    end loop;
+  end if;
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_payment_tickets_top_buyers_ins on public.payment_tickets;
+create trigger trg_payment_tickets_top_buyers_ins
+  after insert on public.payment_tickets
+  referencing new table as new_rows
+  for each statement
+  execute procedure public.trg_payment_tickets_top_buyers();
+
+drop trigger if exists trg_payment_tickets_top_buyers_del on public.payment_tickets;
+create trigger trg_payment_tickets_top_buyers_del
+  after delete on public.payment_tickets
+  referencing old table as old_rows
+  for each statement
+  execute procedure public.trg_payment_tickets_top_buyers();
+
+-- Reconstruye el ranking completo de una rifa (o de todas con null)
+create or replace function public.refresh_raffle_top_buyers(p_raffle_id uuid default null)
+returns bigint
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $$
+declare
+  v_rows bigint;
+begin
+  delete from raffle_top_buyers where p_raffle_id is null or raffle_id = p_raffle_id;
+
+  insert into raffle_top_buyers
+    (raffle_id, buyer_email, tickets, payments_count, first_payment, last_payment, instagram)
+  select a.raffle_id, a.email, a.tickets, a.payments_count, a.first_payment, a.last_payment, ig.instagram
+    from (
+      select p.raffle_id, p.email,
+             count(pt.ticket_id) as tickets,
+             count(distinct p.id) as payments_count,
+             min(p.created_at) as first_payment,
+             max(p.created_at) as last_payment
+        from payments p
+        join payment_tickets pt on pt.payment_id = p.id
+       where p.status = 'approved'
+         and p.email is not null
+         and (p_raffle_id is null or p.raffle_id = p_raffle_id)
+       group by p.raffle_id, p.email
+    ) a
+    left join lateral (
+      select coalesce(p2.instagram_user, p2.instagram) as instagram
+        from payments p2
+       where p2.raffle_id = a.raffle_id
+         and p2.email = a.email
+         and coalesce(p2.instagram_user, p2.instagram) is not null
+       order by p2.created_at desc
+       limit 1
+    ) ig on true;
+  get diagnostics v_rows = row_count;
+  return v_rows;
+end;
+$$;
+
+revoke all on function public.refresh_raffle_top_buyers(uuid) from public, anon, authenticated;
+
+-- Misma firma y columnas que antes; ahora lee el ranking ya calculado
+create or replace function public.top_buyers_for_raffle(
+  p_raffle_id uuid,
+  p_limit int default 20
+) returns table(
+  buyer_email text,
+  tickets bigint,
+  payments_count bigint,
+  first_payment timestamptz,
+  last_payment timestamptz,
+  instagram text
+)
+language sql
+stable
+security definer
+set search_path = public, pg_temp
+as $$
+  select t.buyer_email, t.tickets, t.payments_count, t.first_payment, t.last_payment, t.instagram
+    from raffle_top_buyers t
+   where t.raffle_id = p_raffle_id
+   order by t.tickets desc, t.last_payment desc
+   limit p_limit;
+$$;
+
+grant execute on function public.top_buyers_for_raffle(uuid, int) to anon, authenticated;
+
+-- Llenado inicial con los pagos existentes; el lock evita perder aprobaciones que
+-- ocurran mientras se reconstruye
+begin;
+lock table public.payments, public.payment_tickets in share row exclusive mode;
+select public.refresh_raffle_top_buyers(null) as top_buyers_rows;
+commit;
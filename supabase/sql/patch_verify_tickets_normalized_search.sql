@@ -0,0 +1,113 @@
+-- Patch: búsqueda indexada para verify_tickets (email y cédula normalizados)
+-- Antes: ilike '%q%' sobre payments.email / payments.ci => full scan de payments en cada consulta.
+-- Ahora:
+--   * payments.email_norm = lower(trim(email))
+--   * payments.ci_digits  = solo dígitos de ci ("V-22.321.331" -> "22321331")
+--   mantenidas por trigger, con índices btree (match exacto) y trigram GIN (subcadena).
+--   * verify_tickets usa esas columnas; la consulta también se normaliza, así que
+--     "V-22321331" y "22321331" encuentran el mismo pago sin reintentos desde la API.
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+create extension if not exists pg_trgm;
+
+alter table public.payments
+  add column if not exists email_norm text,
+  add column if not exists ci_digits text;
+
+create or replace function public.payments_normalize_search()
+returns trigger
+language plpgsql
+set search_path = public, pg_temp
+as $$
+begin
+  NEW.email_norm := nullif(lower(btrim(NEW.email)), '');
+  NEW.ci_digits := nullif(regexp_replace(coalesce(NEW.ci, ''), '[^0-9]', '', 'g'), '');
+  return NEW;
+end;
+$$;
+
+drop trigger if exists trg_payments_normalize_search on public.payments;
+create trigger trg_payments_normalize_search
+before insert or update of email, ci
+on public.payments
+for each row
+execute function public.payments_normalize_search();
+
+-- Backfill de filas existentes (solo las que difieren)
+update public.payments
+   set email_norm = nullif(lower(btrim(email)), ''),
+       ci_digits = nullif(regexp_replace(coalesce(ci, ''), '[^0-9]', '', 'g'), '')
+ where email_norm is distinct from nullif(lower(btrim(email)), '')
+    or ci_digits is distinct from nullif(regexp_replace(coalesce(ci, ''), '[^0-9]', '', 'g'), '');
+
+-- Match exacto (email completo / cédula completa): btree
+create index if not exists idx_payments_email_norm on public.payments (email_norm);
+create index if not exists idx_payments_ci_digits on public.payments (ci_digits);
+-- Subcadena (like '%q%'): trigram GIN
+create index if not exists idx_payments_email_norm_trgm on public.payments using gin (email_norm gin_trgm_ops);
+create index if not exists idx_payments_ci_digits_trgm on public.payments using gin (ci_digits gin_trgm_ops);
+-- payment_tickets(payment_id, ticket_id) ya es PK; el join a tickets usa tickets.id
+
+drop function if exists public.verify_tickets(text, boolean);
+
+create or replace function public.verify_tickets(
+  p_query text,
+  p_include_pending boolean default true
+) returns table (
+  raffle_id uuid,
+  raffle_name text,
+  ticket_id uuid,
+  ticket_number text,
+  ticket_status ticket_status,
+  payment_id uuid,
+  payment_status payment_status,
+  created_at timestamptz
+)
+language sql
+stable
+security definer
+set search_path = public, pg_temp
+as $$
+  with q as (
+    select
+      -- Escapar comodines de LIKE para que '%' o '_' en la consulta sean literales
+      nullif(replace(replace(replace(lower(btrim(p_query)), '\', '\\'), '%', '\%'), '_', '\_'), '') as email_q,
+      -- Solo si la consulta tiene forma de cédula (prefijo V/E/J/G/P opcional, dígitos,
+      -- puntos, guiones): así un email con números no coincide con cédulas ajenas
+      case when p_query ~ '^\s*[VvEeJjGgPp]?[\s.-]*[0-9][0-9\s.-]*$'
+           then nullif(regexp_replace(p_query, '[^0-9]', '', 'g'), '')
+      end as ci_q
+  ),
+  matched as materialized (
+    -- Un solo paso sobre payments usando los índices trigram (BitmapOr email/ci)
+    select p.id, p.status, p.created_at
+    from payments p, q
+    where (
+      p.email_norm like '%' || q.email_q || '%'
+      or p.ci_digits like '%' || q.ci_q || '%'
+    )
+    and (
+      p.status = 'approved'
+      or (p_include_pending and p.status in ('pending','underpaid','overpaid','ref_mismatch'))
+    )
+  )
+  -- Estados visibles: published, selling, drawn (ajusta esta lista si quieres menos o más)
+  select r.id as raffle_id,
+         r.name as raffle_name,
+         t.id as ticket_id,
+         t.ticket_number,
+         t.status as ticket_status,
+         p.id as payment_id,
+         p.status as payment_status,
+         p.created_at
+  from matched p
+  join payment_tickets pt on pt.payment_id = p.id
+  join tickets t on t.id = pt.ticket_id
+  join raffles r on r.id = t.raffle_id
+  where r.status in ('published','selling','drawn')
+  order by p.created_at desc, r.name asc, t.ticket_number asc;
+$$;
+
+grant execute on function public.verify_tickets(text, boolean) to anon, authenticated;
@@ -0,0 +1,107 @@
+-- Patch: paginación por cursor (keyset) en verify_tickets
+-- Antes: verify_tickets devolvía todas las filas de la búsqueda en una sola respuesta;
+-- revendedores y compradores grandes (miles de tickets) recibían varios MB de JSON.
+-- Ahora acepta, opcionales:
+--   * p_limit: máximo de filas a devolver (null = todas, como antes);
+--   * p_after_created_at, p_after_raffle_name, p_after_ticket_number, p_after_ticket_id:
+--     la última fila de la página anterior; devuelve solo las que van después.
+-- El orden es el de siempre (created_at desc, raffle_name, ticket_number) más ticket_id
+-- como desempate, así el cursor identifica una posición única y las páginas no se
+-- solapan ni saltan filas aunque entren pagos nuevos entre una y otra. Los pagos sin
+-- created_at van primero (nulls first, como antes); el cursor de una de esas filas
+-- llega con p_after_created_at null y el resto de los p_after_* con valor. Los pagos
+-- posteriores al cursor se descartan antes del join (matched), así cada página no
+-- vuelve a recorrer los tickets de las anteriores.
+-- Llamar con solo (p_query, p_include_pending) sigue funcionando igual.
+-- Requiere patch_verify_tickets_normalized_search.sql (email_norm / ci_digits).
+-- Idempotente: se puede ejecutar varias veces.
+
+set search_path = public;
+
+drop function if exists public.verify_tickets(text, boolean);
+drop function if exists public.verify_tickets(text, boolean, int, timestamptz, text, text, uuid);
+
+create or replace function public.verify_tickets(
+  p_query text,
+  p_include_pending boolean default true,
+  p_limit int default null,
+  p_after_created_at timestamptz default null,
+  p_after_raffle_name text default null,
+  p_after_ticket_number text default null,
+  p_after_ticket_id uuid default null
+) returns table (
+  raffle_id uuid,
+  raffle_name text,
+  ticket_id uuid,
+  ticket_number text,
+  ticket_status ticket_status,
+  payment_id uuid,
+  payment_status payment_status,
+  created_at timestamptz
+)
+language sql
+stable
+security definer
+set search_path = public, pg_temp
+as $$
+  with q as (
+    select
+      -- Escapar comodines de LIKE para que '%' o '_' en la consulta sean literales
+      nullif(replace(replace(replace(lower(btrim(p_query)), '\', '\\'), '%', '\%'), '_', '\_'), '') as email_q,
+      -- Solo si la consulta tiene forma de cédula (prefijo V/E/J/G/P opcional, dígitos,
+      -- puntos, guiones): así un email con números no coincide con cédulas ajenas
+      case when p_query ~ '^\s*[VvEeJjGgPp]?[\s.-]*[0-9][0-9\s.-]*$'
+           then nullif(regexp_replace(p_query, '[^0-9]', '', 'g'), '')
+      end as ci_q
+  ),
+  matched as materialized (
+    -- Un solo paso sobre payments usando los índices trigram (BitmapOr email/ci)
+    select p.id, p.status, p.created_at
+    from payments p, q
+    where (
+      p.email_norm like '%' || q.email_q || '%'
+      or p.ci_digits like '%' || q.ci_q || '%'
+    )
+    and (
+      p.status = 'approved'
+      or (p_include_pending and p.status in ('pending','underpaid','overpaid','ref_mismatch'))
+    )
+    -- Páginas siguientes: los pagos más nuevos que el cursor ya se devolvieron
+    and (p_after_created_at is null or p.created_at <= p_after_created_at)
+  )
+  -- Estados visibles: published, selling, drawn (ajusta esta lista si quieres menos o más)
+  select r.id as raffle_id,
+         r.name as raffle_name,
+         t.id as ticket_id,
+         t.ticket_number,
+         t.status as ticket_status,
+         p.id as payment_id,
+         p.status as payment_status,
+         p.created_at
+  from matched p
+  join payment_tickets pt on pt.payment_id = p.id
+  join tickets t on t.id = pt.ticket_id
+  join raffles r on r.id = t.raffle_id
+  where r.status in ('published','selling','drawn')
+    and (
+      -- Sin cursor: desde el principio
+      (p_after_created_at is null and p_after_raffle_name is null
+       and p_after_ticket_number is null and p_after_ticket_id is null)
+      -- Cursor en una fila sin created_at: el resto de esas filas y todas las fechadas
+      or (p_after_created_at is null and (
+        p.created_at is not null
+        or (r.name, t.ticket_number, t.id)
+           > (coalesce(p_after_raffle_name, ''), coalesce(p_after_ticket_number, ''), coalesce(p_after_ticket_id, '00000000-0000-0000-0000-000000000000'::uuid))
+      ))
+      or p.created_at < p_after_created_at
+      or (
+        p.created_at = p_after_created_at
+        and (r.name, t.ticket_number, t.id)
+            > (coalesce(p_after_raffle_name, ''), coalesce(p_after_ticket_number, ''), coalesce(p_after_ticket_id, '00000000-0000-0000-0000-000000000000'::uuid))
+      )
+    )
+  order by p.created_at desc nulls first, r.name asc, t.ticket_number asc, t.id asc
+  limit p_limit;
+$$;
+
+grant execute on function public.verify_tickets(text, boolean, int, timestamptz, text, text, uuid) to anon, authenticated;